@@ -0,0 +1,238 @@
+import sys
+import os
+import io
+import json
+import time
+import random
+import argparse
+import tempfile
+import platform
+import contextlib
+import statistics
+
+import textpress
+
+# Offline benchmark for textpress.py. Every model call is answered by
+# textpress.FakeBackend, so the timings measure the script's own overhead plus
+# whatever latency the fake is configured to simulate.
+
+SIZES = {'small': 100, 'medium': 1000, 'large': 10000}
+FORMAT_EXTENSIONS = {'JSON': '.json', 'YAML': '.yaml', 'JavaScript': '.js', 'PlainText': '.txt'}
+
+WORDS = (
+    "the quick brown fox jumps over lazy dog user account settings profile message "
+    "notification error warning please try again later your changes have been saved "
+    "successfully unable to connect server request timed out welcome back you have new"
+).split()
+
+def random_sentence(rng, min_words=3, max_words=14):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))).capitalize() + '.'
+
+def random_identifier(rng):
+    return rng.choice(['btn', 'nav', 'user', 'item', 'api']) + '_' + rng.choice(['primary', 'id', 'key', 'url']) + str(rng.randint(0, 99))
+
+def random_value(rng):
+    # Mostly prose, with identifiers and a share of repeated sentences as in real resource files
+    roll = rng.random()
+    if roll < 0.2:
+        return random_identifier(rng)
+    if roll < 0.35:
+        return "Something went wrong, please try again later."
+    return random_sentence(rng)
+
+def generate_json_corpus(count, seed=0):
+    rng = random.Random(seed)
+    sections = {}
+    for i in range(count):
+        sections.setdefault(f"section_{i // 20}", {})[f"key_{i}"] = random_value(rng)
+    return json.dumps({'version': 1, 'strings': sections}, indent=2, ensure_ascii=False)
+
+def generate_yaml_corpus(count, seed=0):
+    rng = random.Random(seed)
+    lines = ['version: 1', 'strings:']
+    for i in range(count):
+        if i % 20 == 0:
+            lines.append(f"  section_{i // 20}:")
+        value = random_value(rng)
+        style = rng.random()
+        if style < 0.5:
+            lines.append(f"    key_{i}: {json.dumps(value)}")
+        elif style < 0.8:
+            lines.append(f"    key_{i}: '{value}'")
+        else:
+            lines.append(f"    key_{i}: |\n      {value}")
+    return '\n'.join(lines) + '\n'
+
+def generate_javascript_corpus(count, seed=0):
+    # Quoted strings and template literals among comments, regex literals and
+    # divisions, all of which the esprima tokenizer can also read
+    rng = random.Random(seed)
+    lines = ['// Generated benchmark corpus', 'export const messages = {']
+    for i in range(count):
+        quote = rng.choice(['"', "'", '`'])
+        value = random_value(rng).replace(quote, '')
+        if i % 10 == 0:
+            lines.append(f"  // Section {i // 10}: don't translate keys")
+        if i % 25 == 0:
+            lines.append(f"  pattern{i}: /[\"'`]+\\/x/g, ratio{i}: {i} / 2 / total,")
+        lines.append(f"  key{i}: {quote}{value}{quote},")
+    lines.append('};')
+    lines.append('export function render(el) { return el.querySelector(".item").textContent; }')
+    return '\n'.join(lines) + '\n'
+
+def generate_plaintext_corpus(count, seed=0):
+    rng = random.Random(seed)
+    return '\n'.join(f'The dialog says "{random_value(rng)}" when the user clicks.' for _ in range(count)) + '\n'
+
+GENERATORS = {
+    'JSON': generate_json_corpus,
+    'YAML': generate_yaml_corpus,
+    'JavaScript': generate_javascript_corpus,
+    'PlainText': generate_plaintext_corpus,
+}
+
+EXTRACTORS = {
+    'JSON': textpress.extract_strings_from_json,
+    'YAML': textpress.extract_strings_from_yaml,
+    'JavaScript': textpress.extract_strings_from_javascript,
+    'PlainText': textpress.extract_strings_with_regex,
+}
+
+def load_esprima():
+    # The tokenizer the scanner replaced; compared against when it is installed
+    try:
+        import esprima
+        return esprima
+    except ImportError:
+        return None
+
+def measure(func, repeat):
+    # Runs func repeat times with its output suppressed; returns timing stats and the last result
+    timings = []
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - start)
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'max': max(timings),
+        'runs': repeat,
+    }, result
+
+def benchmark_format(format_name, size_name, count, options, workdir):
+    content = GENERATORS[format_name](count, options.seed)
+    backend = textpress.FakeBackend(options.latency, options.error_rate, options.ratio, options.seed)
+    textpress.set_completion_backend(backend)
+    model = 'fake'
+    results = {'format': format_name, 'size': size_name, 'strings_generated': count, 'content_chars': len(content)}
+
+    timing, (strings, positions) = measure(lambda: EXTRACTORS[format_name](content), options.repeat)
+    results['extract'] = timing
+    results['strings_extracted'] = len(strings)
+    if format_name == 'JavaScript' and load_esprima() is not None:
+        results['extract_esprima'], _ = measure(lambda: textpress.extract_strings_from_javascript_esprima(content), options.repeat)
+
+    timing, decisions = measure(
+        lambda: textpress.classify_strings(strings, format_name, model, 0.2, max_workers=options.concurrency),
+        options.repeat
+    )
+    results['classify'] = timing
+    selected = [string for string, decision in zip(strings, decisions) if decision]
+    selected_positions = [position for position, decision in zip(positions, decisions) if decision]
+    results['strings_selected'] = len(selected)
+
+    timing, compressed = measure(
+        lambda: textpress.compress_strings(
+            selected, format_name, 'software', '', False, model, options.compression_level, 0.2,
+            max_workers=options.concurrency, sampling=options.sampling, refine=options.refine,
+            packed_batch_size=options.pack_batch_size
+        ),
+        options.repeat
+    )
+    results['compress'] = timing
+    compressed_strings = compressed[0]
+    results['compression_requests'] = sum(compressed[1])
+
+    timing, _ = measure(
+        lambda: textpress.replace_strings_in_content_by_positions(
+            content, selected_positions, selected, compressed_strings, format_name
+        ),
+        options.repeat
+    )
+    results['replace'] = timing
+
+    input_file = os.path.join(workdir, f"{size_name}{FORMAT_EXTENSIONS[format_name]}")
+    output_file = os.path.join(workdir, f"{size_name}_output{FORMAT_EXTENSIONS[format_name]}")
+    with open(input_file, 'w', encoding='utf-8') as f:
+        f.write(content)
+    args = textpress.parse_args([
+        input_file, output_file, '--non-interactive', '--no-cache', '--model', model,
+        '--compression-level', str(options.compression_level), '--field', 'software',
+        '--concurrency', str(options.concurrency), '--sampling', options.sampling,
+        '--pack-batch-size', str(options.pack_batch_size),
+    ] + (['--refine'] if options.refine else []))
+    with contextlib.redirect_stdout(io.StringIO()):
+        textpress.resolve_options(args, interactive=False)
+    results['end_to_end'], _ = measure(
+        lambda: textpress.process_file(input_file, output_file, args, textpress.RateLimiter(), None),
+        options.repeat
+    )
+    results['model_calls'] = backend.calls
+    return results
+
+def print_table(results):
+    phases = ['extract', 'classify', 'compress', 'replace', 'end_to_end']
+    print(f"{'format':<11} {'size':<7} {'strings':>8} " + ' '.join(f"{phase:>11}" for phase in phases))
+    for result in results:
+        timings = ' '.join(f"{result[phase]['median']:>10.4f}s" for phase in phases)
+        print(f"{result['format']:<11} {result['size']:<7} {result['strings_extracted']:>8} {timings}")
+    for result in results:
+        if 'extract_esprima' in result:
+            print(f"JavaScript extraction ({result['size']}): scanner {result['extract']['median']:.4f}s, "
+                  f"esprima {result['extract_esprima']['median']:.4f}s")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for textpress.py using a fake model backend")
+    parser.add_argument('--formats', nargs='+', default=list(GENERATORS), choices=list(GENERATORS))
+    parser.add_argument('--sizes', nargs='+', default=['small', 'medium'], choices=list(SIZES))
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated seconds per model call (default: 0)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of calls failing with a 429 (default: 0)")
+    parser.add_argument('--ratio', type=float, default=0.7, help="Length ratio of fake compressions (default: 0.7)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Concurrent requests (default: 4)")
+    parser.add_argument('--compression-level', type=int, default=3, help="Compression attempts per string (default: 3)")
+    parser.add_argument('--sampling', choices=['sequential', 'parallel'], default='sequential',
+                        help="Compression candidate sampling mode (default: sequential)")
+    parser.add_argument('--refine', action='store_true', help="Refine the best parallel candidate once more")
+    parser.add_argument('--pack-batch-size', type=int, default=0,
+                        help="Strings per packed compression request (default: 0, one string per request)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per measurement; the median is reported (default: 3)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for corpora and the fake backend (default: 0)")
+    parser.add_argument('--output', default='benchmark_results.json', help="Where to write JSON results")
+    return parser.parse_args(argv)
+
+def main():
+    options = parse_args()
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for format_name in options.formats:
+            for size_name in options.sizes:
+                print(f"Benchmarking {format_name} ({size_name})...", file=sys.stderr)
+                results.append(benchmark_format(format_name, size_name, SIZES[size_name], options, workdir))
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': vars(options),
+        'results': results,
+    }
+    with open(options.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print_table(results)
+    print(f"\nResults written to {options.output}")
+
+if __name__ == '__main__':
+    main()
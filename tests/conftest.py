@@ -0,0 +1,60 @@
+import os
+import sys
+import contextlib
+import io
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import textpress
+
+
+class RecordingBackend(textpress.FakeBackend):
+    # Fake model that records every text it is asked to compress and answers
+    # with the text minus the word " please", so tests can predict the output
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.texts = []
+
+    def compress(self, text):
+        self.texts.append(text)
+        return text.replace(' please', '')
+
+
+def compress_content(content, format_name, args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        modified_content, _ = textpress.compress_content(content, format_name, args, None, None)
+    return modified_content
+
+
+@pytest.fixture
+def make_args():
+    # Resolved options for a non-interactive run against the fake model
+    def make(*extra):
+        args = textpress.parse_args(['input.txt', '--non-interactive', '--no-cache', '--model', 'fake',
+                                     '--compression-level', '1'] + list(extra))
+        with contextlib.redirect_stdout(io.StringIO()):
+            textpress.resolve_options(args, interactive=False)
+        return args
+    return make
+
+
+@pytest.fixture
+def backend():
+    # Installs a fake model for the test and removes it afterwards
+    installed = []
+
+    def install(instance=None):
+        instance = instance or textpress.FakeBackend()
+        textpress.set_completion_backend(instance)
+        installed.append(instance)
+        return instance
+    yield install
+    textpress.set_completion_backend(None)
+    textpress.controller = textpress.RequestController()
+
+
+@pytest.fixture
+def recorder(backend):
+    return backend(RecordingBackend())
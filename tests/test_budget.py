@@ -0,0 +1,40 @@
+import pytest
+
+import textpress
+
+STRINGS = ['Your changes have been saved and will sync to every device shortly',
+           'Invite your teammates to collaborate on this project from the sharing menu']
+
+
+@pytest.fixture
+def spent_budget(monkeypatch):
+    # A budget that ran out before the work below started
+    monkeypatch.setattr(textpress, 'budget', textpress.RunBudget(token_limit=1))
+    textpress.budget.spend(1)
+    return textpress.budget
+
+
+def compress(function, *args, **kwargs):
+    return function(*args, 'JSON', '', '', False, 'fake', 5, 0.3, **kwargs)
+
+
+@pytest.mark.parametrize('sampling, refine', [('sequential', False), ('parallel', False), ('parallel', True)])
+def test_single_string_stops_after_the_cleared_attempt(backend, spent_budget, sampling, refine):
+    model = backend(textpress.FakeBackend())
+    shortest, attempts, _ = compress(textpress.compress_single_string, STRINGS[0], sampling=sampling, refine=refine)
+    assert (attempts, model.calls) == (1, 1)
+    assert len(shortest) < len(STRINGS[0])
+
+
+@pytest.mark.parametrize('sampling, refine', [('sequential', False), ('parallel', True)])
+def test_packed_strings_stop_after_the_cleared_round(backend, spent_budget, sampling, refine):
+    model = backend(textpress.FakeBackend())
+    results = compress(textpress.compress_packed_strings, STRINGS, sampling=sampling, refine=refine)
+    assert [attempts for _, attempts, _ in results] == [1, 1]
+    assert model.calls == 1
+
+
+def test_sequential_attempts_continue_within_budget(backend):
+    model = backend(textpress.FakeBackend(compression_ratio=0.9))
+    _, attempts, _ = compress(textpress.compress_single_string, STRINGS[0])
+    assert attempts == model.calls > 1
@@ -0,0 +1,83 @@
+import pytest
+
+import textpress
+
+
+@pytest.fixture
+def open_cache(tmp_path):
+    caches = []
+
+    def open_(**options):
+        cache = textpress.ResultCache(str(tmp_path / 'cache.sqlite3'), **options)
+        caches.append(cache)
+        return cache
+    yield open_
+    for cache in caches:
+        cache.connection.close()
+
+
+def test_hits_and_misses_are_counted(open_cache):
+    cache = open_cache()
+    key = textpress.ResultCache.make_key('compress', string='Hello')
+    assert cache.get(key) is None
+    cache.put(key, 'compress', 'Hi')
+    assert cache.get(key) == 'Hi'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_survive_reopening(open_cache):
+    key = textpress.ResultCache.make_key('classify', string='Hello')
+    open_cache().put(key, 'classify', True)
+    assert open_cache().get(key) is True
+
+
+def test_keys_depend_on_every_setting():
+    base = dict(string='Hello there', format_name='JSON', expert_field='', style_guide='', use_emojis=False,
+                model='fake', compression_level=3, temperature=0.2)
+    keys = {textpress.compression_cache_key(**base)}
+    for name, value in [('model', 'other'), ('compression_level', 4), ('temperature', 0.5), ('use_emojis', True)]:
+        keys.add(textpress.compression_cache_key(**{**base, name: value}))
+    keys.add(textpress.compression_cache_key(**base, sampling='parallel'))
+    keys.add(textpress.compression_cache_key(**base, packed=True))
+    assert len(keys) == 7
+    # Default sampling settings keep the keys of older cache entries
+    assert textpress.compression_cache_key(**base, sampling='sequential', refine=False) in keys
+
+
+def test_least_recently_used_entries_are_evicted_above_max_bytes(open_cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(textpress.time, 'time', lambda: now[0])
+    cache = open_cache(max_bytes=3 * (64 + 12), max_age_days=0)
+    keys = [textpress.ResultCache.make_key('compress', string=str(i)) for i in range(4)]
+    for key in keys:
+        now[0] += 1
+        cache.put(key, 'compress', 'x' * 10)
+    now[0] += 1
+    cache.get(keys[0])
+    cache.evict()
+    assert [cache.get(key) is not None for key in keys] == [True, False, True, True]
+
+
+def test_entries_unused_for_max_age_days_are_dropped(open_cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(textpress.time, 'time', lambda: now[0])
+    cache = open_cache(max_age_days=1)
+    old, recent = (textpress.ResultCache.make_key('compress', string=s) for s in ('old', 'recent'))
+    cache.put(old, 'compress', 'o')
+    now[0] += 86400 * 0.9
+    cache.put(recent, 'compress', 'r')
+    now[0] += 86400 * 0.2
+    cache.evict()
+    assert (cache.get(old), cache.get(recent)) == (None, 'r')
+
+
+def test_cached_compressions_make_no_calls(open_cache, backend):
+    model = backend(textpress.FakeBackend())
+    cache = open_cache()
+    strings = ['Please remember to save your work before closing the editor']
+    first = textpress.compress_strings(strings, 'JSON', '', '', False, 'fake', 2, 0.2, cache=cache)
+    calls = model.calls
+    second = textpress.compress_strings(strings, 'JSON', '', '', False, 'fake', 2, 0.2, cache=cache)
+    assert second[0] == first[0]
+    assert model.calls == calls
+    assert cache.hits == 1
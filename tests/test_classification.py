@@ -0,0 +1,70 @@
+import pytest
+
+import textpress
+
+SENTENCES = [f'This is sentence number {i} with enough words' for i in range(4)]
+KEYS = ['user_id', 'btn-primary', 'en_US', 'api.v2.token']
+
+
+class TruncatingBackend(textpress.FakeBackend):
+    # Answers batches of more than max_batch strings with cut-off JSON
+    def __init__(self, max_batch):
+        super().__init__()
+        self.max_batch = max_batch
+        self.batch_sizes = []
+
+    def __call__(self, prompt, *args):
+        answer = super().__call__(prompt, *args)
+        if 'Respond with a single JSON object mapping every index' in prompt:
+            size = answer.count('":')
+            self.batch_sizes.append(size)
+            if size > self.max_batch:
+                return answer[:len(answer) // 2]
+        return answer
+
+
+def classify(strings, **options):
+    return textpress.classify_strings(strings, 'JSON', 'fake', 0.2, **options)
+
+
+def test_batches_classify_every_string_in_order(backend):
+    model = backend(textpress.FakeBackend())
+    strings = [string for pair in zip(SENTENCES, KEYS) for string in pair]
+    assert classify(strings, batch_size=8) == [True, False] * 4
+    assert model.calls == 1
+
+
+def test_malformed_batches_are_split_until_they_parse(backend):
+    model = backend(TruncatingBackend(max_batch=2))
+    strings = SENTENCES + KEYS
+    assert classify(strings, batch_size=8) == [True] * 4 + [False] * 4
+    # 8 fails, both 4s fail, then four batches of 2 succeed
+    assert model.batch_sizes == [8, 4, 2, 2, 4, 2, 2]
+
+
+def test_single_strings_fall_back_to_one_question(backend):
+    model = backend(TruncatingBackend(max_batch=0))
+    assert classify(SENTENCES[:1] + KEYS[:1], batch_size=8) == [True, False]
+    assert model.batch_sizes == [2]
+    assert model.calls == 3
+
+
+@pytest.mark.parametrize('response', [
+    'Sure! Here you go.',
+    '{"0": "YES"}',
+    '{"0": "YES", "1": "MAYBE"}',
+    '["YES", "NO"]',
+])
+def test_incomplete_answers_are_rejected(response):
+    with pytest.raises(ValueError):
+        textpress.parse_classification_response(response, 2)
+
+
+def test_answers_tolerate_surrounding_text_and_case():
+    assert textpress.parse_classification_response('Answer: {"0": " yes", "1": "No"} done', 2) == [True, False]
+
+
+def test_batches_respect_item_and_token_limits():
+    strings = ['word ' * 40, 'short', 'short', 'short', 'word ' * 40]
+    assert textpress.make_batches(strings, 2, 10_000) == [[0, 1], [2, 3], [4]]
+    assert textpress.make_batches(strings, 10, 60) == [[0, 1, 2, 3], [4]]
@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+import textpress
+
+
+class ShortFirstBackend(textpress.FakeBackend):
+    # Shorter strings answer sooner, so requests finish in a different order
+    # from the one they were sent in
+    def __init__(self):
+        super().__init__()
+        self.finished = []
+
+    def compress(self, text):
+        time.sleep(0.002 * len(text.split()))
+        with self.lock:
+            self.finished.append(text)
+        return text.rsplit(' ', 1)[0]
+
+
+def compress_strings(strings, **options):
+    return textpress.compress_strings(strings, 'JSON', '', '', False, 'fake', 1, 0.3, **options)
+
+
+def test_results_stay_in_source_order(backend):
+    model = backend(ShortFirstBackend())
+    strings = [' '.join(f'word{i}' for i in range(count)) for count in (3, 12, 6, 20, 9, 15)]
+    compressed, attempts, _, _ = compress_strings(strings, max_workers=6)
+    assert model.finished != sorted(model.finished, key=strings.index)
+    assert compressed == [string.rsplit(' ', 1)[0] for string in strings]
+    assert attempts == [1] * len(strings)
+
+
+def test_failed_strings_keep_their_text(backend):
+    class FailingBackend(textpress.FakeBackend):
+        def compress(self, text):
+            if 'broken' in text:
+                raise RuntimeError('provider error')
+            return text.rsplit(' ', 1)[0]
+
+    backend(FailingBackend())
+    strings = ['a broken string that fails', 'a healthy string that works']
+    compressed, _, _, _ = compress_strings(strings, max_workers=2)
+    assert compressed == ['a broken string that fails', 'a healthy string that']
+
+
+class Flaky:
+    # Fails with the given errors first, then answers
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+@pytest.fixture
+def delays(monkeypatch):
+    slept = []
+    monkeypatch.setattr(textpress.time, 'sleep', slept.append)
+    monkeypatch.setattr(textpress.random, 'uniform', lambda low, high: 0)
+    return slept
+
+
+def test_rate_limits_back_off_exponentially(delays):
+    func = Flaky(*(textpress.FakeBackendError(429, 'Too Many Requests') for _ in range(3)))
+    retries_before = textpress.metrics.summary()['retries']
+    assert textpress.call_with_retry(func, kind='compress', base_delay=0.5) == 'ok'
+    assert func.calls == 4
+    assert delays == [0.5, 1.0, 2.0]
+    assert textpress.metrics.summary()['retries'] == retries_before + 3
+
+
+def test_retries_stop_at_max_retries(delays):
+    func = Flaky(*(textpress.FakeBackendError(429, 'rate limit') for _ in range(5)))
+    with pytest.raises(textpress.FakeBackendError):
+        textpress.call_with_retry(func, kind='compress', max_retries=2)
+    assert func.calls == 3
+
+
+def test_other_errors_are_not_retried(delays):
+    func = Flaky(ValueError('bad request'))
+    with pytest.raises(ValueError):
+        textpress.call_with_retry(func, kind='compress')
+    assert func.calls == 1
+    assert delays == []
+
+
+def test_rate_limiter_spaces_request_starts(monkeypatch):
+    now = [100.0]
+    slept = []
+    monkeypatch.setattr(textpress.time, 'time', lambda: now[0])
+    monkeypatch.setattr(textpress.time, 'sleep', slept.append)
+    limiter = textpress.RateLimiter(requests_per_minute=120)
+    for _ in range(3):
+        limiter.acquire()
+        limiter.release()
+    assert slept == [0.5, 1.0]
@@ -0,0 +1,39 @@
+import pytest
+
+import textpress
+
+
+@pytest.fixture
+def parse_with_config(tmp_path):
+    def parse(text, *extra):
+        config = tmp_path / 'textpress.yaml'
+        config.write_text(text)
+        return textpress.parse_args(['input.json', '--config', str(config)] + list(extra))
+    return parse
+
+
+@pytest.mark.parametrize('text', [
+    'creativity: 9',
+    'compression-level: true',
+    'sampling: fast',
+    'concurrency: many',
+    'emojis: 1',
+    'prose: chapters',
+    'model: [claude]',
+])
+def test_bad_config_values_are_rejected(parse_with_config, capsys, text):
+    with pytest.raises(SystemExit):
+        parse_with_config(text)
+    assert 'Invalid value for' in capsys.readouterr().err
+
+
+def test_config_values_are_converted_like_flags(parse_with_config):
+    args = parse_with_config('creativity: "4"\nrequest-timeout: 2\nexclude-key: id\nemojis: true\n')
+    assert args.creativity == 4
+    assert args.request_timeout == 2.0
+    assert args.exclude_key == ['id']
+    assert args.emojis is True
+
+
+def test_flags_override_config(parse_with_config):
+    assert parse_with_config('compression-level: 2', '--compression-level', '5').compression_level == 5
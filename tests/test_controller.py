@@ -0,0 +1,84 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import textpress
+
+
+class SlowModel:
+    # Model call that takes latency seconds and tracks how many calls overlap
+    def __init__(self, latency):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.calls = 0
+
+    def __call__(self, text):
+        with self.lock:
+            self.calls += 1
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.latency)
+        with self.lock:
+            self.running -= 1
+        return text
+
+
+@pytest.fixture
+def use_controller(monkeypatch):
+    def install(controller):
+        monkeypatch.setattr(textpress, 'controller', controller)
+        return controller
+    return install
+
+
+def test_timed_out_requests_keep_their_slots_until_they_finish(use_controller):
+    use_controller(textpress.RequestController(timeout=0.05))
+    model = SlowModel(0.3)
+    rate_limiter = textpress.RateLimiter(semaphore=threading.BoundedSemaphore(2))
+
+    def compress(text):
+        with pytest.raises(TimeoutError):
+            textpress.call_with_retry(model, text, kind='compress', rate_limiter=rate_limiter,
+                                      max_retries=1, base_delay=0.01)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(compress, ['a', 'b', 'c', 'd']))
+    assert model.calls == 8
+    assert model.peak == 2
+    # Requests abandoned by their callers still give their slots back
+    time.sleep(0.4)
+    assert rate_limiter.semaphore.acquire(False) and rate_limiter.semaphore.acquire(False)
+
+
+def test_hedges_need_a_free_slot(use_controller):
+    controller = use_controller(textpress.RequestController(hedge=True))
+    controller.latencies['compress'] = [0.01] * 20
+    model = SlowModel(0.1)
+
+    full = textpress.RateLimiter(semaphore=threading.BoundedSemaphore(1))
+    assert textpress.call_with_retry(model, 'x', kind='compress', rate_limiter=full) == 'x'
+    assert model.peak == 1
+    assert controller.stats()['hedges'] == 0
+
+    time.sleep(0.15)
+    spare = textpress.RateLimiter(semaphore=threading.BoundedSemaphore(2))
+    assert textpress.call_with_retry(model, 'x', kind='compress', rate_limiter=spare) == 'x'
+    assert controller.stats()['hedges'] == 1
+    # The losing request still holds its slot until it returns
+    time.sleep(0.15)
+    assert spare.semaphore.acquire(False) and spare.semaphore.acquire(False)
+
+
+def test_latencies_are_kept_per_call_site_kind(use_controller, backend):
+    backend()
+    controller = use_controller(textpress.RequestController(hedge=True))
+    for kind in ('classify_batch', 'packed', 'structure'):
+        for _ in range(20):
+            textpress.call_with_retry(textpress.ai_completion, 'prompt', 'fake', kind=kind)
+    assert sorted(controller.latencies) == ['classify_batch', 'packed', 'structure']
+    assert all(len(samples) == 20 for samples in controller.latencies.values())
+    assert controller.hedge_deadline('compress') is None
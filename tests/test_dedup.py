@@ -0,0 +1,63 @@
+import json
+
+import textpress
+from conftest import compress_content
+
+
+def compress_strings(strings, **options):
+    return textpress.compress_strings(strings, 'JSON', '', '', False, 'fake', 1, 0.3, **options)
+
+
+def test_duplicates_are_compressed_once_and_fanned_out(recorder):
+    strings = ['Click here please to continue', 'Save please your work', 'Click here please to continue',
+               'Click here please to continue']
+    run_stats = {}
+    compressed, attempts, _, _ = compress_strings(strings, run_stats=run_stats)
+    assert recorder.texts == ['Click here please to continue', 'Save please your work']
+    assert compressed == ['Click here to continue', 'Save your work', 'Click here to continue', 'Click here to continue']
+    assert attempts == [1, 1, 0, 0]
+    assert run_stats['total_strings'] == 4
+    assert run_stats['unique_strings'] == 2
+    assert run_stats['calls_saved'] == 2
+
+
+def test_placeholder_templates_share_one_call(recorder):
+    strings = ['Hello please {name}, you have %d messages', 'Hello please {user}, you have %s messages',
+               'Hello please ${who}, you have {0} messages']
+    run_stats = {}
+    compressed, attempts, _, _ = compress_strings(strings, run_stats=run_stats)
+    assert recorder.texts == ['Hello please {1}, you have {2} messages']
+    assert compressed == ['Hello {name}, you have %d messages', 'Hello {user}, you have %s messages',
+                          'Hello ${who}, you have {0} messages']
+    assert attempts == [1, 0, 0]
+    assert run_stats['templates'] == 1
+    assert run_stats['template_strings'] == 3
+
+
+def test_dropped_placeholder_keeps_every_original(backend):
+    class DroppingBackend(textpress.FakeBackend):
+        def compress(self, text):
+            return text.replace(' {2}', '')
+
+    backend(DroppingBackend())
+    strings = ['Welcome back {name} to {place}', 'Welcome back %s to %s']
+    run_stats = {}
+    compressed, _, _, _ = compress_strings(strings, run_stats=run_stats)
+    assert compressed == strings
+    assert run_stats['candidates_discarded'] == 1
+    assert run_stats['placeholder_mismatches'] == 0
+
+
+def test_repeated_values_get_identical_wording_in_the_file(make_args, recorder):
+    content = json.dumps({
+        'save': 'Remember please to save your work',
+        'dialog': {'hint': 'Remember please to save your work'},
+        'menu': ['Remember please to save your work', 'Open please a file'],
+    })
+    modified = json.loads(compress_content(content, 'JSON', make_args()))
+    assert len(recorder.texts) == 2
+    assert modified == {
+        'save': 'Remember to save your work',
+        'dialog': {'hint': 'Remember to save your work'},
+        'menu': ['Remember to save your work', 'Open a file'],
+    }
@@ -0,0 +1,32 @@
+import contextlib
+import io
+import json
+
+import textpress
+
+TEMPLATES = {
+    'welcome': 'Hello {name}, welcome back to your dashboard please',
+    'welcome_again': 'Hello {{user}}, welcome back to your dashboard please',
+    'count': 'You have %d new messages waiting for you please',
+    'count_again': 'You have %s new messages waiting for you please',
+}
+
+
+def test_dry_run_counts_templates_and_their_cache_entries(tmp_path, make_args, recorder):
+    source = tmp_path / 'en.json'
+    source.write_text(json.dumps(TEMPLATES))
+    args = make_args('--no-prefilter')
+
+    plan = textpress.estimate_file_cost(str(source), args, None)
+    assert (plan['strings'], plan['unique_strings'], plan['compress_requests']) == (4, 2, 2)
+
+    cache = textpress.ResultCache(str(tmp_path / 'cache.sqlite3'))
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            textpress.compress_content(source.read_text(), 'JSON', args, None, cache)
+        assert len(recorder.texts) == 2
+        plan = textpress.estimate_file_cost(str(source), args, cache)
+    finally:
+        cache.close()
+    assert plan['compress_requests'] == 0
+    assert plan['classify_requests'] == 0
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+import yaml
+
+from conftest import compress_content
+
+# Each value holds a Windows path or non-ASCII text; the recording backend drops
+# the trailing " please" so every value is compressed and rendered again
+BACKSLASH = 'Open C:\\new\\table now please'
+ACCENTED = 'Café au lait is served now please'
+
+FORMATS = {
+    'JSON': (json.dumps({'a': BACKSLASH, 'b': ACCENTED}, ensure_ascii=False), json.loads),
+    'YAML': (
+        'a: "Open C:\\\\new\\\\table now please"\n'
+        "b: 'Café au lait is served now please'\n",
+        yaml.safe_load
+    ),
+    'PlainText': ('He said "Open C:\\new\\table now please" and "Café au lait is served now please".', None),
+    'Prose': ('Open C:\\new\\table now please. Café au lait is served now please.', None),
+}
+
+
+@pytest.mark.parametrize('format_name', FORMATS)
+def test_values_reach_the_model_decoded_and_are_written_back(format_name, make_args, recorder):
+    content, load = FORMATS[format_name]
+    modified_content = compress_content(content, format_name, make_args('--no-prefilter'))
+
+    assert any(BACKSLASH in text for text in recorder.texts)
+    assert any(ACCENTED in text for text in recorder.texts)
+    if load is not None:
+        assert load(modified_content) == {'a': 'Open C:\\new\\table now', 'b': 'Café au lait is served now'}
+    else:
+        assert 'Open C:\\new\\table now' in modified_content
+        assert 'Café au lait is served now' in modified_content
+        assert 'please' not in modified_content
+
+
+@pytest.mark.parametrize('format_name', ['JavaScript', 'TypeScript', 'TSX'])
+def test_javascript_values_reach_the_model_decoded(format_name, make_args, recorder):
+    content = 'const a = "Open C:\\\\new\\\\table now please";\nconst b = `Café au lait is served now please`;\n'
+    modified_content = compress_content(content, format_name, make_args('--no-prefilter'))
+
+    assert BACKSLASH in recorder.texts
+    assert ACCENTED in recorder.texts
+    assert modified_content == 'const a = "Open C:\\\\new\\\\table now";\nconst b = `Café au lait is served now`;\n'
+
+
+def test_invalid_json_falls_back_to_decoded_values(make_args, recorder):
+    content = '{"a": "Open C:\\\\new\\\\table now please", "b": "Café au lait is served now please",'
+    modified_content = compress_content(content, 'JSON', make_args('--no-prefilter'))
+
+    assert BACKSLASH in recorder.texts
+    assert modified_content == '{"a": "Open C:\\\\new\\\\table now", "b": "Café au lait is served now",'
@@ -0,0 +1,46 @@
+import shutil
+import subprocess
+
+import pytest
+
+import textpress
+from conftest import compress_content
+
+esprima = pytest.importorskip('esprima')
+
+# Regex literals right after a statement head contain quotes that must not be
+# read as strings; a slash after any other closing parenthesis is a division
+STATEMENT_HEADS = [
+    'if (ok) /x"y/.test(s) && alert("Saved your changes please");\n',
+    'while (i--) /"/.exec(t);\nnotify("Still working on it please");\n',
+    "for (;;) /'/.test(a) && warn('Loop finished early please');\n",
+    'with (scope) /"[a-z]"/g.lastIndex = 0;\nlog("Scope cleared please");\n',
+    'if (a) { if ((b)) /"/.test(c) } say("Nested heads work please");\n',
+    'const ratio = (total) / 2 / count;\nshow("Ratio computed please");\n',
+    'obj.if(x) / 2;\nshow("Property named like a keyword please");\n',
+    'const t = `${fn(a) / 2}`;\nshow("Template substitution please");\n',
+]
+
+
+def esprima_strings(source):
+    # String literals as esprima's parser reads them, with their source ranges;
+    # parsing rather than tokenizing decides regex against division by grammar
+    tokens = esprima.parseScript(source, {'tokens': True, 'range': True}).tokens
+    return [(token.value, tuple(token.range)) for token in tokens if token.type == 'String']
+
+
+@pytest.mark.parametrize('source', STATEMENT_HEADS)
+def test_strings_match_esprima(source):
+    found = [(source[start:end], (start, end)) for _, (start, end), kind in textpress.find_strings_in_javascript(source)
+             if kind == 'string']
+    assert found == esprima_strings(source)
+
+
+@pytest.mark.parametrize('source', STATEMENT_HEADS)
+def test_rewritten_source_still_parses(source, make_args, recorder):
+    modified = compress_content(source, 'JavaScript', make_args())
+    assert ' please' not in modified
+    esprima.parseScript(modified)
+    if shutil.which('node'):
+        subprocess.run(['node', '--check', '--input-type=commonjs'], input=modified, text=True, check=True,
+                       capture_output=True)
@@ -0,0 +1,107 @@
+import contextlib
+import io
+import json
+import os
+
+import pytest
+
+import textpress
+from conftest import RecordingBackend
+
+STRINGS = {
+    'first': 'The first please string of the file',
+    'second': 'The second please string of the file',
+    'third': 'The third please string of the file',
+}
+
+
+class InterruptingBackend(RecordingBackend):
+    # Stops the run like Ctrl+C when it reaches a string containing the marker
+    def __init__(self, marker):
+        super().__init__()
+        self.marker = marker
+
+    def compress(self, text):
+        if self.marker in text:
+            raise KeyboardInterrupt
+        return super().compress(text)
+
+
+@pytest.fixture
+def files(tmp_path):
+    source = tmp_path / 'strings.json'
+    source.write_text(json.dumps(STRINGS), encoding='utf-8')
+    return str(source), str(tmp_path / 'strings_output.json')
+
+
+def run(files, make_args, *extra):
+    source, output = files
+    args = make_args('--no-prefilter', '--concurrency', '1', *extra)
+    with contextlib.redirect_stdout(io.StringIO()):
+        stats = textpress.process_file(source, output, args, None, None)
+    with open(output, encoding='utf-8') as f:
+        return json.load(f), stats
+
+
+def test_interrupted_run_resumes_from_the_journal(files, make_args, backend):
+    first = backend(InterruptingBackend('third'))
+    with pytest.raises(KeyboardInterrupt):
+        run(files, make_args)
+    journal = textpress.journal_path(files[1])
+    assert os.path.exists(journal)
+    assert STRINGS['third'] not in first.texts
+
+    second = backend(RecordingBackend())
+    modified, stats = run(files, make_args)
+    assert second.texts == [STRINGS['third']]
+    assert modified == {key: value.replace(' please', '') for key, value in STRINGS.items()}
+    assert stats['journal_reused'] > 0
+    # A finished run without --incremental has no use for the journal
+    assert not os.path.exists(journal)
+
+
+def test_incremental_run_recompresses_only_changed_strings(files, make_args, backend):
+    backend(RecordingBackend())
+    run(files, make_args, '--incremental')
+    assert os.path.exists(textpress.journal_path(files[1]))
+
+    changed = dict(STRINGS, second='The second please string was edited')
+    with open(files[0], 'w', encoding='utf-8') as f:
+        json.dump(changed, f)
+    model = backend(RecordingBackend())
+    modified, stats = run(files, make_args, '--incremental')
+    assert model.texts == [changed['second']]
+    assert modified['second'] == 'The second string was edited'
+    assert modified['first'] == 'The first string of the file'
+    assert stats['journal_reused'] > 0
+
+
+def test_complete_journal_is_ignored_without_incremental(files, make_args, backend):
+    backend(RecordingBackend())
+    run(files, make_args, '--incremental')
+    model = backend(RecordingBackend())
+    _, stats = run(files, make_args)
+    assert sorted(model.texts) == sorted(STRINGS.values())
+    assert stats['journal_reused'] == 0
+
+
+def test_journal_skips_a_line_cut_short_by_a_crash(tmp_path):
+    path = str(tmp_path / 'out.json.journal')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'textpress_journal': 1, 'complete': False}) + '\n')
+        f.write(json.dumps({'key': 'a', 'value': 'kept'}) + '\n')
+        f.write('{"key": "b", "val')
+    journal = textpress.RunJournal(path)
+    try:
+        assert journal.resumed_from == 'interrupted run'
+        assert journal.get('a') == 'kept'
+        assert journal.get('b') is None
+        assert journal.reused == 1
+    finally:
+        journal.close()
+
+
+def test_no_journal_leaves_no_file(files, make_args, backend):
+    backend(RecordingBackend())
+    run(files, make_args, '--no-journal')
+    assert not os.path.exists(textpress.journal_path(files[1]))
@@ -0,0 +1,43 @@
+import io
+import json
+
+import pytest
+
+import textpress
+from conftest import compress_content
+
+EDGE_CASES = (
+    '{"a\\"b": "Say \\"hi\\" please", "emoji": "Smile \\ud83d\\ude00 now please",\n'
+    ' "nested": [{"x": "Zürich tram stops here please"}, ["Line\\nbreak please", ""]],\n'
+    ' "skip": {"id": "Keep me please"}, "n": -1.5e3, "t": true, "z": null, "slash": "Files live in a\\/b now please"}'
+)
+
+
+def test_spans_cover_the_literals_as_written():
+    found = list(textpress.find_strings_in_json(EDGE_CASES))
+    encoded = EDGE_CASES.encode('utf-8')
+    for value, (start, end), (byte_start, byte_end), path in found:
+        assert json.loads(EDGE_CASES[start:end]) == value
+        assert encoded[byte_start:byte_end].decode('utf-8') == EDGE_CASES[start:end]
+    assert [path for *_, path in found] == [
+        '.a"b', '.emoji', '.nested[0].x', '.nested[1][0]', '.nested[1][1]', '.skip.id', '.slash'
+    ]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64])
+def test_chunked_reads_match_whole_reads(chunk_size):
+    assert list(textpress.find_strings_in_json(io.StringIO(EDGE_CASES), chunk_size=chunk_size)) == \
+        list(textpress.find_strings_in_json(EDGE_CASES))
+
+
+def test_excluded_keys_are_skipped():
+    paths = [path for *_, path in textpress.find_strings_in_json(EDGE_CASES, exclude_keys={'skip', 'emoji'})]
+    assert '.skip.id' not in paths and '.emoji' not in paths
+
+
+def test_round_trip(make_args, recorder):
+    modified = compress_content(EDGE_CASES, 'JSON', make_args('--no-prefilter'))
+    expected = json.loads(EDGE_CASES.replace(' please', ''))
+    assert json.loads(modified) == expected
+    # Numbers, literals and keys keep their original text
+    assert '-1.5e3' in modified and '"a\\"b"' in modified
@@ -0,0 +1,95 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import textpress
+
+
+class StubOllama(ThreadingHTTPServer):
+    # Ollama stand-in that records each request body and answers with the next
+    # scripted (status, chunks) reply; more than one chunk is sent as a stream
+    daemon_threads = True
+
+    def __init__(self, replies):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.replies = list(replies)
+        self.requests = []
+        self.connections = 0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.path, json.loads(body)))
+        status, chunks = self.server.replies.pop(0)
+        payload = ''.join(json.dumps(chunk) + '\n' for chunk in chunks).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(*replies):
+        server = StubOllama(replies)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server, textpress.OllamaClient(f"127.0.0.1:{server.server_address[1]}")
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_generate_sends_options_and_reuses_the_connection(stub):
+    done = {'response': ' Short text ', 'done': True, 'prompt_eval_count': 12, 'eval_count': 3}
+    server, client = stub((200, [done]), (200, [done]))
+    usage = {}
+    assert client.generate('Compress this', 'llama3.2', max_tokens=50, temperature=0.4, usage=usage) == ' Short text '
+    assert client.generate('Compress that', 'llama3.2') == ' Short text '
+    assert server.requests[0] == ('/api/generate', {
+        'model': 'llama3.2', 'prompt': 'Compress this', 'stream': False,
+        'options': {'temperature': 0.4, 'num_predict': 50},
+    })
+    assert usage == {'prompt_tokens': 12, 'completion_tokens': 3}
+    assert server.connections == 1
+
+
+def test_streamed_pieces_reach_on_token_in_order(stub):
+    chunks = [{'response': 'Sh', 'done': False}, {'response': 'ort', 'done': False},
+              {'response': '', 'done': True, 'prompt_eval_count': 7, 'eval_count': 2}]
+    server, client = stub((200, chunks))
+    pieces, usage = [], {}
+    assert client.generate('Compress', 'llama3.2', stream=True, on_token=pieces.append, usage=usage) == 'Short'
+    assert pieces == ['Sh', 'ort', '']
+    assert server.requests[0][1]['stream'] is True
+    assert usage == {'prompt_tokens': 7, 'completion_tokens': 2}
+
+
+def test_rate_limits_are_retried(stub, monkeypatch):
+    server, client = stub((429, [{'error': 'too many requests'}]), (200, [{'response': 'Done', 'done': True}]))
+    monkeypatch.setattr(textpress, 'ollama_client', client)
+    with pytest.raises(textpress.OllamaError) as error:
+        client.generate('Compress', 'llama3.2')
+    assert error.value.status_code == 429
+    assert textpress.is_rate_limit_error(error.value)
+
+    server.replies[:0] = [(429, [{'error': 'too many requests'}])]
+    result = textpress.call_with_retry(textpress.llama_local_completion, 'Compress', kind='compress', base_delay=0.01)
+    assert result == 'Done'
+    assert len(server.requests) == 3
@@ -0,0 +1,76 @@
+import json
+import re
+
+import textpress
+from conftest import RecordingBackend
+
+
+class PackedRecorder(RecordingBackend):
+    # Records how many items each packed prompt carried and can spoil the
+    # packed answer for chosen strings: 'drop' leaves the index out and 'grow'
+    # returns text longer than the original
+    def __init__(self, spoil=None):
+        super().__init__()
+        self.spoil = spoil or {}
+        self.packed_sizes = []
+
+    def __call__(self, prompt, model, max_tokens, temperature):
+        if "maps each index to its compressed string" not in prompt:
+            return super().__call__(prompt, model, max_tokens, temperature)
+        self.calls += 1
+        items = {index: json.loads(literal) for index, literal
+                 in re.findall(r'^(\d+) \(under \d+ characters\): (".*")$', prompt, re.MULTILINE)}
+        self.packed_sizes.append(len(items))
+        answer = {}
+        for index, text in items.items():
+            action = self.spoil.get(text)
+            if action == 'grow':
+                answer[index] = text + ' and then some more'
+            elif action != 'drop':
+                answer[index] = self.compress(text)
+        return 'Here you go:\n' + json.dumps(answer)
+
+
+def test_parse_reads_every_index_around_extra_text():
+    response = 'Sure!\n{"0": " first ", "1": "second"}\nDone.'
+    assert textpress.parse_packed_compression_response(response, 2) == ['first', 'second']
+
+
+def test_parse_leaves_missing_and_non_string_items_empty():
+    response = json.dumps({'0': 'kept', '2': 3, '3': None})
+    assert textpress.parse_packed_compression_response(response, 4) == ['kept', None, None, None]
+
+
+def test_parse_rejects_malformed_answers():
+    for response in ['no json here', '{"0": "unterminated}', '{"0": "a"} trailing {"1": "b"}']:
+        assert textpress.parse_packed_compression_response(response, 2) == [None, None]
+
+
+def test_missing_and_invalid_items_are_retried_alone(backend):
+    strings = ['Keep please this one short', 'This please goes missing', 'This please one grows']
+    model = backend(PackedRecorder({strings[1]: 'drop', strings[2]: 'grow'}))
+    candidates, requests = textpress.compress_packed_round(strings, 'JSON', '', '', False, 'fake', 0.3)
+    assert candidates == ['Keep this one short', 'This goes missing', 'This one grows']
+    assert requests == [1, 2, 2]
+    assert model.packed_sizes == [3]
+    # The packed answer for the first string was used, the other two came from solo prompts
+    assert model.texts == strings
+
+
+def test_single_item_round_is_not_retried(backend):
+    model = backend(PackedRecorder({'Only please one item': 'grow'}))
+    candidates, requests = textpress.compress_packed_round(['Only please one item'], 'JSON', '', '', False, 'fake', 0.3)
+    assert candidates == [None]
+    assert requests == [1]
+    assert model.calls == 1
+
+
+def test_packed_batches_make_one_request_per_group(backend):
+    model = backend(PackedRecorder())
+    strings = [f'Item {i} please stays the same' for i in range(5)]
+    compressed, attempts, _, _ = textpress.compress_strings(strings, 'JSON', '', '', False, 'fake', 1, 0.3,
+                                                            packed_batch_size=2)
+    assert model.packed_sizes == [2, 2, 1]
+    assert model.calls == 3
+    assert compressed == [string.replace(' please', '') for string in strings]
+    assert attempts == [1] * 5
@@ -0,0 +1,94 @@
+import io
+import time
+
+import pytest
+
+import textpress
+from conftest import compress_content
+
+QUOTES = '''It's "a \\"quoted\\" string please" and 'single one here please'.
+Unclosed "quote here
+
+\\"not a string\\" but "this one is fine please"
+Don't stop 'believing in it please' now, it's 'Bob's turn please'
+'''
+
+# A string may span lines; its closing quote must not open a string of its own
+MULTILINE = 'The label "Save\nchanges" is shown to the user please when the user "edits the document".\n'
+
+PROSE = '''# Heading here please
+
+First sentence is here please. Second one follows please! Third? Yes.
+
+- A list item with words please
+```
+code "not prose" please
+```
+Paragraph two spans
+two lines please.
+'''
+
+
+def test_quoted_strings():
+    found = list(textpress.find_quoted_strings(QUOTES))
+    assert [text for text, _ in found] == [
+        'a \\"quoted\\" string please', 'single one here please', 'this one is fine please', 'believing in it please',
+        "Bob's turn please",
+    ]
+    for text, (start, end) in found:
+        assert QUOTES[start + 1:end - 1] == text
+
+
+def test_quoted_strings_span_lines_within_a_paragraph():
+    assert list(textpress.find_quoted_strings(MULTILINE)) == [('Save\nchanges', (10, 24)), ('edits the document', (67, 87))]
+    # A blank line ends the paragraph, so the first quote is left unclosed and
+    # the one after a word cannot open a string
+    assert list(textpress.find_quoted_strings(MULTILINE.replace('\n', '\n\n', 1))) == [('edits the document', (68, 88))]
+
+
+def test_multiline_round_trip(make_args, recorder):
+    modified = compress_content(MULTILINE.replace('Save', 'Save your work please'), 'PlainText', make_args('--no-prefilter'))
+    assert modified == MULTILINE.replace('Save', 'Save your work')
+
+
+def test_streamed_quotes_match_whole_content():
+    content = QUOTES + '\n' + MULTILINE + '  \n' + MULTILINE
+    assert list(textpress.iter_string_spans(io.StringIO(content), 'PlainText')) == \
+        list(zip(*textpress.extract_strings_with_regex(content)))
+
+
+@pytest.mark.parametrize('content', [
+    '"\\' * 20000, "'" * 20000 + '"' * 20000, ("'x" + '\\"' * 50 + '\n') * 400,
+])
+def test_quote_scan_is_linear(content):
+    start = time.perf_counter()
+    list(textpress.find_quoted_strings(content))
+    assert time.perf_counter() - start < 1
+
+
+def test_prose_sentences_and_paragraphs():
+    lines = PROSE.splitlines(keepends=True)
+    sentences = list(textpress.find_prose_segments(lines))
+    assert [text for text, _ in sentences] == [
+        'Heading here please', 'First sentence is here please.', 'Second one follows please!', 'Third?', 'Yes.',
+        'A list item with words please', 'Paragraph two spans\ntwo lines please.',
+    ]
+    paragraphs = [text for text, _ in textpress.find_prose_segments(lines, 'paragraphs')]
+    assert paragraphs[1] == 'First sentence is here please. Second one follows please! Third? Yes.'
+    for text, (start, end) in sentences:
+        assert PROSE[start:end] == text
+
+
+def test_quotes_round_trip(make_args, recorder):
+    modified = compress_content(QUOTES, 'PlainText', make_args('--no-prefilter'))
+    assert modified == QUOTES.replace(' please"', '"').replace(" please'", "'")
+
+
+def test_prose_round_trip(make_args, recorder):
+    modified = compress_content(PROSE, 'Prose', make_args('--no-prefilter', '--prose', 'sentences'))
+    assert modified == PROSE.replace(' please', '').replace('code "not prose"', 'code "not prose" please')
+
+
+def test_streamed_prose_matches_whole_content():
+    assert list(textpress.find_prose_segments(io.StringIO(PROSE))) == \
+        list(textpress.find_prose_segments(PROSE.splitlines(keepends=True)))
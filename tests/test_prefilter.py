@@ -0,0 +1,71 @@
+import contextlib
+import io
+import json
+
+import pytest
+
+import textpress
+
+RULE_EXAMPLES = {
+    'no_letters': ('12,345.67 / 89', 'skip'),
+    'short': ('Hi there', 'skip'),
+    'single_word': ('Überraschungsei!', 'skip'),
+    'url': ('https://example.com/docs', 'skip'),
+    'email': ('team@example.com', 'skip'),
+    'path': ('assets/images/logo.png', 'skip'),
+    'identifier': ('user.profile.name', 'skip'),
+    'hex_color': ('#1a2b3c', 'skip'),
+    'datetime': ('2024-05-01T10:30:00Z', 'skip'),
+    'mime_type': ('text/html; charset=utf-8', 'skip'),
+    'placeholder_only': ('{{ user.name }} %s', 'skip'),
+    'css_classes': ('btn btn-primary mt-2 md:flex', 'skip'),
+    'prose': ('The quick brown fox jumps over the lazy dog.', 'compress'),
+}
+
+
+def test_every_rule_has_an_example():
+    assert set(RULE_EXAMPLES) == set(textpress.PREFILTER_RULES)
+
+
+@pytest.mark.parametrize('rule', sorted(RULE_EXAMPLES))
+def test_each_rule_settles_its_example_on_its_own(rule):
+    # Later rules are often shadowed by earlier ones, so each is checked with all others off
+    string, verdict = RULE_EXAMPLES[rule]
+    others = [name for name in textpress.PREFILTER_RULES if name != rule]
+    assert textpress.Prefilter(others).classify(string, 'JSON') == verdict
+    assert textpress.Prefilter(textpress.PREFILTER_RULES).classify(string, 'JSON') == 'ambiguous'
+
+
+def test_ordinary_text_is_left_to_the_model():
+    prefilter = textpress.Prefilter()
+    assert prefilter.classify('Save changes now', 'JSON') == 'ambiguous'
+    assert prefilter.classify(RULE_EXAMPLES['prose'][0], 'JSON') == 'compress'
+
+
+def test_rules_can_be_disabled_for_one_format():
+    prefilter = textpress.Prefilter(['JavaScript:single_word'])
+    assert prefilter.classify('Überraschungsei!', 'JavaScript') == 'ambiguous'
+    assert prefilter.classify('Überraschungsei!', 'JSON') == 'skip'
+
+
+def test_unknown_rules_are_rejected(make_args):
+    for entry in ['nope', 'JSON:nope']:
+        with pytest.raises(ValueError):
+            textpress.Prefilter([entry])
+    with pytest.raises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+        make_args('--prefilter-disable', 'nope')
+
+
+def test_counters_report_what_the_rules_settled(make_args, recorder):
+    content = json.dumps({
+        'classes': 'btn btn-primary mt-2 md:flex',
+        'type': 'text/html; charset=utf-8',
+        'intro': 'Please read the whole guide please before you start.',
+    })
+    prefilter = textpress.Prefilter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        modified, stats = textpress.compress_content(content, 'JSON', make_args(), None, None, prefilter)
+    assert json.loads(modified)['intro'] == 'Please read the whole guide before you start.'
+    assert json.loads(modified)['classes'] == 'btn btn-primary mt-2 md:flex'
+    assert recorder.texts == ['Please read the whole guide please before you start.']
+    assert (stats['prefilter_skipped'], stats['prefilter_compressed'], stats['prefilter_calls_avoided']) == (2, 1, 1)
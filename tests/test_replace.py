@@ -0,0 +1,46 @@
+import contextlib
+import io
+import json
+
+import pytest
+
+import textpress
+from conftest import compress_content
+
+CONTENT = json.dumps({
+    'title': 'Café menus are printed fresh every morning please',
+    'note': 'Ask the staff about today’s specials please',
+    'id': 'menu_01',
+}, ensure_ascii=False)
+
+
+def test_writer_streams_the_same_content_as_the_joined_string():
+    spans = [(10, 15), (0, 3), (20, 24)]
+    content = 'abcdefghijklmnopqrstuvwxyzéèê' * 2
+    originals = [content[start:end] for start, end in spans]
+    compressed = ['X', 'é', 'Y']
+    expected = textpress.replace_strings_in_content_by_positions(content, spans, originals, compressed, 'Prose')
+    output = io.StringIO()
+    size, sample = textpress.write_strings_in_content_by_positions(output, content, spans, originals, compressed, 'Prose',
+                                                                   sample_length=12)
+    assert output.getvalue() == expected
+    assert size == len(expected.encode('utf-8'))
+    assert sample == expected[:12]
+
+
+def test_overlapping_spans_are_rejected():
+    with pytest.raises(ValueError):
+        textpress.replace_strings_in_content_by_positions('abcdef', [(0, 3), (2, 4)], ['abc', 'cd'], ['x', 'y'])
+
+
+def test_file_runs_write_through_the_splice_writer(tmp_path, make_args, recorder):
+    source = tmp_path / 'menu.json'
+    source.write_text(CONTENT, encoding='utf-8')
+    output = tmp_path / 'out' / 'menu.json'
+    with contextlib.redirect_stdout(io.StringIO()) as printed:
+        stats = textpress.process_file_in_memory(str(source), str(output), make_args('--no-prefilter'), None, None)
+    written = output.read_bytes()
+    assert written.decode('utf-8') == compress_content(CONTENT, 'JSON', make_args('--no-prefilter'))
+    assert stats['compressed_size'] == len(written)
+    assert stats['original_size'] == len(CONTENT.encode('utf-8'))
+    assert written.decode('utf-8')[:100] in printed.getvalue()
@@ -0,0 +1,39 @@
+import json
+import sys
+
+import pytest
+
+import textpress
+
+
+class PeakBackend(textpress.FakeBackend):
+    # Fake model that records the most requests it ever had in flight
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.running = 0
+        self.peak = 0
+
+    def __call__(self, *args):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        try:
+            return super().__call__(*args)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+@pytest.mark.parametrize('extra', [[], ['--pack-batch-size', '2']])
+def test_parallel_sampling_stays_within_concurrency(tmp_path, monkeypatch, backend, extra):
+    model = backend(PeakBackend(latency=0.02))
+    source = tmp_path / 'strings.json'
+    strings = {f'key{i}': f'Sentence number {i} that is long enough to compress' for i in range(8)}
+    source.write_text(json.dumps(strings))
+    monkeypatch.setattr(sys, 'argv', [
+        'textpress.py', str(source), str(tmp_path / 'out.json'), '--non-interactive', '--no-cache', '--no-ell-store',
+        '--concurrency', '4', '--compression-level', '5', '--sampling', 'parallel',
+    ] + extra)
+    textpress.main()
+    assert model.calls > 8
+    assert model.peak <= 4
@@ -0,0 +1,87 @@
+import contextlib
+import http.client
+import io
+import json
+import threading
+
+import pytest
+
+import textpress
+
+
+@pytest.fixture
+def server(backend):
+    backend(textpress.FakeBackend())
+    args = textpress.parse_args(['--serve', '--non-interactive', '--no-cache', '--port', '0', '--compression-level', '1'])
+    with contextlib.redirect_stdout(io.StringIO()):
+        textpress.resolve_options(args, interactive=False)
+    instance = textpress.create_server((args.host, args.port), args, None)
+    threading.Thread(target=instance.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    yield instance
+    instance.shutdown()
+    instance.server_close()
+
+
+@pytest.fixture
+def request_json(server):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+
+    def send(method, path, body=None):
+        data = body if isinstance(body, (str, type(None))) else json.dumps(body)
+        connection.request(method, path, body=data, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        payload = response.read().decode('utf-8')
+        return response.status, json.loads(payload) if 'json' in response.getheader('Content-Type') else payload
+    yield send
+    connection.close()
+
+
+def test_compress_file_keeps_structure(request_json):
+    content = json.dumps({
+        'title': 'Welcome back to the application dashboard, we missed you',
+        'button': 'btn_primary',
+    })
+    status, body = request_json('POST', '/compress/file', {'content': content, 'filename': 'en.json'})
+    assert status == 200
+    assert body['format'] == 'JSON'
+    result = json.loads(body['content'])
+    assert result['button'] == 'btn_primary'
+    assert len(result['title']) < len('Welcome back to the application dashboard, we missed you')
+    assert body['stats']['strings_selected'] == 1
+
+
+def test_compress_strings_keeps_order_and_classifies_on_request(request_json):
+    strings = ['Your settings have been saved successfully to the server', 'OK', 'user_id']
+    status, body = request_json('POST', '/compress/strings', {'strings': strings, 'classify': True})
+    assert status == 200
+    assert body['results'][1:] == ['OK', 'user_id']
+    assert strings[0].startswith(body['results'][0]) and body['results'][0] != strings[0]
+
+    status, body = request_json('POST', '/compress/strings', {'strings': strings[:1], 'options': {'compression_level': 2}})
+    assert status == 200
+    assert len(body['results']) == 1
+
+
+@pytest.mark.parametrize('path, body, status', [
+    ('/compress/strings', {'strings': 'not a list'}, 400),
+    ('/compress/strings', {'strings': ['x'], 'options': {'creativity': 9}}, 400),
+    ('/compress/strings', {'strings': ['x'], 'options': {'colour': 'red'}}, 400),
+    ('/compress/file', {'content': 'x', 'format': 'Markdown'}, 400),
+    ('/compress/file', '{not json', 400),
+    ('/compress/everything', {}, 404),
+])
+def test_bad_requests_are_rejected(request_json, path, body, status):
+    response_status, response = request_json('POST', path, body)
+    assert response_status == status
+    assert 'error' in response
+
+
+def test_health_and_metrics(request_json):
+    request_json('POST', '/compress/strings', {'strings': ['A sentence that is long enough to shorten']})
+    request_json('POST', '/compress/strings', {'strings': ['x'], 'options': {'sampling': 'random'}})
+    status, health = request_json('GET', '/health')
+    assert status == 200
+    assert (health['status'], health['completed_jobs'], health['failed_jobs'], health['active_jobs']) == ('ok', 1, 1, 0)
+    status, text = request_json('GET', '/metrics')
+    assert status == 200
+    assert 'textpress_' in text
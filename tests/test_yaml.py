@@ -0,0 +1,47 @@
+import io
+
+import yaml
+
+import textpress
+from conftest import compress_content
+
+ANCHORS_AND_TAGS = """\
+base: &greet Welcome back to the application, dear user please
+other: *greet
+tagged: !!str Your changes have been saved to the server please
+both: &quoted !!str "Quoted value with an anchor and a tag please"
+block: &notes |
+  Block text that should be compressed as well please
+list:
+  - *quoted
+  - *notes
+"""
+
+
+def test_spans_leave_anchors_and_tags_out():
+    spans = {path: ANCHORS_AND_TAGS[start:end] for _, (start, end), _, path in textpress.find_strings_in_yaml(ANCHORS_AND_TAGS)}
+    assert spans == {
+        '0.base': 'Welcome back to the application, dear user please',
+        '0.tagged': 'Your changes have been saved to the server please',
+        '0.both': '"Quoted value with an anchor and a tag please"',
+        '0.block': '|\n  Block text that should be compressed as well please\n',
+    }
+
+
+def test_anchors_aliases_and_tags_survive_compression(make_args, recorder):
+    modified_content = compress_content(ANCHORS_AND_TAGS, 'YAML', make_args('--no-prefilter'))
+
+    assert '&greet ' in modified_content
+    assert '!!str ' in modified_content
+    assert yaml.safe_load(modified_content) == {
+        'base': 'Welcome back to the application, dear user',
+        'other': 'Welcome back to the application, dear user',
+        'tagged': 'Your changes have been saved to the server',
+        'both': 'Quoted value with an anchor and a tag',
+        'block': 'Block text that should be compressed as well\n',
+        'list': ['Quoted value with an anchor and a tag', 'Block text that should be compressed as well\n'],
+    }
+
+
+def test_streamed_yaml_gets_the_same_spans():
+    assert list(textpress.find_strings_in_yaml(io.StringIO(ANCHORS_AND_TAGS))) == list(textpress.find_strings_in_yaml(ANCHORS_AND_TAGS))
@@ -1,23 +1,50 @@
 import sys
-import json5
-import ell
 import re
 import logging
-import yaml
 from colorama import init, Fore, Style
 import os
-import subprocess
-import esprima
 import json
 import time
+import argparse
+import random
+import threading
+import hashlib
+import queue
+import glob
+import contextlib
+from types import SimpleNamespace
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
 init(autoreset=True)  # Initialize colorama
 
 # Configure logging
 logging.basicConfig(level=logging.CRITICAL, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Initialize ell
-ell.init(store='./logdir')
+# ell, PyYAML and esprima, and the standard library's HTTP client and server,
+# sqlite3 and multiprocessing, are imported where they are first needed, so
+# runs that never use them (and --help or argument errors) start quickly
+
+MODEL_ALIASES = {
+    'claude': "claude-3-5-sonnet-20240620",
+    'chatgpt': "chatgpt-4o-latest",
+    'llama': "llama3.2",
+}
+
+EXTENSION_FORMATS = {
+    '.json': 'JSON',
+    '.yaml': 'YAML',
+    '.yml': 'YAML',
+    '.js': 'JavaScript',
+    '.jsx': 'JavaScript',
+    '.mjs': 'JavaScript',
+    '.cjs': 'JavaScript',
+    '.ts': 'TypeScript',
+    '.tsx': 'TSX',
+}
+
+# Formats read by the JavaScript scanner; all but plain TypeScript may contain JSX
+JAVASCRIPT_FORMATS = ('JavaScript', 'TypeScript', 'TSX')
 
 def get_model_choice():
     prompt = f"{Fore.YELLOW}Choose AI model:{Fore.WHITE}\n"
@@ -57,53 +84,466 @@ def get_temperature(creativity_level):
     temperature_map = {1: 0.0, 2: 0.2, 3: 0.5, 4: 0.8, 5: 1.0}
     return temperature_map[creativity_level]
 
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(-(-fraction * len(sorted_values) // 1)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+class RunMetrics:
+    # Thread-safe collector for per-phase wall-clock time, per-request latency and
+    # token counts by model, retries and compression attempts per string. Token
+    # counts are estimated from text length unless the backend reports them.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.phases = {}
+            self.models = {}
+            self.retries = 0
+            self.attempts = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def record_request(self, model, latency, prompt_tokens, completion_tokens, error=False):
+        with self.lock:
+            entry = self.models.setdefault(model, {
+                'latencies': [], 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0
+            })
+            entry['latencies'].append(latency)
+            entry['prompt_tokens'] += prompt_tokens
+            entry['completion_tokens'] += completion_tokens
+            if error:
+                entry['errors'] += 1
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def record_attempts(self, attempts):
+        with self.lock:
+            self.attempts.append(attempts)
+
+    def snapshot(self):
+        # Raw data that can be pickled across processes and merged
+        with self.lock:
+            return {
+                'phases': dict(self.phases),
+                'models': {model: {**entry, 'latencies': list(entry['latencies'])} for model, entry in self.models.items()},
+                'retries': self.retries,
+                'attempts': list(self.attempts),
+            }
+
+    def merge(self, snapshot):
+        with self.lock:
+            for name, seconds in snapshot['phases'].items():
+                self.phases[name] = self.phases.get(name, 0.0) + seconds
+            for model, other in snapshot['models'].items():
+                entry = self.models.setdefault(model, {
+                    'latencies': [], 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0
+                })
+                entry['latencies'].extend(other['latencies'])
+                for key in ('errors', 'prompt_tokens', 'completion_tokens'):
+                    entry[key] += other[key]
+            self.retries += snapshot['retries']
+            self.attempts.extend(snapshot['attempts'])
+
+    def summary(self):
+        snapshot = self.snapshot()
+        models = {}
+        for model, entry in snapshot['models'].items():
+            latencies = sorted(entry['latencies'])
+            models[model] = {
+                'requests': len(latencies),
+                'errors': entry['errors'],
+                'prompt_tokens': entry['prompt_tokens'],
+                'completion_tokens': entry['completion_tokens'],
+                'latency_seconds': {
+                    'mean': sum(latencies) / len(latencies) if latencies else 0.0,
+                    'p50': percentile(latencies, 0.50),
+                    'p95': percentile(latencies, 0.95),
+                    'p99': percentile(latencies, 0.99),
+                    'max': latencies[-1] if latencies else 0.0,
+                },
+            }
+        attempts = snapshot['attempts']
+        histogram = {}
+        for count in attempts:
+            histogram[str(count)] = histogram.get(str(count), 0) + 1
+        return {
+            'phases_seconds': snapshot['phases'],
+            'models': models,
+            'retries': snapshot['retries'],
+            'attempts': {
+                'strings': len(attempts),
+                'total': sum(attempts),
+                'mean': sum(attempts) / len(attempts) if attempts else 0.0,
+                'histogram': dict(sorted(histogram.items(), key=lambda item: int(item[0]))),
+            },
+        }
+
+    def to_json(self):
+        return json.dumps(self.summary(), indent=2)
+
+    def to_prometheus(self):
+        summary = self.summary()
+
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+        lines = [
+            "# HELP textpress_phase_seconds Wall-clock seconds spent in each pipeline phase.",
+            "# TYPE textpress_phase_seconds gauge",
+        ]
+        for name, seconds in summary['phases_seconds'].items():
+            lines.append(f'textpress_phase_seconds{{phase="{label(name)}"}} {seconds:.6f}')
+        lines += [
+            "# HELP textpress_requests_total Model requests sent.",
+            "# TYPE textpress_requests_total counter",
+        ]
+        for model, entry in summary['models'].items():
+            lines.append(f'textpress_requests_total{{model="{label(model)}"}} {entry["requests"]}')
+        lines += [
+            "# HELP textpress_request_errors_total Model requests that failed.",
+            "# TYPE textpress_request_errors_total counter",
+        ]
+        for model, entry in summary['models'].items():
+            lines.append(f'textpress_request_errors_total{{model="{label(model)}"}} {entry["errors"]}')
+        lines += [
+            "# HELP textpress_tokens_total Prompt and completion tokens by model.",
+            "# TYPE textpress_tokens_total counter",
+        ]
+        for model, entry in summary['models'].items():
+            lines.append(f'textpress_tokens_total{{model="{label(model)}",type="prompt"}} {entry["prompt_tokens"]}')
+            lines.append(f'textpress_tokens_total{{model="{label(model)}",type="completion"}} {entry["completion_tokens"]}')
+        lines += [
+            "# HELP textpress_request_latency_seconds Model request latency.",
+            "# TYPE textpress_request_latency_seconds summary",
+        ]
+        for model, entry in summary['models'].items():
+            for quantile in ('p50', 'p95', 'p99'):
+                lines.append(
+                    f'textpress_request_latency_seconds{{model="{label(model)}",quantile="0.{quantile[1:]}"}} '
+                    f'{entry["latency_seconds"][quantile]:.6f}'
+                )
+            lines.append(f'textpress_request_latency_seconds_count{{model="{label(model)}"}} {entry["requests"]}')
+            lines.append(
+                f'textpress_request_latency_seconds_sum{{model="{label(model)}"}} '
+                f'{entry["latency_seconds"]["mean"] * entry["requests"]:.6f}'
+            )
+        lines += [
+            "# HELP textpress_retries_total Requests retried after a rate-limit error or timeout.",
+            "# TYPE textpress_retries_total counter",
+            f"textpress_retries_total {summary['retries']}",
+            "# HELP textpress_compression_attempts Compression attempts per string.",
+            "# TYPE textpress_compression_attempts histogram",
+        ]
+        cumulative = 0
+        for attempts, count in summary['attempts']['histogram'].items():
+            cumulative += count
+            lines.append(f'textpress_compression_attempts_bucket{{le="{attempts}"}} {cumulative}')
+        lines.append(f'textpress_compression_attempts_bucket{{le="+Inf"}} {summary["attempts"]["strings"]}')
+        lines.append(f"textpress_compression_attempts_sum {summary['attempts']['total']}")
+        lines.append(f"textpress_compression_attempts_count {summary['attempts']['strings']}")
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path, metrics_format=None):
+        if metrics_format is None:
+            metrics_format = 'prometheus' if path.endswith(('.prom', '.txt')) else 'json'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus() if metrics_format == 'prometheus' else self.to_json())
+
+# Metrics for the current run; every model request is recorded here
+metrics = RunMetrics()
+
+# Replaces every model provider when set, e.g. with a FakeBackend for offline runs
+completion_backend = None
+
+# Where ell records invocations; None disables the store. ell itself is only
+# imported and initialized before the first request that goes through it.
+ell_store = './logdir'
+ell_lock = threading.Lock()
+ell_initialized = False
+ell_completions = {}
+
+def get_ell_completion(model, max_tokens, temperature):
+    # Builds one LMP per (model, temperature, max_tokens) and reuses it for every request
+    global ell_initialized
+    key = (model, temperature, max_tokens)
+    with ell_lock:
+        if key not in ell_completions:
+            import ell
+            if not ell_initialized:
+                ell.init(store=ell_store)
+                ell_initialized = True
+
+            @ell.simple(model=model, max_tokens=max_tokens, temperature=temperature)
+            def ell_completion(p):
+                return p
+            ell_completions[key] = ell_completion
+        return ell_completions[key]
+
+def set_completion_backend(backend):
+    global completion_backend
+    completion_backend = backend
+
 def ai_completion(prompt, model, max_tokens=1000, temperature=0.2):
     logging.debug(f"Sending request to AI model: {model}")
+    usage = {}
+    start = time.perf_counter()
     try:
-        if model == "llama3.2":
-            result = llama_local_completion(prompt, max_tokens, temperature)
+        if completion_backend is not None:
+            result = completion_backend(prompt, model, max_tokens, temperature)
+        elif is_local_model(model):
+            result = llama_local_completion(prompt, max_tokens, temperature, model, usage)
         else:
-            @ell.simple(model=model, max_tokens=max_tokens, temperature=temperature)
-            def ell_completion(p):
-                return p
-            result = ell_completion(prompt)
+            result = get_ell_completion(model, max_tokens, temperature)(prompt)
         logging.debug(f"AI response received. Length: {len(result)}")
+        prompt_tokens = usage.get('prompt_tokens') or estimate_tokens(prompt)
+        completion_tokens = usage.get('completion_tokens') or estimate_tokens(result)
+        metrics.record_request(model, time.perf_counter() - start, prompt_tokens, completion_tokens)
+        budget.spend(prompt_tokens + completion_tokens)
         return result
     except Exception as e:
         logging.error(f"Error in AI completion: {str(e)}")
+        metrics.record_request(model, time.perf_counter() - start, estimate_tokens(prompt), 0, error=True)
+        budget.spend(estimate_tokens(prompt))
         raise
 
-def llama_local_completion(prompt, max_tokens=1000, temperature=0.2):
+class FakeBackendError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+class FakeBackend:
+    # Deterministic stand-in for a model provider. It recognizes the prompts this
+    # script sends, single or batched, and answers them locally: strings are
+    # classified with is_sentence and compressed by dropping trailing words down
+    # to compression_ratio of their length. Latency and simulated rate-limit errors
+    # are drawn from a generator seeded by the prompt, so runs are reproducible.
+    def __init__(self, latency=0.0, error_rate=0.0, compression_ratio=0.7, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.compression_ratio = compression_ratio
+        self.seed = seed
+        self.calls = 0
+        self.prompt_attempts = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_spec(cls, spec):
+        # Builds a backend from "latency=0.2,error_rate=0.01,ratio=0.7,seed=1"
+        options = {}
+        for item in filter(None, (part.strip() for part in spec.split(','))):
+            key, _, value = item.partition('=')
+            key = {'ratio': 'compression_ratio'}.get(key.strip(), key.strip())
+            options[key] = int(value) if key == 'seed' else float(value)
+        return cls(**options)
+
+    def __call__(self, prompt, model, max_tokens, temperature):
+        # Seeding by prompt and retry number keeps results independent of request order
+        prompt_key = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        with self.lock:
+            self.calls += 1
+            attempt = self.prompt_attempts.get(prompt_key, 0) + 1
+            self.prompt_attempts[prompt_key] = attempt
+        rng = random.Random(f"{self.seed}:{attempt}:{prompt_key}")
+        if self.latency:
+            time.sleep(self.latency * (0.5 + rng.random()))
+        if rng.random() < self.error_rate:
+            raise FakeBackendError(429, "Fake backend: 429 Too Many Requests")
+
+        if "Respond with a single JSON object mapping every index" in prompt:
+            decisions = {}
+            for index, literal in re.findall(r'^(\d+): (".*")$', prompt, re.MULTILINE):
+                decisions[index] = 'YES' if is_sentence(json.loads(literal)) else 'NO'
+            return json.dumps(decisions)
+        if "determine if they should be compressed" in prompt:
+            match = re.search(r'^String: "(.*)"$', prompt, re.MULTILINE | re.DOTALL)
+            return 'YES' if match and is_sentence(match.group(1)) else 'NO'
+        if "maps each index to its compressed string" in prompt:
+            compressed = {}
+            for index, literal in re.findall(r'^(\d+) \(under \d+ characters\): (".*")$', prompt, re.MULTILINE):
+                compressed[index] = self.compress(json.loads(literal))
+            return json.dumps(compressed, ensure_ascii=False)
+        match = re.search(r'Original string: (.*)\n\n\s*Compressed string:', prompt, re.DOTALL)
+        if match:
+            return self.compress(match.group(1))
+        return "Structure: nested keys with string values."
+
+    def compress(self, text):
+        # Placeholders are kept, as a well-behaved model would
+        target = max(1, int(len(text) * self.compression_ratio))
+        words = text.split()
+        droppable = [i for i, word in enumerate(words) if not PLACEHOLDER_PATTERN.search(word)]
+        while len(words) > 1 and droppable and len(' '.join(words)) > target:
+            words.pop(droppable.pop())
+        compressed = ' '.join(words)
+        if len(compressed) <= target or PLACEHOLDER_PATTERN.search(compressed):
+            return compressed
+        return compressed[:target]
+
+def configure_backend(args):
+    global ell_store, controller
+    controller = RequestController(
+        args.concurrency if getattr(args, 'adaptive_concurrency', False) else 0,
+        getattr(args, 'request_timeout', 0),
+        getattr(args, 'hedge', False)
+    )
+    if getattr(args, 'no_ell_store', False):
+        ell_store = None
+    elif getattr(args, 'ell_store', None):
+        ell_store = args.ell_store
+    if getattr(args, 'fake_backend', None) is not None:
+        set_completion_backend(FakeBackend.from_spec(args.fake_backend))
+
+def is_local_model(model):
+    # Local models are served by Ollama: the built-in Llama choice or any "ollama/<name>"
+    return model == "llama3.2" or model.startswith("ollama/")
+
+class OllamaError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(f"Ollama returned HTTP {status_code}: {message}")
+        self.status_code = status_code
+
+class OllamaClient:
+    # Minimal client for the Ollama HTTP API. Connections are kept alive and
+    # pooled, so concurrent requests reuse sockets and the model stays loaded
+    # between calls instead of spawning `ollama run` for every prompt.
+    def __init__(self, base_url=None, max_idle_connections=16, timeout=300):
+        import http.client
+        import urllib.parse
+        base_url = base_url or os.environ.get('OLLAMA_HOST') or 'http://localhost:11434'
+        if '://' not in base_url:
+            base_url = f"http://{base_url}"
+        parsed = urllib.parse.urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 11434
+        self.timeout = timeout
+        self.idle_connections = queue.LifoQueue(maxsize=max_idle_connections)
+
+    def _acquire_connection(self):
+        try:
+            return self.idle_connections.get_nowait(), True
+        except queue.Empty:
+            return self.connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def _release_connection(self, connection):
+        try:
+            self.idle_connections.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def generate(self, prompt, model, max_tokens=1000, temperature=0.2, stream=False, on_token=None, usage=None):
+        # With stream=True the response is read as it is generated and each piece
+        # is passed to on_token; the full text is returned either way. Token counts
+        # reported by the server are stored in usage when a dict is given.
+        body = json.dumps({
+            'model': model,
+            'prompt': prompt,
+            'stream': stream,
+            'options': {'temperature': temperature, 'num_predict': max_tokens},
+        })
+        import http.client
+        while True:
+            connection, reused = self._acquire_connection()
+            try:
+                connection.request('POST', '/api/generate', body=body, headers={'Content-Type': 'application/json'})
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused:
+                    # The server closed an idle keep-alive connection; retry on a fresh one
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            break
+
+        try:
+            if response.status != 200:
+                message = response.read().decode('utf-8', errors='replace')
+                raise OllamaError(response.status, message)
+            if not stream:
+                data = json.loads(response.read())
+                if data.get('error'):
+                    raise OllamaError(response.status, data['error'])
+                text = data.get('response', '')
+                final = data
+            else:
+                pieces = []
+                for line in response:
+                    if not line.strip():
+                        continue
+                    data = json.loads(line)
+                    if data.get('error'):
+                        raise OllamaError(response.status, data['error'])
+                    piece = data.get('response', '')
+                    pieces.append(piece)
+                    if on_token:
+                        on_token(piece)
+                    if data.get('done'):
+                        break
+                final = data
+                response.read()
+                text = ''.join(pieces)
+        except Exception:
+            connection.close()
+            raise
+        self._release_connection(connection)
+        if usage is not None:
+            usage['prompt_tokens'] = final.get('prompt_eval_count', 0)
+            usage['completion_tokens'] = final.get('eval_count', 0)
+        return text
+
+ollama_client = None
+ollama_client_lock = threading.Lock()
+
+def get_ollama_client():
+    global ollama_client
+    with ollama_client_lock:
+        if ollama_client is None:
+            ollama_client = OllamaClient()
+        return ollama_client
+
+def llama_local_completion(prompt, max_tokens=1000, temperature=0.2, model="llama3.2", usage=None):
+    import http.client
     try:
-        command = ["ollama", "run", "llama3.2", "-t", str(temperature), prompt]
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error running Llama 3.2 locally: {e}")
+        return get_ollama_client().generate(prompt, model.removeprefix("ollama/"), max_tokens, temperature, usage=usage).strip()
+    except (OllamaError, OSError, http.client.HTTPException) as e:
+        logging.error(f"Error running {model} locally: {e}")
         raise
 
-def format_detector(file_path, model):
+def detect_format(file_path, prose=None):
+    # Determine format based on file extension
+    _, file_extension = os.path.splitext(file_path)
+    if file_extension in EXTENSION_FORMATS:
+        return EXTENSION_FORMATS[file_extension]
+    # Plain text is read as prose when sentences or paragraphs are asked for
+    if prose:
+        return 'Prose'
+    # Fallback to AI-based detection or default to PlainText
+    return 'PlainText'
+
+def format_detector(file_path, model, prose=None):
     # Read the content
     with open(file_path, 'r', encoding='utf-8') as f:
         content = f.read()
 
-    # Determine format based on file extension
-    _, file_extension = os.path.splitext(file_path)
-    extension_map = {
-        '.json': 'JSON',
-        '.yaml': 'YAML',
-        '.yml': 'YAML',
-        '.js': 'JavaScript',
-        '.jsx': 'JavaScript',
-        '.ts': 'TypeScript',
-    }
-    if file_extension in extension_map:
-        detected_format = extension_map[file_extension]
-    else:
-        # Fallback to AI-based detection or default to PlainText
-        detected_format = 'PlainText'
-
-    return detected_format, content
+    return detect_format(file_path, prose), content
 
 def generate_structure_prompt(format_name, content):
     prompt = f"""Analyze the following {format_name} content and describe its structure. 
@@ -120,108 +560,926 @@ def generate_structure_prompt(format_name, content):
     return prompt
 
 def compress_string(original: str, format_name: str, expert_field: str, style_guide: str, use_emojis: bool, model: str, temperature: float):
-    # Unescape the original string
-    unescaped_original = bytes(original, "utf-8").decode("unicode_escape")
+    # The extractors hand over each value as the text it stands for, already
+    # decoded and without delimiters, and the renderers encode the result again
+    prompt = generate_compression_prompt(original, format_name, expert_field, style_guide, use_emojis)
+    return ai_completion(prompt, model, max_tokens=1000, temperature=temperature).strip()
 
-    # Remove surrounding quotes if present
-    if (unescaped_original.startswith("'") and unescaped_original.endswith("'")) or \
-       (unescaped_original.startswith('"') and unescaped_original.endswith('"')):
-        unescaped_original = unescaped_original[1:-1]
+# Added to compression prompts for text with interpolation slots
+PLACEHOLDER_INSTRUCTION = "\n    {}. Keep every placeholder such as {{1}}, %s or ${{name}} exactly as written, each exactly once."
 
+def generate_compression_prompt(original, format_name, expert_field, style_guide, use_emojis):
     emoji_instruction = "Include relevant emojis in the output." if use_emojis else "Do not use emojis."
+    placeholder_instruction = PLACEHOLDER_INSTRUCTION.format(8) if PLACEHOLDER_PATTERN.search(original) else ""
     prompt = f"""You are an expert at making text more concise without changing its meaning. Don't reword, don't improve. Think hard and find ways to combine and shorten the text. Fix grammar. No talk; just go. `interactive=false`
     Compress the given text content from a {format_name} file. Follow these guidelines:
     1. MUST maintain the original meaning.
-    2. The compressed string MUST be shorter than {len(unescaped_original)} characters and have the same meaning as the original.
+    2. The compressed string MUST be shorter than {len(original)} characters and have the same meaning as the original.
     3. Use language appropriate for an expert in {expert_field}.
     4. {emoji_instruction}
     5. MUST follow this instruction:{style_guide}
     6. Return ONLY the compressed string.
-    7. Do NOT wrap output in quotes.
+    7. Do NOT wrap output in quotes.{placeholder_instruction}
 
-    Original string: {unescaped_original}
+    Original string: {original}
 
     Compressed string:"""
+    return prompt
+
+class RateLimiter:
+    # Spaces out request starts so that no more than requests_per_minute begin
+    # in any minute. A limit of 0 disables rate limiting. The lock, next-slot
+    # holder and in-flight semaphore may be multiprocessing manager proxies, so
+    # worker processes can share a single budget.
+    def __init__(self, requests_per_minute=0, lock=None, next_slot=None, semaphore=None):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self.lock = lock or threading.Lock()
+        self.next_slot = next_slot if next_slot is not None else SimpleNamespace(value=0.0)
+        self.semaphore = semaphore
+
+    def acquire(self):
+        if self.semaphore is not None:
+            self.semaphore.acquire()
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            wait = self.next_slot.value - now
+            self.next_slot.value = max(now, self.next_slot.value) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def try_acquire(self):
+        # Takes a slot only if one is free right now, without waiting
+        if self.semaphore is not None and not self.semaphore.acquire(False):
+            return False
+        if not self.interval:
+            return True
+        with self.lock:
+            now = time.time()
+            free = self.next_slot.value <= now
+            if free:
+                self.next_slot.value = now + self.interval
+        if not free:
+            self.release()
+        return free
+
+    def release(self):
+        if self.semaphore is not None:
+            self.semaphore.release()
+
+class RunBudget:
+    # Caps the tokens and wall time a run may spend. Work that has not started
+    # when the budget runs out is skipped and its strings keep their original
+    # text, while requests already in flight finish. A limit of 0 disables it.
+    # Like RateLimiter, the shared counters may be multiprocessing manager
+    # proxies so batch workers spend from one budget.
+    def __init__(self, token_limit=0, time_limit=0, lock=None, spent=None, started=None):
+        self.token_limit = token_limit
+        self.time_limit = time_limit
+        self.lock = lock or threading.Lock()
+        self.spent = spent if spent is not None else SimpleNamespace(value=0)
+        self.started = started if started is not None else SimpleNamespace(value=time.time())
+        self.skipped = 0
+
+    def spend(self, tokens):
+        if not self.token_limit:
+            return
+        with self.lock:
+            self.spent.value += tokens
+
+    def exhausted(self):
+        if self.token_limit and self.spent.value >= self.token_limit:
+            return True
+        return bool(self.time_limit) and time.time() - self.started.value >= self.time_limit
+
+    def skip(self, count):
+        with self.lock:
+            self.skipped += count
+
+# Budget for the current run; unlimited unless configured
+budget = RunBudget()
+
+class RequestTimeout(TimeoutError):
+    pass
+
+def run_in_thread(func, *args, **kwargs):
+    # Starts func on a daemon thread and returns a Future for its result. A
+    # request that is given up on keeps its thread but never delays exit.
+    future = Future()
+    def target():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+class RequestController:
+    # Adapts the number of model requests in flight, and enforces per-request
+    # timeouts and hedging. With a ceiling, the limit starts at half of it and
+    # grows by one after each window of as many requests as the limit, as long
+    # as the window had few errors and a median latency within twice the best
+    # window seen. Rate limits and timeouts halve it, once per window, since
+    # the requests that started before a decrease report the same congestion.
+    # Hedging sends a duplicate of a request still running after the p95
+    # latency of its kind and keeps whichever answer arrives first, if a slot
+    # is free for it. Every request, hedge or not, holds its slots until the
+    # model call returns, even after the caller stopped waiting for it.
+    def __init__(self, max_concurrency=0, timeout=0, hedge=False):
+        self.max_concurrency = max_concurrency
+        self.limit = max(1, max_concurrency // 2) if max_concurrency else 0
+        self.timeout = timeout
+        self.hedge = hedge
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.epoch = 0
+        self.window = []
+        self.baseline = None
+        self.latencies = {}
+        self.started = time.time()
+        self.decisions = []
+        self.counters = {'increases': 0, 'decreases': 0, 'holds': 0, 'timeouts': 0, 'hedges': 0, 'hedge_wins': 0, 'failed_strings': 0}
+        self.peak = self.limit
+
+    def acquire(self):
+        # Waits for a free slot under the current limit; returns the window the
+        # request starts in
+        with self.condition:
+            while self.limit and self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+            return self.epoch
+
+    def try_acquire(self, rate_limiter=None):
+        # Takes a controller slot and a rate limiter slot only if both are free
+        # right now
+        with self.condition:
+            if self.limit and self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+        if rate_limiter and not rate_limiter.try_acquire():
+            self.release()
+            return False
+        return True
+
+    def release(self, rate_limiter=None):
+        if rate_limiter:
+            rate_limiter.release()
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def record(self, epoch, latency, error=False, overloaded=False):
+        if not self.limit:
+            return
+        with self.condition:
+            if overloaded:
+                if epoch == self.epoch:
+                    self.decide('decrease', max(1, self.limit // 2), 'rate limit or timeout')
+                return
+            self.window.append((latency, error))
+            if len(self.window) < self.limit:
+                return
+            latencies = sorted(latency for latency, error in self.window if not error)
+            errors = len(self.window) - len(latencies)
+            median = percentile(latencies, 0.5)
+            if errors > len(self.window) * 0.1:
+                self.decide('hold', self.limit, f"{errors} errors in {len(self.window)} requests")
+            elif self.baseline is not None and median > self.baseline * 2:
+                self.decide('hold', self.limit, f"median latency {median:.2f}s over twice the best {self.baseline:.2f}s")
+            elif self.limit < self.max_concurrency:
+                self.decide('increase', self.limit + 1, f"median latency {median:.2f}s")
+            else:
+                self.window = []
+            if latencies:
+                self.baseline = median if self.baseline is None else min(self.baseline, median)
+
+    def decide(self, action, limit, reason):
+        # Called with the condition held; starts a new window
+        self.counters[{'increase': 'increases', 'decrease': 'decreases', 'hold': 'holds'}[action]] += 1
+        self.decisions.append({
+            'time': round(time.time() - self.started, 3), 'action': action, 'from': self.limit, 'to': limit, 'reason': reason
+        })
+        logging.info(f"Concurrency {action}: {self.limit} -> {limit} ({reason})")
+        self.limit = limit
+        self.peak = max(self.peak, limit)
+        self.epoch += 1
+        self.window = []
+        self.condition.notify_all()
+
+    def count(self, counter, amount=1):
+        with self.condition:
+            self.counters[counter] += amount
+
+    def hedge_deadline(self, kind):
+        with self.condition:
+            samples = sorted(self.latencies.get(kind, ()))
+        return percentile(samples, 0.95) if len(samples) >= 20 else None
+
+    def start(self, rate_limiter, func, *args, **kwargs):
+        # Runs func on its own thread and frees its slots when func returns
+        def request():
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.release(rate_limiter)
+        return run_in_thread(request)
+
+    def call(self, kind, rate_limiter, func, *args, **kwargs):
+        # Takes over the slots the caller acquired for this request
+        if not self.timeout and not self.hedge:
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.release(rate_limiter)
+        start = time.perf_counter()
+        futures = [self.start(rate_limiter, func, *args, **kwargs)]
+        hedge_at = self.hedge_deadline(kind) if self.hedge else None
+        if hedge_at is not None and (not self.timeout or hedge_at < self.timeout):
+            done, _ = wait(futures, timeout=hedge_at)
+            if not done and self.try_acquire(rate_limiter):
+                self.count('hedges')
+                futures.append(self.start(rate_limiter, func, *args, **kwargs))
+
+        pending = set(futures)
+        first_error = None
+        while pending:
+            remaining = max(0.0, self.timeout - (time.perf_counter() - start)) if self.timeout else None
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                self.count('timeouts')
+                raise RequestTimeout(f"No answer within {self.timeout:g}s")
+            for future in done:
+                if future.exception() is not None:
+                    first_error = first_error or future.exception()
+                    continue
+                if future is not futures[0]:
+                    self.count('hedge_wins')
+                with self.condition:
+                    self.latencies.setdefault(kind, deque(maxlen=200)).append(time.perf_counter() - start)
+                return future.result()
+        raise first_error
+
+    def stats(self):
+        with self.condition:
+            return {**self.counters, 'limit': self.limit, 'peak': self.peak, 'decisions': len(self.decisions)}
+
+# Controller for the current process; without configuration it only counts
+controller = RequestController()
+
+def is_rate_limit_error(error):
+    if getattr(error, 'status_code', None) == 429:
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in ('429', 'rate limit', 'ratelimit', 'rate_limit', 'too many requests'))
+
+def is_overload_error(error):
+    # Rate limits and timeouts mean the provider is saturated; both are retried
+    # and both make the controller back off
+    return isinstance(error, TimeoutError) or is_rate_limit_error(error)
+
+def call_with_retry(func, *args, kind, rate_limiter=None, max_retries=5, base_delay=1.0, **kwargs):
+    # kind groups requests with similar latency for hedging: 'classify',
+    # 'classify_batch', 'compress', 'packed' or 'structure'
+    retries = 0
+    while True:
+        epoch = controller.acquire()
+        if rate_limiter:
+            rate_limiter.acquire()
+        start = time.perf_counter()
+        try:
+            result = controller.call(kind, rate_limiter, func, *args, **kwargs)
+        except Exception as e:
+            overloaded = is_overload_error(e)
+            controller.record(epoch, time.perf_counter() - start, error=True, overloaded=overloaded)
+            if not overloaded or retries >= max_retries:
+                raise
+            # Exponential backoff with jitter so concurrent workers don't retry in lockstep
+            delay = base_delay * (2 ** retries) + random.uniform(0, base_delay)
+            retries += 1
+            metrics.record_retry()
+            logging.warning(f"Rate limited or timed out, retry {retries}/{max_retries} in {delay:.1f}s: {str(e)}")
+        else:
+            controller.record(epoch, time.perf_counter() - start)
+            return result
+        time.sleep(delay)
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'textpress', 'cache.sqlite3')
+
+class ResultCache:
+    # Content-addressed on-disk store for classification and compression results.
+    # Entries unused for max_age_days are dropped, then the least recently used
+    # entries are evicted until the stored values fit in max_bytes.
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=100 * 1024 * 1024, max_age_days=30):
+        import sqlite3
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+        self.connection.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(kind, **fields):
+        payload = json.dumps({'kind': kind, **fields}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+            return json.loads(row[0])
+
+    def put(self, key, kind, value):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results (key, kind, value, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, json.dumps(value, ensure_ascii=False), now, now)
+            )
+            self.connection.commit()
+
+    def evict(self):
+        with self.lock:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                self.connection.execute("DELETE FROM results WHERE accessed < ?", (cutoff,))
+            if self.max_bytes:
+                total = 0
+                stale_keys = []
+                rows = self.connection.execute("SELECT key, LENGTH(key) + LENGTH(value) FROM results ORDER BY accessed DESC")
+                for key, size in rows:
+                    total += size
+                    if total > self.max_bytes:
+                        stale_keys.append((key,))
+                self.connection.executemany("DELETE FROM results WHERE key = ?", stale_keys)
+            self.connection.commit()
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM results")
+            self.connection.commit()
+
+    def close(self):
+        self.evict()
+        self.connection.close()
+
+class RunJournal:
+    # Append-only JSON-lines record of every classification and compression result
+    # of one output file, written as results arrive so an interrupted run can be
+    # resumed. The first line is a header; a finished run rewrites the journal to
+    # just the results it used and marks it complete, which an incremental run
+    # then reuses for every string that has not changed. Lookups fall through to
+    # the result cache, and cache hits are journaled too.
+    def __init__(self, path, cache=None, reuse_complete=False):
+        self.path = path
+        self.cache = cache
+        self.entries = {}
+        self.used = {}
+        self.reused = 0
+        self.resumed_from = None
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            self.load(reuse_complete)
+        if self.resumed_from is None:
+            self.entries = {}
+            self.file = open(path, 'w', encoding='utf-8')
+            self.write_line({'textpress_journal': 1, 'complete': False})
+        else:
+            self.file = open(path, 'a', encoding='utf-8')
 
-    @ell.simple(model=model, max_tokens=1000, temperature=temperature)
-    def ell_compress(p):
-        return p
+    def load(self, reuse_complete):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return
+        if not isinstance(header, dict) or 'textpress_journal' not in header:
+            return
+        # A complete journal belongs to a finished run and only counts in incremental mode
+        if header.get('complete') and not reuse_complete:
+            return
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line may have been cut short by a crash
+                continue
+            self.entries[entry['key']] = entry['value']
+        self.resumed_from = 'previous run' if header.get('complete') else 'interrupted run'
+
+    def write_line(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    @property
+    def hits(self):
+        return self.cache.hits if self.cache is not None else 0
+
+    @property
+    def misses(self):
+        return self.cache.misses if self.cache is not None else 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.reused += 1
+                self.used[key] = self.entries[key]
+                return self.entries[key]
+        if self.cache is None:
+            return None
+        value = self.cache.get(key)
+        if value is not None:
+            with self.lock:
+                self.used[key] = value
+                self.write_line({'key': key, 'value': value})
+        return value
+
+    def put(self, key, kind, value):
+        with self.lock:
+            self.used[key] = value
+            self.write_line({'key': key, 'value': value})
+        if self.cache is not None:
+            self.cache.put(key, kind, value)
+
+    def finish(self, keep):
+        # Called once the output file is written. Without keep the journal has
+        # served its purpose and is removed.
+        self.file.close()
+        if not keep:
+            os.remove(self.path)
+            return
+        partial_path = f"{self.path}.partial"
+        with open(partial_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'textpress_journal': 1, 'complete': True}) + '\n')
+            for key, value in self.used.items():
+                f.write(json.dumps({'key': key, 'value': value}, ensure_ascii=False) + '\n')
+        os.replace(partial_path, self.path)
+
+    def close(self):
+        self.file.close()
+
+def compression_cache_key(string, format_name, expert_field, style_guide, use_emojis, model, compression_level, temperature,
+                          sampling='sequential', refine=False, packed=False):
+    # Sampling and packing settings only join the key when they differ from the
+    # defaults, so results cached by the one-string sequential loop keep their keys
+    extra = {} if sampling == 'sequential' and not refine else {'sampling': sampling, 'refine': refine}
+    if packed:
+        extra['packed'] = True
+    return ResultCache.make_key(
+        'compress', string=string, format_name=format_name, expert_field=expert_field, style_guide=style_guide,
+        use_emojis=use_emojis, model=model, compression_level=compression_level, temperature=temperature, **extra
+    )
 
-    compressed_result = ell_compress(prompt).strip()
+def classification_cache_key(string, format_name, model, temperature):
+    return ResultCache.make_key('classify', string=string, format_name=format_name, model=model, temperature=temperature)
+
+# Interpolation slots: {{name}}, ${name}, {name} or {0}, and printf-style %s, %d, %1$s, %(name)s
+PLACEHOLDER_PATTERN = re.compile(r'\{\{\s*[\w.]+\s*\}\}|\$\{[^{}]*\}|\{[\w.]*\}|%(?:\(\w+\)|\d+\$)?[-+0#]*\d*(?:\.\d+)?[sdifu]')
+TEMPLATE_MARKER_PATTERN = re.compile(r'\{(\d+)\}')
+
+def mask_placeholders(string):
+    # Replaces every placeholder with a numbered marker {1}, {2}, ... so strings
+    # that differ only in their slots or slot syntax share one template
+    placeholders = []
+    def mask(match):
+        placeholders.append(match.group(0))
+        return f"{{{len(placeholders)}}}"
+    return PLACEHOLDER_PATTERN.sub(mask, string), placeholders
+
+def deduplicate_templates(strings):
+    # Masks the placeholders of every string and deduplicates the templates;
+    # returns the (template, placeholders) pairs, the distinct templates and
+    # the index of each string's template among them
+    masked = [mask_placeholders(string) for string in strings]
+    unique_strings, unique_index = deduplicate_strings([template for template, _ in masked])
+    return masked, unique_strings, unique_index
+
+def unmask_placeholders(template, placeholders):
+    def unmask(match):
+        number = int(match.group(1))
+        return placeholders[number - 1] if 0 < number <= len(placeholders) else match.group(0)
+    return TEMPLATE_MARKER_PATTERN.sub(unmask, template)
+
+def placeholders_match(original, candidate):
+    # Every placeholder must survive exactly once; the order may change
+    return sorted(PLACEHOLDER_PATTERN.findall(original)) == sorted(PLACEHOLDER_PATTERN.findall(candidate))
+
+def is_valid_candidate(original, candidate):
+    # A usable compression is non-empty, strictly shorter, keeps every placeholder,
+    # and does not gain line breaks the original did not have (usually the model
+    # talking about its answer)
+    if not candidate.strip('\'"').strip():
+        return False
+    if '\n' in candidate and '\n' not in original:
+        return False
+    if not placeholders_match(original, candidate):
+        return False
+    return len(candidate) < len(original)
+
+def candidate_temperatures(temperature, count):
+    # Spreads parallel samples from the chosen temperature upwards for variety
+    return [min(1.0, temperature + i * 0.2) for i in range(count)]
+
+def compress_single_string(string, format_name, expert_field, style_guide, use_emojis, model, compression_level, temperature,
+                           rate_limiter=None, sampling='sequential', refine=False):
+    # Returns the shortest valid compression, the number of requests made and the
+    # number of candidates discarded
+    if sampling == 'parallel':
+        return sample_compression_candidates(
+            string, format_name, expert_field, style_guide, use_emojis, model, compression_level, temperature,
+            rate_limiter, refine
+        )
+    attempts = 0
+    discarded = 0
+    shortest_compressed = string
+    current_string = string
+
+    while attempts < compression_level:
+        # The first attempt was cleared by the caller; later ones stop once the
+        # budget runs out and the string keeps its best compression so far
+        if attempts and budget.exhausted():
+            break
+        attempts += 1
+
+        compressed = call_with_retry(
+            compress_string,
+            current_string, format_name, expert_field, style_guide, use_emojis, model, temperature,
+            kind='compress', rate_limiter=rate_limiter
+        ).strip()
+
+        if is_valid_candidate(shortest_compressed, compressed):
+            shortest_compressed = compressed
+            current_string = compressed
+        else:
+            discarded += 1
+            break
+
+    return shortest_compressed, attempts, discarded
+
+def sample_compression_candidates(string, format_name, expert_field, style_guide, use_emojis, model, compression_level, temperature,
+                                  rate_limiter=None, refine=False):
+    # Requests compression_level candidates at once, each at its own temperature,
+    # so a string costs one round trip whatever the level. The shortest valid
+    # candidate wins and, with refine, gets one more round of compression.
+    temperatures = candidate_temperatures(temperature, compression_level)
+
+    def sample(index, candidate_temperature):
+        # Candidates after the first are not started once the budget runs out
+        if index and budget.exhausted():
+            return None
+        return call_with_retry(
+            compress_string,
+            string, format_name, expert_field, style_guide, use_emojis, model, candidate_temperature,
+            kind='compress', rate_limiter=rate_limiter
+        ).strip()
+
+    with ThreadPoolExecutor(max_workers=len(temperatures)) as executor:
+        futures = [executor.submit(sample, index, candidate_temperature) for index, candidate_temperature in enumerate(temperatures)]
+        candidates = [candidate for candidate in (future.result() for future in futures) if candidate is not None]
+    attempts = len(candidates)
+
+    valid = [candidate for candidate in candidates if is_valid_candidate(string, candidate)]
+    discarded = len(candidates) - min(1, len(valid))
+    if not valid:
+        return string, attempts, discarded
+    shortest_compressed = min(valid, key=len)
+
+    if refine and not budget.exhausted():
+        attempts += 1
+        refined = call_with_retry(
+            compress_string,
+            shortest_compressed, format_name, expert_field, style_guide, use_emojis, model, temperature,
+            kind='compress', rate_limiter=rate_limiter
+        ).strip()
+        if is_valid_candidate(shortest_compressed, refined):
+            shortest_compressed = refined
+        else:
+            discarded += 1
+
+    return shortest_compressed, attempts, discarded
+
+def print_compression_result(completed, total, index, string, shortest_compressed, attempts, compression_level):
+    print(f"\n{Fore.CYAN}Compressed string {index+1} ({completed}/{total} done):")
+    print(f"{Fore.YELLOW}Before: {string[:100]}{'...' if len(string) > 100 else ''}")
+    print(f"{Fore.GREEN}Compressed in {attempts} attempt(s) at level {compression_level}:")
+    print(f"{Fore.MAGENTA}After:  {shortest_compressed[:100]}{'...' if len(shortest_compressed) > 100 else ''}")
+    print(f"{Fore.BLUE}Length: {len(string)} → {len(shortest_compressed)} ({(1 - len(shortest_compressed) / len(string)) * 100:.2f}% reduction)")
+
+def deduplicate_strings(strings):
+    # Returns the distinct strings in first-seen order and, for every input
+    # position, the index of its string in that list
+    unique_positions = {}
+    unique_index = []
+    for string in strings:
+        unique_index.append(unique_positions.setdefault(string, len(unique_positions)))
+    return list(unique_positions), unique_index
+
+def generate_packed_compression_prompt(strings, format_name, expert_field, style_guide, use_emojis):
+    emoji_instruction = "Include relevant emojis in the output." if use_emojis else "Do not use emojis."
+    indexed_strings = "\n".join(
+        f"{i} (under {len(string)} characters): {json.dumps(string, ensure_ascii=False)}" for i, string in enumerate(strings)
+    )
+    placeholder_instruction = PLACEHOLDER_INSTRUCTION.format(7) if any(PLACEHOLDER_PATTERN.search(string) for string in strings) else ""
+    prompt = f"""You are an expert at making text more concise without changing its meaning. Don't reword, don't improve. Think hard and find ways to combine and shorten the text. Fix grammar. No talk; just go. `interactive=false`
+    Compress each of the following text items from a {format_name} file. Follow these guidelines:
+    1. MUST maintain the original meaning of every item.
+    2. Each compressed item MUST be shorter than the character count given for it.
+    3. Use language appropriate for an expert in {expert_field}.
+    4. {emoji_instruction}
+    5. MUST follow this instruction:{style_guide}
+    6. Compress every item on its own; never merge, split or reorder items.{placeholder_instruction}
 
-    # Re-add quotes if they were present in the original
-    if original.startswith("'") and original.endswith("'"):
-        compressed_result = f"'{compressed_result}'"
-    elif original.startswith('"') and original.endswith('"'):
-        compressed_result = f'"{compressed_result}"'
+    Items (index (length limit): JSON-encoded string):
+{indexed_strings}
 
-    return compressed_result
+    Return a JSON object that maps each index to its compressed string, e.g. {{"0": "...", "1": "..."}}. No intro, no outro, just the JSON object.
 
-import time
-from itertools import cycle
+    Compressed items:"""
+    return prompt
 
-def compress_strings(strings, format_name, expert_field, style_guide, use_emojis, model, compression_level, temperature):
-    compressed_strings = []
-    compression_attempts = []
-    total_original_length = 0
-    total_compressed_length = 0
-    spinner = cycle(['-', '\\', '|', '/'])
-    
-    for i, string in enumerate(strings):
-        attempts = 0
-        shortest_compressed = string
-        current_string = string
-        
-        print(f"\n{Fore.CYAN}Compressing string {i+1}/{len(strings)}:")
-        print(f"{Fore.YELLOW}Before: {string[:100]}{'...' if len(string) > 100 else ''}")
-        
-        while attempts < compression_level:
-            attempts += 1
-            print(f"\r{Fore.WHITE}Attempt {attempts}/{compression_level} {next(spinner)}", end='', flush=True)
-            
-            if model == "llama3.2":
-                prompt = compress_string(
-                    current_string, format_name, expert_field, style_guide, use_emojis, model
-                )
-                compressed = llama_local_completion(prompt, 1000, temperature)
-            else:
-                compressed = compress_string(
-                    current_string, format_name, expert_field, style_guide, use_emojis, model, temperature
-                )
-            compressed = compressed.strip()
-            
-            if len(compressed) < len(shortest_compressed):
-                shortest_compressed = compressed
-                current_string = compressed
+def parse_packed_compression_response(response, count):
+    # Returns a string or None per index; items that are missing or not strings
+    # are left for the caller to retry on their own
+    match = re.search(r'\{.*\}', response, re.DOTALL)
+    if not match:
+        return [None] * count
+    try:
+        data = json.loads(match.group(0))
+    except ValueError:
+        return [None] * count
+    if not isinstance(data, dict):
+        return [None] * count
+    results = []
+    for i in range(count):
+        value = data.get(str(i))
+        results.append(value.strip() if isinstance(value, str) else None)
+    return results
+
+def compress_packed_round(strings, format_name, expert_field, style_guide, use_emojis, model, temperature, rate_limiter=None):
+    # One packed request for every string; items that come back missing or fail
+    # their own length check are retried alone. Returns a valid candidate or None
+    # per string and the number of requests made for each.
+    prompt = generate_packed_compression_prompt(strings, format_name, expert_field, style_guide, use_emojis)
+    max_tokens = 16 + sum(estimate_tokens(json.dumps(string, ensure_ascii=False)) + 8 for string in strings)
+    response = call_with_retry(ai_completion, prompt, model, max_tokens, temperature, kind='packed', rate_limiter=rate_limiter)
+    candidates = parse_packed_compression_response(response, len(strings))
+    requests = [1] * len(strings)
+    for i, (string, candidate) in enumerate(zip(strings, candidates)):
+        if candidate is not None and is_valid_candidate(string, candidate):
+            continue
+        if len(strings) > 1 and not budget.exhausted():
+            logging.debug(f"Packed item {i} missing or invalid, retrying alone")
+            requests[i] += 1
+            candidate = call_with_retry(
+                compress_string, string, format_name, expert_field, style_guide, use_emojis, model, temperature,
+                kind='compress', rate_limiter=rate_limiter
+            ).strip()
+        candidates[i] = candidate if is_valid_candidate(string, candidate or '') else None
+    return candidates, requests
+
+def compress_packed_strings(strings, format_name, expert_field, style_guide, use_emojis, model, compression_level, temperature,
+                            rate_limiter=None, sampling='sequential', refine=False):
+    # Packed counterpart of compress_single_string for a batch of strings: every
+    # round is one request for the whole batch. Returns (shortest, attempts,
+    # discarded) for each string.
+    shortest = list(strings)
+    attempts = [0] * len(strings)
+    discarded = [0] * len(strings)
+
+    def run_round(indexes, round_temperature):
+        candidates, requests = compress_packed_round(
+            [shortest[i] for i in indexes], format_name, expert_field, style_guide, use_emojis, model,
+            round_temperature, rate_limiter
+        )
+        for i, count in zip(indexes, requests):
+            attempts[i] += count
+        return candidates
+
+    if sampling == 'parallel':
+        temperatures = candidate_temperatures(temperature, compression_level)
+        indexes = list(range(len(strings)))
+        def sample_round(index, round_temperature):
+            # Rounds after the first are not started once the budget runs out
+            if index and budget.exhausted():
+                return None
+            return run_round(indexes, round_temperature)
+
+        with ThreadPoolExecutor(max_workers=len(temperatures)) as executor:
+            rounds = [candidates for candidates in executor.map(sample_round, range(len(temperatures)), temperatures)
+                      if candidates is not None]
+        for i in indexes:
+            valid = [candidates[i] for candidates in rounds if candidates[i] is not None]
+            discarded[i] += len(rounds) - min(1, len(valid))
+            if valid:
+                shortest[i] = min(valid, key=len)
+        if refine and not budget.exhausted():
+            improved = [i for i in indexes if shortest[i] != strings[i]]
+            if improved:
+                for i, candidate in zip(improved, run_round(improved, temperature)):
+                    if candidate is None:
+                        discarded[i] += 1
+                    else:
+                        shortest[i] = candidate
+        return list(zip(shortest, attempts, discarded))
+
+    # Strings that shrank go around again, as in the one-string loop
+    active = list(range(len(strings)))
+    for round_number in range(compression_level):
+        if not active or round_number and budget.exhausted():
+            break
+        still_active = []
+        for i, candidate in zip(active, run_round(active, temperature)):
+            if candidate is None:
+                discarded[i] += 1
             else:
-                break
-            
-            time.sleep(0.017)  # Add a small delay for visual effect
-        
-        print(f"\r{Fore.GREEN}Compressed in {attempts} of {compression_level} attempt(s):")
-        print(f"{Fore.MAGENTA}After:  {shortest_compressed[:100]}{'...' if len(shortest_compressed) > 100 else ''}")
-        print(f"{Fore.BLUE}Length: {len(string)} → {len(shortest_compressed)} ({(1 - len(shortest_compressed) / len(string)) * 100:.2f}% reduction)")
-        
-        compressed_strings.append(shortest_compressed)
-        compression_attempts.append(attempts)
-        total_original_length += len(string)
-        total_compressed_length += len(shortest_compressed)
-    
+                shortest[i] = candidate
+                still_active.append(i)
+        active = still_active
+    return list(zip(shortest, attempts, discarded))
+
+def compress_unique_strings(strings, format_name, expert_field, style_guide, use_emojis, model, compression_level, temperature, max_workers=1, rate_limiter=None, cache=None,
+                            sampling='sequential', refine=False, packed_batch_size=0, packed_batch_tokens=1000):
+    compressed_strings = [None] * len(strings)
+    compression_attempts = [0] * len(strings)
+    candidates_discarded = [0] * len(strings)
+    completed = 0
+
+    # Serve previously compressed strings from the cache without calling the model
+    pending = []
+    cache_keys = {}
+    for i, string in enumerate(strings):
+        if cache is None:
+            pending.append(i)
+            continue
+        cache_keys[i] = compression_cache_key(
+            string, format_name, expert_field, style_guide, use_emojis, model, compression_level, temperature, sampling, refine,
+            packed=packed_batch_size > 0
+        )
+        cached = cache.get(cache_keys[i])
+        if cached is None:
+            pending.append(i)
+        else:
+            compressed_strings[i] = cached
+            completed += 1
+    if completed:
+        print(f"\n{Fore.GREEN}{completed} of {len(strings)} strings served from cache.")
+
+    # The longest strings have the most to gain, so they go first; if the run
+    # budget runs out, what is left undone is what would have saved the least
+    pending.sort(key=lambda i: len(strings[i]), reverse=True)
+
+    # In packed mode strings are grouped by token budget and each group is one
+    # request per round; otherwise every string is a group of its own
+    if packed_batch_size > 0:
+        groups = [
+            [pending[j] for j in batch]
+            for batch in make_batches([strings[i] for i in pending], packed_batch_size, packed_batch_tokens)
+        ]
+        print(f"\n{Fore.CYAN}Compressing {len(pending)} strings in {len(groups)} packed batch(es) with up to {max_workers} concurrent request(s)...")
+    else:
+        groups = [[i] for i in pending]
+        print(f"\n{Fore.CYAN}Compressing {len(pending)} strings with up to {max_workers} concurrent request(s)...")
+
+    # Strings are compressed concurrently; results are stored by source index so
+    # the output stays aligned with the extracted positions.
+    def compress_group(group):
+        # Groups that would start after the budget ran out keep their original text
+        if budget.exhausted():
+            budget.skip(len(group))
+            return None
+        if packed_batch_size > 0:
+            return compress_packed_strings(
+                [strings[i] for i in group], format_name, expert_field, style_guide, use_emojis, model, compression_level,
+                temperature, rate_limiter, sampling, refine
+            )
+        return [compress_single_string(
+            strings[group[0]], format_name, expert_field, style_guide, use_emojis, model, compression_level,
+            temperature, rate_limiter, sampling, refine
+        )]
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        futures = {executor.submit(compress_group, group): group for group in groups}
+        for future in as_completed(futures):
+            group = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                # Strings whose requests still fail after their retries keep their original text
+                logging.warning(f"Compression failed for {len(group)} strings, keeping the originals: {str(e)}")
+                controller.count('failed_strings', len(group))
+                results = None
+            if results is None:
+                for i in group:
+                    compressed_strings[i] = strings[i]
+                continue
+            for i, (shortest_compressed, attempts, discarded) in zip(group, results):
+                compressed_strings[i] = shortest_compressed
+                compression_attempts[i] = attempts
+                candidates_discarded[i] = discarded
+                metrics.record_attempts(attempts)
+                # A result finished after the budget ran out may have been cut
+                # short, so it is not cached as the answer for these settings
+                if cache is not None and not budget.exhausted():
+                    cache.put(cache_keys[i], 'compress', shortest_compressed)
+                completed += 1
+                print_compression_result(completed, len(strings), i, strings[i], shortest_compressed, attempts, compression_level)
+    except BaseException:
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    return compressed_strings, compression_attempts, candidates_discarded
+
+def compress_strings(strings, format_name, expert_field, style_guide, use_emojis, model, compression_level, temperature, max_workers=1, rate_limiter=None, cache=None, run_stats=None,
+                     sampling='sequential', refine=False, packed_batch_size=0, packed_batch_tokens=1000):
+    # Compress each distinct string once and fan the result out to every occurrence,
+    # so repeated text costs one set of calls and always gets the same wording.
+    # Strings that differ only in their placeholders count as one template, which
+    # is compressed with numbered markers in place of the slots.
+    masked, unique_strings, unique_index = deduplicate_templates(strings)
+    if len(unique_strings) < len(strings):
+        print(f"\n{Fore.GREEN}{len(strings)} strings contain {len(unique_strings)} unique values.")
+
+    compressed_unique, attempts_unique, discarded_unique = compress_unique_strings(
+        unique_strings, format_name, expert_field, style_guide, use_emojis, model, compression_level, temperature,
+        max_workers=max_workers, rate_limiter=rate_limiter, cache=cache, sampling=sampling, refine=refine,
+        packed_batch_size=packed_batch_size, packed_batch_tokens=packed_batch_tokens
+    )
+
+    # Each template is expanded with its member's own placeholders, and any result
+    # that lost or gained a placeholder is replaced by the original before writing
+    compressed_strings = []
+    placeholder_mismatches = 0
+    for string, (_, placeholders), j in zip(strings, masked, unique_index):
+        compressed = unmask_placeholders(compressed_unique[j], placeholders) if placeholders else compressed_unique[j]
+        if not placeholders_match(string, compressed):
+            logging.warning(f"Placeholders changed in compressed string, keeping the original: {string[:100]}")
+            compressed = string
+            placeholder_mismatches += 1
+        compressed_strings.append(compressed)
+    # Attempts are credited to the first occurrence only; duplicates made no calls
+    compression_attempts = [0] * len(strings)
+    credited = set()
+    for i, j in enumerate(unique_index):
+        if j not in credited:
+            credited.add(j)
+            compression_attempts[i] = attempts_unique[j]
+
+    if run_stats is not None:
+        run_stats['total_strings'] = len(strings)
+        run_stats['unique_strings'] = len(unique_strings)
+        run_stats['calls_saved'] = sum(attempts_unique[j] for j in unique_index) - sum(attempts_unique)
+        run_stats['candidates_discarded'] = sum(discarded_unique)
+        run_stats['template_strings'] = sum(1 for _, placeholders in masked if placeholders)
+        run_stats['templates'] = len({unique_index[i] for i, (_, placeholders) in enumerate(masked) if placeholders})
+        run_stats['placeholder_mismatches'] = placeholder_mismatches
+
+    total_original_length = sum(len(string) for string in strings)
+    total_compressed_length = sum(len(string) for string in compressed_strings)
+
     return compressed_strings, compression_attempts, total_original_length, total_compressed_length
 
 def calculate_stats(original_content, compressed_content, compression_attempts, start_time, end_time, total_original_length, total_compressed_length):
-    original_size = len(original_content.encode('utf-8'))
-    compressed_size = len(compressed_content.encode('utf-8'))
-    compression_ratio = (1 - compressed_size / original_size) * 100
+    return summarize_stats(
+        len(original_content.encode('utf-8')), len(compressed_content.encode('utf-8')),
+        len(compression_attempts), sum(compression_attempts),
+        start_time, end_time, total_original_length, total_compressed_length
+    )
+
+def summarize_stats(original_size, compressed_size, string_count, total_attempts, start_time, end_time, total_original_length, total_compressed_length):
+    compression_ratio = (1 - compressed_size / original_size) * 100 if original_size > 0 else 0
 
     text_compression_ratio = (1 - total_compressed_length / total_original_length) * 100 if total_original_length > 0 else 0
 
-    avg_original_len = total_original_length / len(compression_attempts) if compression_attempts else 0
-    avg_compressed_len = total_compressed_length / len(compression_attempts) if compression_attempts else 0
-    avg_compression_attempts = sum(compression_attempts) / len(compression_attempts) if compression_attempts else 0
+    avg_original_len = total_original_length / string_count if string_count else 0
+    avg_compressed_len = total_compressed_length / string_count if string_count else 0
+    avg_compression_attempts = total_attempts / string_count if string_count else 0
 
     total_time = end_time - start_time
-    avg_time_per_string = total_time / len(compression_attempts) if compression_attempts else 0
+    avg_time_per_string = total_time / string_count if string_count else 0
 
     return {
         'original_size': original_size,
@@ -250,88 +1508,572 @@ def display_stats(stats):
     print(f"{Fore.BLUE}Avg compressed length: {stats['avg_compressed_len']:.2f} characters")
     print(f"{Fore.YELLOW}Total processing time: {stats['total_time']:.2f} seconds")
     print(f"{Fore.YELLOW}Avg time per string:   {stats['avg_time_per_string']:.4f} seconds")
+    if 'unique_strings' in stats:
+        print(f"{Fore.CYAN}Unique / total strings: {stats['unique_strings']} / {stats['total_strings']} ({stats['calls_saved']} calls saved)")
+    if 'candidates_discarded' in stats:
+        print(f"{Fore.CYAN}Candidates discarded:  {stats['candidates_discarded']}")
+    if stats.get('template_strings'):
+        print(f"{Fore.CYAN}Placeholder templates: {stats['templates']} for {stats['template_strings']} strings")
+    if stats.get('placeholder_mismatches'):
+        print(f"{Fore.YELLOW}Placeholder mismatches: {stats['placeholder_mismatches']} strings kept as they were")
+    if 'cache_hits' in stats:
+        print(f"{Fore.CYAN}Cache hits / misses:   {stats['cache_hits']} / {stats['cache_misses']}")
+    if 'prefilter_skipped' in stats:
+        print(f"{Fore.CYAN}Local rules:           {stats['prefilter_skipped']} skipped, {stats['prefilter_compressed']} compressed "
+              f"({stats['prefilter_calls_avoided']} classification calls avoided)")
+    if stats.get('journal_reused'):
+        print(f"{Fore.CYAN}Results from journal:  {stats['journal_reused']}")
     print(f"{Fore.YELLOW}{'='*40}")
 
-def replace_strings_in_content_by_positions(content, positions, original_strings, compressed_strings):
-    new_content = content
-    offset = 0  # Offset due to length changes
-
-    for (start, end), original, compressed in zip(positions, original_strings, compressed_strings):
-        adjusted_start = start + offset
-        adjusted_end = end + offset
-
-        # Extract the original string (including quotes)
-        original_string_with_quotes = new_content[adjusted_start:adjusted_end]
-        quote_char = original_string_with_quotes[0]  # Either ' or "
-
-        # Clean up the compressed string
-        compressed_unescaped = compressed.strip()
-
-        # Escape necessary characters
-        compressed_escaped = compressed_unescaped.replace('\\', '\\\\').replace(quote_char, f'\\{quote_char}')
-
-        # Reconstruct the string with the original quote character
-        replaced_string = f"{quote_char}{compressed_escaped}{quote_char}"
-
-        # Replace the original string with the compressed string
-        new_content = new_content[:adjusted_start] + replaced_string + new_content[adjusted_end:]
-
-        # Update offset
-        offset += len(replaced_string) - (adjusted_end - adjusted_start)
-
-    return new_content
+def display_controller_stats(stats):
+    # Printed once process_file has added the request controller's figures
+    if stats.get('failed_strings'):
+        print(f"{Fore.YELLOW}{stats['failed_strings']} strings kept their original text after failed requests.")
+    if 'concurrency_limit' in stats:
+        print(f"{Fore.CYAN}Concurrency:           limit {stats['concurrency_limit']} (peak {stats['concurrency_peak']}), "
+              f"{stats['increases']} increases, {stats['decreases']} decreases, {stats['holds']} holds")
+    if stats.get('hedges'):
+        print(f"{Fore.CYAN}Hedged requests:       {stats['hedges']} sent, {stats['hedge_wins']} answered first")
+    if stats.get('timeouts'):
+        print(f"{Fore.YELLOW}Timed-out requests:    {stats['timeouts']}")
+
+def display_metrics(summary):
+    print(f"\n{Fore.CYAN}{Style.BRIGHT}Run Metrics:{Style.RESET_ALL}")
+    print(f"{Fore.YELLOW}{'='*40}")
+    for name, seconds in summary['phases_seconds'].items():
+        print(f"{Fore.GREEN}{name.capitalize() + ' phase:':<22} {seconds:.2f} seconds")
+    for model, entry in summary['models'].items():
+        latency = entry['latency_seconds']
+        print(f"{Fore.BLUE}{model}: {entry['requests']} requests, {entry['errors']} errors, "
+              f"{entry['prompt_tokens']:,} prompt / {entry['completion_tokens']:,} completion tokens")
+        print(f"{Fore.BLUE}  latency p50 / p95 / p99: {latency['p50']:.3f} / {latency['p95']:.3f} / {latency['p99']:.3f} seconds")
+    print(f"{Fore.MAGENTA}Retries after rate limits or timeouts: {summary['retries']}")
+    if summary['attempts']['strings']:
+        print(f"{Fore.MAGENTA}Avg attempts per string: {summary['attempts']['mean']:.2f}")
+    print(f"{Fore.YELLOW}{'='*40}")
 
-def extract_strings_with_positions(content, format_name, model, temperature):
+def render_replacement(original_string_with_quotes, compressed, format_name=None):
+    if format_name == 'YAML':
+        return render_yaml_scalar(original_string_with_quotes, compressed.strip())
+    if format_name == 'JSON' and original_string_with_quotes.startswith('"'):
+        return json.dumps(compressed.strip(), ensure_ascii=False)
+    if format_name in JAVASCRIPT_FORMATS:
+        return render_javascript_literal(original_string_with_quotes, compressed.strip())
+    if format_name == 'Prose':
+        # Sentences and paragraphs are plain text without delimiters
+        return compressed.strip()
+
+    quote_char = original_string_with_quotes[0]  # Either ' or "
+
+    # Plain text has no escaping rules of its own, so the text is written as it
+    # came, with escape pairs kept and only quotes that would end it early
+    # escaped; in single quotes an apostrophe before a letter or digit does not
+    text = compressed.strip()
+    closing = quote_char if quote_char == '"' else r"'(?![^\W_])"
+    escaped = re.sub(r'\\.|' + closing, lambda match: match.group(0) if len(match.group(0)) == 2 else f'\\{quote_char}', text)
+    if (len(escaped) - len(escaped.rstrip('\\'))) % 2:
+        escaped += '\\'
+
+    # Reconstruct the string with the original quote character
+    return f"{quote_char}{escaped}{quote_char}"
+
+def render_javascript_literal(original, text):
+    # Writes text back in the form of the literal it replaces: a quoted string, a
+    # template literal, or JSX text
+    if original[0] in '"\'':
+        quote_char = original[0]
+        # Switching quotes avoids backslashes, which JSX attribute strings do not support
+        if quote_char in text and ('"' if quote_char == "'" else "'") not in text:
+            quote_char = '"' if quote_char == "'" else "'"
+        escaped = text.replace('\\', '\\\\').replace(quote_char, f'\\{quote_char}')
+        escaped = escaped.replace('\r', '\\r').replace('\n', '\\n').replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+        return f"{quote_char}{escaped}{quote_char}"
+    if original[0] == '`':
+        return '`' + text.replace('\\', '\\\\').replace('`', '\\`').replace('${', '\\${') + '`'
+    # JSX text cannot contain braces or angle brackets; wrap it in an expression if it does
+    if any(char in text for char in '{}<>'):
+        return '{' + json.dumps(text, ensure_ascii=False) + '}'
+    return text
+
+def iter_replaced_segments(content, positions, original_strings, compressed_strings, format_name=None):
+    # Yields the rewritten content as a sequence of segments in a single pass
+    # over the spans, so no intermediate copies of the whole content are made
+    replacements = sorted(zip(positions, original_strings, compressed_strings), key=lambda item: item[0])
+    cursor = 0
+    previous_span = None
+    for (start, end), original, compressed in replacements:
+        if (start, end) == previous_span:
+            # The same literal can only be rewritten once
+            continue
+        if start < cursor:
+            raise ValueError(f"Replacement span {start}-{end} overlaps the span ending at {cursor}")
+        yield content[cursor:start]
+        if compressed == original:
+            # Strings left as they were keep their literal byte for byte
+            yield content[start:end]
+        else:
+            yield render_replacement(content[start:end], compressed, format_name)
+        cursor = end
+        previous_span = (start, end)
+    yield content[cursor:]
+
+def replace_strings_in_content_by_positions(content, positions, original_strings, compressed_strings, format_name=None):
+    return ''.join(iter_replaced_segments(content, positions, original_strings, compressed_strings, format_name))
+
+def write_strings_in_content_by_positions(output, content, positions, original_strings, compressed_strings, format_name=None,
+                                          sample_length=100):
+    # Streams the rewritten content to a file object, so it never exists as one
+    # string; returns its size in UTF-8 bytes and its first sample_length characters
+    size = 0
+    sample = ''
+    for segment in iter_replaced_segments(content, positions, original_strings, compressed_strings, format_name):
+        output.write(segment)
+        size += len(segment) if segment.isascii() else len(segment.encode('utf-8'))
+        if len(sample) < sample_length:
+            sample += segment[:sample_length - len(sample)]
+    return size, sample
+
+def extract_strings_with_positions(content, format_name, model, temperature, rate_limiter=None,
+                                   batch_size=50, batch_token_budget=2000, max_workers=1, cache=None, exclude_keys=(), prefilter=None,
+                                   prose_unit='sentences'):
     # Extract all strings and positions
-    if format_name == 'JavaScript':
-        strings, positions = extract_strings_from_javascript(content)
-    elif format_name == 'JSON':
-        strings, positions = extract_strings_from_json(content)
-    elif format_name == 'YAML':
-        strings, positions = extract_strings_from_yaml(content)
-    else:
-        strings, positions = extract_strings_with_regex(content)
+    with metrics.phase('extract'):
+        if format_name == 'Prose':
+            strings, positions = extract_prose_segments(content, prose_unit)
+        elif format_name in JAVASCRIPT_FORMATS:
+            strings, positions = extract_strings_from_javascript(content, jsx=format_name != 'TypeScript')
+        elif format_name == 'JSON':
+            strings, positions = extract_strings_from_json(content, exclude_keys)
+        elif format_name == 'YAML':
+            strings, positions = extract_strings_from_yaml(content)
+        else:
+            strings, positions = extract_strings_with_regex(content)
     
     original_strings = strings.copy()
     original_positions = positions.copy()
     
     # Use AI to decide which strings to compress
+    with metrics.phase('classify'):
+        decisions = classify_strings(
+            strings, format_name, model, temperature,
+            batch_size=batch_size,
+            batch_token_budget=batch_token_budget,
+            max_workers=max_workers,
+            rate_limiter=rate_limiter,
+            cache=cache,
+            prefilter=prefilter
+        )
     filtered_strings = []
     filtered_positions = []
-    for string, position in zip(strings, positions):
-        if decide_to_compress(string, format_name, model, temperature):
+    for string, position, decision in zip(strings, positions, decisions):
+        if decision:
             filtered_strings.append(string)
             filtered_positions.append(position)
     return original_strings, original_positions, filtered_strings, filtered_positions
 
 def extract_strings_with_regex(content):
-    # Fallback function using regex
-    string_matches = list(re.finditer(r'(["\'])(?:(?=(\\?))\2.)*?\1', content))
+    # Fallback for plain text and for JSON or YAML that does not parse
     strings = []
     positions = []
-    for match in string_matches:
-        full_match = match.group(0)
-        quote_char = full_match[0]
-        string_content = full_match[1:-1]
+    for string_content, span in find_quoted_strings(content):
         if not string_content.isdigit():
             strings.append(string_content)
-            positions.append(match.span())
+            positions.append(span)
+    return strings, positions
+
+def decode_quoted_literal(literal):
+    # Value of a quoted JSON or YAML string found by the fallback scanner: double
+    # quotes use JSON escapes, single quotes have none
+    if literal[0] == '"':
+        try:
+            return json.loads(literal)
+        except ValueError:
+            return None
+    return literal[1:-1]
+
+def extract_decoded_strings(content):
+    # Fallback for JSON and YAML that does not parse; values are decoded so they
+    # render like the ones the parsers yield. A double-quoted span across lines
+    # is not valid JSON and is left alone.
+    strings = []
+    positions = []
+    for _, (start, end) in find_quoted_strings(content):
+        value = decode_quoted_literal(content[start:end])
+        if value is not None and not value.isdigit():
+            strings.append(value)
+            positions.append((start, end))
+    return strings, positions
+
+QUOTE_START_PATTERN = re.compile(r'["\']')
+# Unrolled loops: the runs of plain characters and the separators (escapes, a
+# line break not followed by a blank line, and for single quotes an apostrophe
+# before a letter or digit) can never match the same text, so a string that
+# does not close fails without backtracking
+QUOTED_STRING_PATTERNS = {
+    '"': re.compile(r'"[^"\\\n]*(?:(?:\\[\s\S]|\n(?![ \t]*\r?\n))[^"\\\n]*)*"'),
+    "'": re.compile(r"'[^'\\\n]*(?:(?:\\[\s\S]|\n(?![ \t]*\r?\n)|'(?=[^\W_]))[^'\\\n]*)*'(?![^\W_])"),
+}
+BLANK_LINE_PATTERN = re.compile(r'[ \t]*\r?\n')
+PARAGRAPH_END_PATTERN = re.compile(r'\n[ \t]*\r?\n|$')
+
+def find_quoted_strings(content):
+    # Yields (text, (start, end)) for every single- or double-quoted string that
+    # closes within its paragraph, so it may span lines but not a blank line;
+    # backslash escapes are kept in the text. An escaped quote never opens a
+    # string, and neither does a quote after a letter or digit, which is an
+    # apostrophe or the end of a quotation. A string that does not close leaves no quote of its kind
+    # that could open one before the end of the paragraph, so those quotes are
+    # skipped rather than paired with each other, and the scan stays linear.
+    blocked = {'"': 0, "'": 0}
+    i = 0
+    while True:
+        match = QUOTE_START_PATTERN.search(content, i)
+        if match is None:
+            return
+        start = match.start()
+        quote = content[start]
+        i = start + 1
+        if start < blocked[quote]:
+            continue
+        escape_start = start
+        while escape_start and content[escape_start - 1] == '\\':
+            escape_start -= 1
+        if (start - escape_start) % 2 or start and content[start - 1].isalnum():
+            continue
+        match = QUOTED_STRING_PATTERNS[quote].match(content, start)
+        if match is None:
+            blocked[quote] = PARAGRAPH_END_PATTERN.search(content, start).end()
+            continue
+        yield content[start + 1:match.end() - 1], match.span()
+        i = match.end()
+
+SENTENCE_END_PATTERN = re.compile(r'[.!?…]+["\'”’)\]]*(?=\s+["\'“‘(\[]?[A-Z0-9]|\s*$)')
+CODE_FENCE_PATTERN = re.compile(r'\s*(?:```|~~~)')
+PROSE_RULE_PATTERN = re.compile(r'\s*(?:[-=*_]\s*){3,}$')
+PROSE_MARKER_PATTERN = re.compile(r'\s*(?:#{1,6}|[-*+>]|\d+[.)])[ \t]+')
+
+def split_sentences(text, offset=0):
+    # Yields (sentence, (start, end)) for each sentence of a paragraph; a sentence
+    # ends at terminal punctuation followed by a capital, a digit or the end
+    start = 0
+    for match in SENTENCE_END_PATTERN.finditer(text):
+        sentence_start = start + len(text[start:match.end()]) - len(text[start:match.end()].lstrip())
+        if sentence_start < match.end():
+            yield text[sentence_start:match.end()], (offset + sentence_start, offset + match.end())
+        start = match.end()
+    tail = text[start:]
+    if tail.strip():
+        sentence_start = start + len(tail) - len(tail.lstrip())
+        sentence_end = start + len(tail.rstrip())
+        yield text[sentence_start:sentence_end], (offset + sentence_start, offset + sentence_end)
+
+def prose_units(paragraph, offset, unit):
+    if not paragraph.strip():
+        return
+    if unit == 'paragraphs':
+        start = len(paragraph) - len(paragraph.lstrip())
+        end = len(paragraph.rstrip())
+        yield paragraph[start:end], (offset + start, offset + end)
+    else:
+        yield from split_sentences(paragraph, offset)
+
+def find_prose_segments(lines, unit='sentences'):
+    # Yields (text, (start, end)) for every sentence or paragraph of unquoted text
+    # read line by line. Blank lines and rules end a paragraph, headings and list
+    # items are paragraphs of their own without their markers, and fenced code
+    # blocks are left out.
+    offset = 0
+    paragraph = []
+    paragraph_start = 0
+    in_fence = False
+    heading = False
+    for line in lines:
+        fence = CODE_FENCE_PATTERN.match(line)
+        text = not fence and not in_fence and line.strip() and not PROSE_RULE_PATTERN.match(line)
+        marker = PROSE_MARKER_PATTERN.match(line) if text else None
+        if paragraph and (not text or marker or heading):
+            yield from prose_units(''.join(paragraph), paragraph_start, unit)
+            paragraph = []
+        if fence:
+            in_fence = not in_fence
+        elif text:
+            if not paragraph:
+                paragraph_start = offset + (marker.end() if marker else 0)
+            paragraph.append(line[marker.end():] if marker else line)
+            heading = bool(marker) and marker.group(0).lstrip().startswith('#')
+        offset += len(line)
+    if paragraph:
+        yield from prose_units(''.join(paragraph), paragraph_start, unit)
+
+def extract_prose_segments(content, unit='sentences'):
+    strings = []
+    positions = []
+    for string, span in find_prose_segments(content.splitlines(keepends=True), unit):
+        strings.append(string)
+        positions.append(span)
+    return strings, positions
+
+def extract_strings_from_javascript(content, jsx=True):
+    strings = []
+    positions = []
+    for string, pos, _ in find_strings_in_javascript(content, jsx):
+        strings.append(string)
+        positions.append(pos)
     return strings, positions
 
-def extract_strings_from_javascript(content):
+def extract_strings_from_javascript_esprima(content):
+    # The previous tokenizer-based extractor, kept to benchmark the scanner against
+    import esprima
     strings = []
     positions = []
     tokens = esprima.tokenize(content, loc=True, range=True)
     for token in tokens:
         if token.type == 'String':
-            # Preserve the original string including quotes
-            value = token.value
-            start = token.range[0]
-            end = token.range[1]
-            strings.append(value)
-            positions.append((start, end))
+            # The token includes its quotes; only the text between them is compressed
+            strings.append(token.value[1:-1])
+            positions.append((token.range[0], token.range[1]))
     return strings, positions
 
+# Words after which a slash starts a regex literal and a < starts JSX
+JS_EXPRESSION_KEYWORDS = frozenset([
+    'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw',
+    'case', 'do', 'else', 'yield', 'await', 'extends',
+])
+# Statement heads whose closing parenthesis is followed by a statement, so a
+# slash there starts a regex literal rather than a division
+JS_STATEMENT_HEAD_KEYWORDS = frozenset(['if', 'while', 'for', 'with'])
+# Words whose string operand is a module specifier, not text
+JS_MODULE_KEYWORDS = frozenset(['import', 'from', 'require'])
+JS_WHITESPACE_PATTERN = re.compile(r'[\s\ufeff]+')
+JS_STRING_PATTERNS = {
+    '"': re.compile(r'"(?:[^"\\\r\n]|\\[\s\S])*"'),
+    "'": re.compile(r"'(?:[^'\\\r\n]|\\[\s\S])*'"),
+}
+JS_TEMPLATE_PATTERN = re.compile(r'(?:[^`\\$]|\\[\s\S]|\$(?!\{))*')
+JS_REGEX_PATTERN = re.compile(r'/(?![*/])(?:[^/\\\[\r\n]|\\.|\[(?:[^\]\\\r\n]|\\.)*\])+/[\w$]*')
+JS_IDENTIFIER_PATTERN = re.compile(r'(?:[\w$\u0080-\uffff]|\\u[0-9a-fA-F]{4})+')
+JS_NUMBER_PATTERN = re.compile(r'\.?[0-9](?:[eE][+-]|[\w.])*')
+JS_ESCAPE_PATTERN = re.compile(r'\\(u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|0(?![0-9])|\r\n|[\s\S])')
+JS_SIMPLE_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v', '0': '\0'}
+JSX_START_PATTERN = re.compile(r'<(?:>|[A-Za-z_$][\w$.:-]*(?=[\s/>{]))')
+JSX_NAME_PATTERN = re.compile(r'/?[\w$.:-]*')
+JSX_TEXT_PATTERN = re.compile(r'[^<{]*')
+
+def decode_javascript_escapes(raw):
+    if '\\' not in raw:
+        return raw
+
+    def replace(match):
+        escape = match.group(1)
+        if escape[0] == 'u' and len(escape) > 1:
+            return chr(int(escape[2:-1] if escape[1] == '{' else escape[1:], 16))
+        if escape[0] == 'x' and len(escape) > 1:
+            return chr(int(escape[1:], 16))
+        if escape in ('\n', '\r', '\r\n', '\u2028', '\u2029'):
+            # Line continuation
+            return ''
+        return JS_SIMPLE_ESCAPES.get(escape, escape)
+
+    decoded = JS_ESCAPE_PATTERN.sub(replace, raw)
+    # Escaped surrogate pairs decode to two halves; join them into one character
+    return decoded.encode('utf-16', 'surrogatepass').decode('utf-16', 'replace')
+
+def find_strings_in_javascript(content, jsx=True):
+    # Single linear pass over JavaScript or TypeScript source that yields
+    # (value, (start, end), kind) for quoted strings and JSX attribute strings
+    # ('string'), template literals without substitutions ('template') and JSX
+    # text ('jsx'). Comments and regex literals are skipped; whether a slash or <
+    # starts a regex or a JSX element is decided from the previous token, as a
+    # tokenizer does. Quoted spans include the quotes and values have their
+    # escapes decoded. JSX spans cover the trimmed text and values have their
+    # whitespace collapsed. Module specifiers are not reported. With jsx=False
+    # (plain .ts files) a < is always an operator or a type bracket.
+    length = len(content)
+    i = 0
+    # Context stack: ['code', open braces, words before open parentheses],
+    # ['template', start, has substitution], ['tag', start, closing, self closing]
+    # and ['children']
+    stack = [['code', 0, []]]
+    expression_allowed = True
+    previous_word = None
+    after_dot = False
+    if content.startswith('#!'):
+        newline = content.find('\n')
+        i = newline if newline != -1 else length
+
+    while i < length:
+        context = stack[-1]
+        kind = context[0]
+
+        if kind == 'code':
+            char = content[i]
+            match = JS_WHITESPACE_PATTERN.match(content, i)
+            if match:
+                i = match.end()
+                continue
+            if content.startswith('//', i):
+                newline = content.find('\n', i)
+                i = newline if newline != -1 else length
+                continue
+            if content.startswith('/*', i):
+                close = content.find('*/', i + 2)
+                i = close + 2 if close != -1 else length
+                continue
+
+            word = None
+            dot = False
+            if char in '"\'':
+                match = JS_STRING_PATTERNS[char].match(content, i)
+                if match is None:
+                    # Unterminated string: skip to the end of the line
+                    newline = content.find('\n', i)
+                    i = newline if newline != -1 else length
+                    continue
+                if previous_word not in JS_MODULE_KEYWORDS:
+                    value = decode_javascript_escapes(content[i + 1:match.end() - 1])
+                    if value.strip():
+                        yield value, match.span(), 'string'
+                i = match.end()
+                expression_allowed = False
+            elif char == '`':
+                stack.append(['template', i, False])
+                i += 1
+            elif char == '/' and expression_allowed:
+                match = JS_REGEX_PATTERN.match(content, i)
+                i = match.end() if match else i + 1
+                expression_allowed = not match
+            elif char == '<' and jsx and expression_allowed and JSX_START_PATTERN.match(content, i):
+                stack.append(['tag', i, False, False])
+            elif char == '{':
+                context[1] += 1
+                i += 1
+                expression_allowed = True
+            elif char == '}':
+                i += 1
+                if context[1] == 0 and len(stack) > 1:
+                    # Closes a template substitution or a JSX expression container
+                    stack.pop()
+                    if stack[-1][0] == 'tag':
+                        expression_allowed = False
+                    continue
+                context[1] -= 1
+                expression_allowed = True
+            elif char.isdigit() or char == '.' and content[i + 1:i + 2].isdigit():
+                i = JS_NUMBER_PATTERN.match(content, i).end()
+                expression_allowed = False
+            elif char == '(':
+                context[2].append(previous_word)
+                i += 1
+                expression_allowed = True
+            elif char == ')':
+                i += 1
+                # The body of if (...), while (...), for (...) and with (...) is a statement
+                expression_allowed = bool(context[2]) and context[2].pop() in JS_STATEMENT_HEAD_KEYWORDS
+            elif char == ']':
+                i += 1
+                expression_allowed = False
+            else:
+                match = JS_IDENTIFIER_PATTERN.match(content, i)
+                if match:
+                    word = match.group(0)
+                    i = match.end()
+                    if after_dot:
+                        # A property name after a dot is never a keyword
+                        word = ''
+                    expression_allowed = word in JS_EXPRESSION_KEYWORDS
+                else:
+                    # Punctuator; an operator is followed by an operand
+                    dot = char == '.'
+                    i += 1
+                    expression_allowed = True
+            after_dot = dot
+            if char != '(':
+                previous_word = word
+            continue
+
+        if kind == 'template':
+            end = JS_TEMPLATE_PATTERN.match(content, i).end()
+            if end >= length:
+                break
+            if content[end] == '`':
+                stack.pop()
+                start = context[1]
+                if not context[2]:
+                    value = decode_javascript_escapes(content[start + 1:end])
+                    if value.strip():
+                        yield value, (start, end + 1), 'template'
+                i = end + 1
+                expression_allowed = False
+                previous_word = None
+            else:
+                # ${ opens a substitution, scanned as code until its closing brace
+                context[2] = True
+                stack.append(['code', 0, []])
+                i = end + 2
+                expression_allowed = True
+            continue
+
+        if kind == 'tag':
+            char = content[i]
+            if i == context[1]:
+                # Tag name, with a leading slash for closing tags
+                name = JSX_NAME_PATTERN.match(content, i + 1)
+                context[2] = name.group(0).startswith('/')
+                i = name.end()
+            elif char in ' \t\r\n':
+                i += 1
+            elif content.startswith('/>', i):
+                context[3] = True
+                i += 1
+            elif char == '>':
+                i += 1
+                stack.pop()
+                if context[2]:
+                    # A closing tag ends the element whose children were open
+                    if stack[-1][0] == 'children':
+                        stack.pop()
+                elif not context[3]:
+                    stack.append(['children'])
+                    continue
+                if stack[-1][0] == 'code':
+                    # The element was an operand
+                    expression_allowed = False
+                    previous_word = None
+                    after_dot = False
+            elif char == '{':
+                stack.append(['code', 0, []])
+                expression_allowed = True
+                previous_word = None
+                i += 1
+            elif char in '"\'':
+                # Attribute strings have no escapes
+                end = content.find(char, i + 1)
+                end = end + 1 if end != -1 else length
+                if content[i + 1:end - 1].strip():
+                    yield content[i + 1:end - 1], (i, end), 'string'
+                i = end
+            else:
+                # Attribute names and =
+                i = max(i + 1, JSX_NAME_PATTERN.match(content, i).end())
+            continue
+
+        # JSX children: text runs until the next element or expression container
+        end = JSX_TEXT_PATTERN.match(content, i).end()
+        text = content[i:end]
+        if text.strip():
+            start = i + len(text) - len(text.lstrip())
+            yield ' '.join(text.split()), (start, i + len(text.rstrip())), 'jsx'
+        if end >= length:
+            break
+        if content[end] == '{':
+            stack.append(['code', 0, []])
+            expression_allowed = True
+            previous_word = None
+            i = end + 1
+        else:
+            stack.append(['tag', end, False, False])
+            i = end
+
 def get_absolute_position(content, line_number, column_number):
     lines = content.split('\n')
     position = sum(len(lines[i]) + 1 for i in range(line_number)) + column_number
@@ -341,57 +2083,294 @@ def is_sentence(text):
     # Returns True if text is at least 12 characters and contains more than one word
     return len(text) >= 12 and len(text.strip().split()) > 1
 
-def extract_strings_from_json(content):
+def extract_strings_from_json(content, exclude_keys=()):
     strings = []
     positions = []
     try:
-        data = json.loads(content)
-        for string, pos in find_strings_in_json(data, content):
+        for string, pos, _, _ in find_strings_in_json(content, exclude_keys):
             if is_sentence(string):
                 strings.append(string)
                 positions.append(pos)
-    except json.JSONDecodeError:
-        # Fallback to regex if JSON is invalid
-        return extract_strings_with_regex(content)
+    except ValueError:
+        # Fall back to the quote scanner if JSON is invalid
+        return extract_decoded_strings(content)
     return strings, positions
 
 def extract_strings_from_yaml(content):
+    import yaml
     strings = []
     positions = []
     try:
-        data = yaml.safe_load(content)
-        for string, pos in find_strings_in_yaml(data, content):
+        for string, pos, _, _ in find_strings_in_yaml(content):
             if is_sentence(string):
                 strings.append(string)
                 positions.append(pos)
     except yaml.YAMLError:
-        # Fallback to regex if YAML is invalid
-        return extract_strings_with_regex(content)
+        # Fall back to the quote scanner if YAML is invalid
+        return extract_decoded_strings(content)
     return strings, positions
 
-def find_strings_in_json(data, content, path=""):
-    if isinstance(data, str):
-        start = content.index(json.dumps(data), 0)
-        end = start + len(json.dumps(data))
-        yield data, (start, end)
-    elif isinstance(data, dict):
-        for key, value in data.items():
-            yield from find_strings_in_json(value, content, f"{path}.{key}")
-    elif isinstance(data, list):
-        for i, item in enumerate(data):
-            yield from find_strings_in_json(item, content, f"{path}[{i}]")
-
-def find_strings_in_yaml(data, content, path=""):
-    if isinstance(data, str):
-        start = content.index(data, 0)
-        end = start + len(data)
-        yield data, (start, end)
-    elif isinstance(data, dict):
-        for key, value in data.items():
-            yield from find_strings_in_yaml(value, content, f"{path}.{key}")
-    elif isinstance(data, list):
-        for i, item in enumerate(data):
-            yield from find_strings_in_yaml(item, content, f"{path}[{i}]")
+JSON_STRING_PATTERN = re.compile(r'"(?:[^"\\\x00-\x1f]|\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4}))*"')
+JSON_SCALAR_PATTERN = re.compile(r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|true|false|null')
+JSON_WHITESPACE_PATTERN = re.compile(r'[ \t\n\r]+')
+JSON_DELIMITER_PATTERN = re.compile(r'[ \t\n\r,\]}]')
+
+def utf8_length(text):
+    return len(text) if text.isascii() else len(text.encode('utf-8'))
+
+def find_strings_in_json(source, exclude_keys=(), chunk_size=1 << 20):
+    # Single-pass JSON scanner. Yields (value, (start, end), (byte_start, byte_end), path)
+    # for every string value, where the spans cover the literal including its quotes
+    # exactly as written in the source. `source` may be a string or a text file
+    # object; files are read in chunks so memory stays bounded by the largest token.
+    read = getattr(source, 'read', None)
+    buffer = '' if read else source
+    eof = read is None
+    base = 0  # Character offset of buffer[0] in the source
+    byte_char = 0  # Buffer index up to which bytes have been counted
+    byte_offset = 0  # Byte offset of buffer[byte_char] in the source
+    pos = 0
+    # Each frame is [container, key or index, state, excluded]
+    stack = []
+    root_done = False
+
+    def fail(message):
+        raise ValueError(f"Invalid JSON at character {base + pos}: {message}")
+
+    def refill():
+        # Reads the next chunk, dropping the already consumed prefix of the buffer
+        nonlocal buffer, eof, base, pos, byte_char, byte_offset
+        chunk = read(chunk_size) if not eof else ''
+        if not chunk:
+            eof = True
+            return
+        byte_offset += utf8_length(buffer[byte_char:pos])
+        base += pos
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        byte_char = 0
+
+    while True:
+        match = JSON_WHITESPACE_PATTERN.match(buffer, pos)
+        if match:
+            pos = match.end()
+        if pos >= len(buffer):
+            if eof:
+                break
+            refill()
+            continue
+
+        char = buffer[pos]
+        frame = stack[-1] if stack else None
+        state = frame[2] if frame else ('end' if root_done else 'value')
+
+        if state == 'end':
+            fail("unexpected data after the top-level value")
+        elif state == 'colon':
+            if char != ':':
+                fail("expected ':'")
+            frame[2] = 'value'
+            pos += 1
+            continue
+        elif state == 'comma_or_end':
+            if char == ',':
+                if frame[0] == 'object':
+                    frame[2] = 'key'
+                else:
+                    frame[1] += 1
+                    frame[2] = 'value'
+                pos += 1
+                continue
+            if char != ('}' if frame[0] == 'object' else ']'):
+                fail("expected ',' or the end of the container")
+            stack.pop()
+            pos += 1
+        elif state in ('key', 'key_or_end'):
+            if char == '}' and state == 'key_or_end':
+                stack.pop()
+                pos += 1
+            elif char == '"':
+                match = JSON_STRING_PATTERN.match(buffer, pos)
+                if not match:
+                    if eof:
+                        fail("invalid object key")
+                    refill()
+                    continue
+                frame[1] = json.loads(match.group(0))
+                frame[2] = 'colon'
+                pos = match.end()
+                continue
+            else:
+                fail("expected an object key")
+        else:
+            # A value is expected: at the top level, after ':' or inside an array
+            if char == ']' and state == 'value_or_end':
+                stack.pop()
+                pos += 1
+            elif char in '{[':
+                excluded = (frame is not None and frame[3]) or \
+                    (frame is not None and frame[0] == 'object' and frame[1] in exclude_keys)
+                if char == '{':
+                    stack.append(['object', None, 'key_or_end', excluded])
+                else:
+                    stack.append(['array', 0, 'value_or_end', excluded])
+                pos += 1
+                continue
+            else:
+                if char == '"':
+                    match = JSON_STRING_PATTERN.match(buffer, pos)
+                    incomplete = not match
+                else:
+                    # A number or literal is only complete once a delimiter follows it
+                    match = JSON_SCALAR_PATTERN.match(buffer, pos)
+                    incomplete = not eof and not JSON_DELIMITER_PATTERN.search(buffer, pos)
+                if incomplete and not eof:
+                    # The token may continue in the next chunk
+                    refill()
+                    continue
+                if not match:
+                    fail("invalid value")
+                start, end = match.span()
+                if char == '"':
+                    excluded = frame is not None and (frame[3] or (frame[0] == 'object' and frame[1] in exclude_keys))
+                    if not excluded:
+                        byte_offset += utf8_length(buffer[byte_char:start])
+                        byte_char = start
+                        literal = match.group(0)
+                        byte_end = byte_offset + utf8_length(literal)
+                        path = ''.join(f"[{item[1]}]" if item[0] == 'array' else f".{item[1]}" for item in stack)
+                        yield json.loads(literal), (base + start, base + end), (byte_offset, byte_end), path
+                pos = end
+
+        # A complete value was consumed
+        if stack:
+            stack[-1][2] = 'comma_or_end'
+        else:
+            root_done = True
+
+    if stack or not root_done:
+        fail("unexpected end of input")
+
+YAML_STR_TAG = 'tag:yaml.org,2002:str'
+
+def iter_yaml_events(content):
+    # Like yaml.parse, but each ScalarEvent also gets the start of its scalar token
+    # as `scalar_start`. The event's own start mark includes any anchor or tag,
+    # which a replacement has to leave in place.
+    import yaml
+
+    class ScalarMarkLoader(yaml.SafeLoader):
+        scalar_start = None
+
+        def get_token(self):
+            token = super().get_token()
+            if isinstance(token, yaml.ScalarToken):
+                self.scalar_start = token.start_mark.index
+            return token
+
+    loader = ScalarMarkLoader(content)
+    try:
+        while loader.check_event():
+            event = loader.get_event()
+            if isinstance(event, yaml.ScalarEvent):
+                start = loader.scalar_start
+                # Empty scalars have no token of their own
+                if start is None or not event.start_mark.index <= start <= event.end_mark.index:
+                    start = event.start_mark.index
+                event.scalar_start = start
+            yield event
+    finally:
+        loader.dispose()
+
+def find_strings_in_yaml(content):
+    # Walks the YAML event stream once and yields (value, (start, end), style, path)
+    # for every string scalar that is a value rather than a mapping key. Spans come
+    # from the scanner marks, so they cover the scalar exactly as written, including
+    # quotes or the block indicator but not its anchor or tag. Multi-document
+    # streams are supported; paths start with the document index. `content` may
+    # also be a text stream, which PyYAML reads incrementally.
+    import yaml
+    resolver = yaml.resolver.Resolver()
+    document_index = -1
+    # Each frame is [kind, key or index, expecting_key, inside_complex_key]
+    stack = []
+
+    def value_done():
+        if not stack:
+            return
+        frame = stack[-1]
+        if frame[0] == 'mapping':
+            # After a complex key the value follows; after a value the next key does
+            frame[2] = frame[2] != 'complex'
+        else:
+            frame[1] += 1
+
+    for event in iter_yaml_events(content):
+        if isinstance(event, yaml.DocumentStartEvent):
+            document_index += 1
+            stack = []
+        elif isinstance(event, (yaml.MappingStartEvent, yaml.SequenceStartEvent)):
+            in_key = bool(stack) and stack[-1][3]
+            if stack and stack[-1][0] == 'mapping' and stack[-1][2] is True:
+                # A collection used as a mapping key; nothing inside it is content
+                stack[-1][1] = None
+                stack[-1][2] = 'complex'
+                in_key = True
+            if isinstance(event, yaml.MappingStartEvent):
+                stack.append(['mapping', None, True, in_key])
+            else:
+                stack.append(['sequence', 0, False, in_key])
+        elif isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+            stack.pop()
+            value_done()
+        elif isinstance(event, yaml.AliasEvent):
+            if stack and stack[-1][0] == 'mapping' and stack[-1][2] is True:
+                stack[-1][1] = None
+                stack[-1][2] = False
+            else:
+                value_done()
+        elif isinstance(event, yaml.ScalarEvent):
+            if stack and stack[-1][0] == 'mapping' and stack[-1][2] is True:
+                stack[-1][1] = event.value
+                stack[-1][2] = False
+                continue
+            tag = event.tag if event.tag not in (None, '!') else resolver.resolve(yaml.ScalarNode, event.value, event.implicit)
+            if tag == YAML_STR_TAG and not (stack and stack[-1][3]):
+                path = f"{document_index}" + ''.join(
+                    f"[{frame[1]}]" if frame[0] == 'sequence' else f".{frame[1]}" for frame in stack
+                )
+                yield event.value, (event.scalar_start, event.end_mark.index), event.style, path
+            value_done()
+
+def render_yaml_scalar(original, text):
+    # Renders text in the same scalar style as the original source literal
+    indicator = original[:1]
+    if indicator == '"':
+        return json.dumps(text, ensure_ascii=False)
+    if indicator == "'":
+        return "'" + text.replace("'", "''") + "'"
+    if indicator in ('|', '>'):
+        header, _, body = original.partition('\n')
+        indent_match = re.search(r'^( +)\S', body, re.MULTILINE)
+        indent = indent_match.group(1) if indent_match else '  '
+        trailing = re.search(r'\s*\Z', original).group(0)
+        # A folded scalar joins single line breaks with spaces, so keep one line per paragraph
+        lines = text.split('\n') if indicator == '|' else text.replace('\n', '\n\n').split('\n')
+        return header + '\n' + '\n'.join(indent + line if line else '' for line in lines) + trailing
+    # Plain scalars stay plain unless the text would change meaning or type unquoted
+    import yaml
+    plain_safe = (
+        text
+        and text == text.strip()
+        and '\n' not in text
+        and ': ' not in text
+        and ' #' not in text
+        and not text.endswith(':')
+        and not any(char in text for char in ',[]{}')
+        and text[0] not in '-?:#&*!|>\'"%@`'
+        and yaml.resolver.Resolver().resolve(yaml.ScalarNode, text, (True, False)) == YAML_STR_TAG
+    )
+    return text if plain_safe else json.dumps(text, ensure_ascii=False)
 
 # Implement the decide_to_compress function using ell
 def decide_to_compress(string, format_name, model, temperature):
@@ -409,117 +2388,565 @@ No intro, no outro, no comments, no explanations, no yapping. Just the answer.
 
 Answer:"""
 
-    # Use the ell library to get a response from the AI model
-    @ell.simple(model=model, max_tokens=1, temperature=temperature)
-    def ell_decide(p):
-        return p
-
-    response = ell_decide(prompt).strip().upper()
+    # Get a response from the AI model
+    response = ai_completion(prompt, model, max_tokens=1, temperature=temperature).strip().upper()
     return response == 'YES'
 
-def main():
-    logging.info("Starting AI Text Copy Compressor")
-    print(f"{Fore.CYAN}{Style.BRIGHT}Welcome to the AI Text Copy Compressor! 🧠✨{Style.RESET_ALL}")
-    
-    # Check for correct number of arguments
-    if len(sys.argv) < 2 or len(sys.argv) > 3:
-        print(f"{Fore.RED}Error: Please provide input file path and optionally output file path.")
-        print(f"{Fore.YELLOW}Usage: python psycho.py <input_file> [output_file]")
-        sys.exit(1)
-    
-    # Obtain input file path
-    input_file = sys.argv[1]
-    
-    # Determine output file path
-    if len(sys.argv) == 3:
-        output_file = sys.argv[2]
-    else:
-        # If no output file is specified, use _output.originalextension format
-        input_name, input_ext = os.path.splitext(input_file)
-        output_file = f"{input_name}_output{input_ext}"
-    
-    logging.info(f"Input file: {input_file}")
-    logging.info(f"Output file: {output_file}")
+# Local rules that settle obvious cases before any model is asked. A skip rule
+# matching means the string is left alone; the prose rule means it is compressed
+# without classification; anything else is ambiguous and goes to the model.
+PREFILTER_PATTERNS = {
+    'url': re.compile(r'^(?:[a-z][a-z0-9+.-]*://|www\.|mailto:)\S*$', re.IGNORECASE),
+    'email': re.compile(r'^[\w.+-]+@[\w-]+(?:\.[\w-]+)+$'),
+    'path': re.compile(r'^(?:[A-Za-z]:)?[~.]{0,2}[\\/]?(?:[\w.@-]+[\\/])+[\w.@-]*$'),
+    'identifier': re.compile(r'^[A-Za-z_$][\w$]*(?:[.:-][\w$]+)*$'),
+    'hex_color': re.compile(r'^#(?:[0-9a-fA-F]{3,4}|[0-9a-fA-F]{6}|[0-9a-fA-F]{8})$'),
+    'datetime': re.compile(r'^\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?)?$'),
+    'mime_type': re.compile(r'^(?:application|audio|font|image|message|model|multipart|text|video)/[\w.+-]+(?:;\s*[\w-]+=[\w.-]+)*$'),
+    'placeholder_only': re.compile(r'^(?:\s*(?:\{\{?\s*[\w.]+\s*\}?\}|%[sd]|\$\{[^}]*\}))+\s*$'),
+}
+CSS_CLASS_PATTERN = re.compile(r'^-?[a-z][a-z0-9]*(?:[-_:/.][a-z0-9]+)*$')
+
+def looks_like_css_classes(string):
+    # Lowercase tokens only, more than half of them hyphenated or prefixed, e.g. "btn mt-2 md:flex"
+    tokens = string.split()
+    if len(tokens) < 2 or not all(CSS_CLASS_PATTERN.match(token) for token in tokens):
+        return False
+    return sum(1 for token in tokens if re.search(r'[-_:/0-9]', token)) * 2 > len(tokens)
+
+def looks_like_prose(string):
+    # Six or more words, nearly all of them made of letters
+    words = string.split()
+    if len(words) < 6:
+        return False
+    alphabetic = sum(1 for word in words if word.strip('.,;:!?"\'()-…').isalpha())
+    return alphabetic >= 0.8 * len(words)
+
+PREFILTER_SKIP_RULES = {
+    'no_letters': lambda string: not any(char.isalpha() for char in string),
+    'short': lambda string: len(string.strip()) < 12,
+    'single_word': lambda string: len(string.split()) < 2,
+    **{name: (lambda pattern: lambda string: bool(pattern.match(string.strip())))(pattern) for name, pattern in PREFILTER_PATTERNS.items()},
+    'css_classes': looks_like_css_classes,
+}
+PREFILTER_COMPRESS_RULES = {
+    'prose': looks_like_prose,
+}
+PREFILTER_RULES = (*PREFILTER_SKIP_RULES, *PREFILTER_COMPRESS_RULES)
+
+class Prefilter:
+    # Applies the local rules and counts what they settled. Rules can be turned
+    # off everywhere ("url") or for one format ("JavaScript:single_word").
+    def __init__(self, disabled=()):
+        self.disabled = set()
+        for entry in disabled:
+            format_name, _, rule = entry.rpartition(':')
+            if rule not in PREFILTER_RULES:
+                raise ValueError(f"Unknown prefilter rule: {rule} (choose from {', '.join(PREFILTER_RULES)})")
+            self.disabled.add((format_name or '*', rule))
+        self.lock = threading.Lock()
+        self.skipped = 0
+        self.compressed = 0
+        self.calls_avoided = 0
+
+    def enabled(self, format_name, rule):
+        return ('*', rule) not in self.disabled and (format_name, rule) not in self.disabled
+
+    def classify(self, string, format_name):
+        # Returns 'skip', 'compress' or 'ambiguous'
+        for rule, matches in PREFILTER_SKIP_RULES.items():
+            if self.enabled(format_name, rule) and matches(string):
+                return 'skip'
+        for rule, matches in PREFILTER_COMPRESS_RULES.items():
+            if self.enabled(format_name, rule) and matches(string):
+                return 'compress'
+        return 'ambiguous'
+
+    def record(self, skipped, compressed, calls_avoided):
+        with self.lock:
+            self.skipped += skipped
+            self.compressed += compressed
+            self.calls_avoided += calls_avoided
+
+def build_prefilter(args):
+    if args.no_prefilter:
+        return None
+    return Prefilter(args.prefilter_disable)
+
+def estimate_tokens(text):
+    # Rough heuristic: about four characters per token for English text
+    return len(text) // 4 + 1
+
+def make_batches(strings, max_items, max_tokens):
+    # Group consecutive indexes so each batch stays within both the item and the token budget
+    batches = []
+    current = []
+    current_tokens = 0
+    for i, string in enumerate(strings):
+        tokens = estimate_tokens(string)
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def generate_classification_batch_prompt(strings, format_name):
+    indexed_strings = "\n".join(f"{i}: {json.dumps(string, ensure_ascii=False)}" for i, string in enumerate(strings))
+    prompt = f"""You are analyzing strings in a {format_name} file to determine if they should be compressed.
+
+Strings (index: JSON-encoded string):
+{indexed_strings}
 
-    # Get model choice
-    model = get_model_choice()
-    logging.info(f"Using model: {model}")
+Instructions:
+- Answer 'YES' for a string that is NOT a value or variable, but a string that is part of the content.
+- Answer 'NO' for a string that is a parameter, not the actual content.
+- Respond with a single JSON object mapping every index to "YES" or "NO", e.g. {{"0": "YES", "1": "NO"}}.
+
+No intro, no outro, no comments, no explanations, no yapping. Just the JSON object.
 
-    # Get creativity level
-    creativity_level = get_creativity_level()
-    temperature = get_temperature(creativity_level)
-    logging.info(f"Creativity level: {creativity_level}, Temperature: {temperature}")
-    print(f"{Fore.MAGENTA}Creativity level set to: {creativity_level} (Temperature: {temperature}) 🎨")
+Answer:"""
+    return prompt
 
-    # Prompt for compression level
-    compression_level_prompt = (
+def parse_classification_response(response, count):
+    match = re.search(r'\{.*\}', response, re.DOTALL)
+    if not match:
+        raise ValueError("No JSON object in classification response")
+    data = json.loads(match.group(0))
+    if not isinstance(data, dict):
+        raise ValueError("Classification response is not a JSON object")
+    decisions = []
+    for i in range(count):
+        value = data.get(str(i))
+        if not isinstance(value, str) or value.strip().upper() not in ('YES', 'NO'):
+            raise ValueError(f"Missing or invalid decision for index {i}")
+        decisions.append(value.strip().upper() == 'YES')
+    return decisions
+
+def decide_to_compress_batch(strings, format_name, model, temperature, rate_limiter=None):
+    if len(strings) == 1:
+        return [call_with_retry(decide_to_compress, strings[0], format_name, model, temperature,
+                                kind='classify', rate_limiter=rate_limiter)]
+
+    prompt = generate_classification_batch_prompt(strings, format_name)
+    max_tokens = 16 + 8 * len(strings)
+    try:
+        response = call_with_retry(ai_completion, prompt, model, max_tokens, temperature, kind='classify_batch',
+                                   rate_limiter=rate_limiter)
+        return parse_classification_response(response, len(strings))
+    except ValueError as e:
+        # Malformed or incomplete output: retry each half separately
+        logging.warning(f"Malformed classification for batch of {len(strings)} strings, splitting: {str(e)}")
+        middle = len(strings) // 2
+        return (decide_to_compress_batch(strings[:middle], format_name, model, temperature, rate_limiter) +
+                decide_to_compress_batch(strings[middle:], format_name, model, temperature, rate_limiter))
+
+def classify_strings(strings, format_name, model, temperature, batch_size=50, batch_token_budget=2000, max_workers=1, rate_limiter=None, cache=None,
+                     prefilter=None):
+    decisions = [False] * len(strings)
+
+    # Only strings that the local rules leave ambiguous and that have no cached
+    # decision are sent to the model
+    pending = []
+    cache_keys = {}
+    settled_locally = []
+    for i, string in enumerate(strings):
+        if prefilter is not None:
+            verdict = prefilter.classify(string, format_name)
+            if verdict != 'ambiguous':
+                decisions[i] = verdict == 'compress'
+                settled_locally.append(i)
+                continue
+        if cache is None:
+            pending.append(i)
+            continue
+        cache_keys[i] = classification_cache_key(string, format_name, model, temperature)
+        cached = cache.get(cache_keys[i])
+        if cached is None:
+            pending.append(i)
+        else:
+            decisions[i] = cached
+
+    batches = [[pending[j] for j in batch] for batch in make_batches([strings[i] for i in pending], batch_size, batch_token_budget)]
+    if prefilter is not None and settled_locally:
+        # Requests the settled strings would have needed on top of the ones still made
+        unfiltered = sorted(pending + settled_locally)
+        calls_avoided = len(make_batches([strings[i] for i in unfiltered], batch_size, batch_token_budget)) - len(batches)
+        compressed = sum(1 for i in settled_locally if decisions[i])
+        prefilter.record(len(settled_locally) - compressed, compressed, calls_avoided)
+        print(f"{Fore.CYAN}Local rules settled {len(settled_locally)} strings ({compressed} to compress).")
+    print(f"{Fore.CYAN}Classifying {len(pending)} strings in {len(batches)} batch(es) ({len(strings) - len(pending) - len(settled_locally)} cached)...")
+
+    def classify_batch(batch_strings):
+        # Batches that would start after the budget ran out are left unclassified
+        if budget.exhausted():
+            budget.skip(len(batch_strings))
+            return None
+        return decide_to_compress_batch(batch_strings, format_name, model, temperature, rate_limiter)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(classify_batch, [strings[i] for i in batch]): batch
+            for batch in batches
+        }
+        for future in as_completed(futures):
+            try:
+                batch_decisions = future.result()
+            except Exception as e:
+                # A batch that still fails after its retries is left uncompressed
+                logging.warning(f"Classification failed for {len(futures[future])} strings, keeping them: {str(e)}")
+                controller.count('failed_strings', len(futures[future]))
+                continue
+            if batch_decisions is None:
+                continue
+            for i, decision in zip(futures[future], batch_decisions):
+                decisions[i] = decision
+                if cache is not None:
+                    cache.put(cache_keys[i], 'classify', decision)
+    return decisions
+
+def get_compression_level():
+    prompt = (
         f"{Fore.YELLOW}Enter compression level (1-5, default 3):\n"
         f"{Fore.LIGHTBLUE_EX}This defines the number of attempts to compress each line. "
         f"Higher levels may result in more aggressive compression but may take longer. 🚀\n"
         f"{Fore.WHITE}Compression level: "
     )
-    compression_level_input = input(compression_level_prompt).strip()
-    if compression_level_input == '':
-        compression_level = 3
-    else:
-        try:
-            compression_level = int(compression_level_input)
-            if compression_level < 1 or compression_level > 5:
-                print(f"{Fore.RED}Invalid compression level. Must be between 1 and 5. Using default level 3.")
-                compression_level = 3
-        except ValueError:
-            print(f"{Fore.RED}Invalid input. Using default compression level 3.")
-            compression_level = 3
-    print(f"{Fore.MAGENTA}Compression level set to: {compression_level} 🔥")
-
-    # Detect format and structure
-    logging.info("Detecting file format and structure")
-    format_name, content = format_detector(input_file, model)
-    logging.info(f"Detected format: {format_name}")
-
-    # Analyze structure if applicable
-    if format_name in ['JSON', 'YAML']:
-        logging.info("Analyzing file structure")
-        structure_prompt = generate_structure_prompt(format_name, content)
-        structure = ai_completion(structure_prompt, model, temperature=temperature)
-        logging.debug(f"Structure analysis result: {structure[:100]}...")
-
-    # Prompt for expert field
-    expert_prompt = (
+    choice = input(prompt).strip()
+    if choice == '':
+        return 3
+    try:
+        compression_level = int(choice)
+        if compression_level < 1 or compression_level > 5:
+            print(f"{Fore.RED}Invalid compression level. Must be between 1 and 5. Using default level 3.")
+            return 3
+        return compression_level
+    except ValueError:
+        print(f"{Fore.RED}Invalid input. Using default compression level 3.")
+        return 3
+
+def get_expert_field():
+    prompt = (
         f"{Fore.YELLOW}Enter the field of expertise for the text (e.g., psychology, medicine, law):\n"
         f"{Fore.LIGHTBLUE_EX}This helps tailor the compression to the specific domain. 🎓\n"
         f"{Fore.WHITE}Enter the field: "
     )
-    expert_field = input(expert_prompt).strip()
-    print(f"{Fore.MAGENTA}Selected field: {expert_field} 📚")
+    return input(prompt).strip()
 
-    # Prompt for optional style guide
-    style_prompt = (
+def get_style_guide():
+    prompt = (
         f"{Fore.YELLOW}Enter any additional style guidelines (optional):\n"
         f"{Fore.LIGHTBLUE_EX}E.g., 'formal', 'casual', 'technical', 'use metaphors'. Press Enter to skip. 🎨\n"
         f"{Fore.WHITE}Style guide: "
     )
-    style_guide = input(style_prompt).strip()
-    if style_guide:
-        print(f"{Fore.MAGENTA}Style guide: {style_guide} 🖋️")
-    else:
-        print(f"{Fore.MAGENTA}No additional style guide provided 🖋️")
+    return input(prompt).strip()
 
-    # Prompt for emoji usage
-    emoji_prompt = (
+def get_emoji_choice():
+    prompt = (
         f"{Fore.YELLOW}Want emojis in compressed text? (y/N):\n"
         f"{Fore.LIGHTBLUE_EX}Emojis can add visual appeal but may affect meaning. 🤔\n"
         f"{Fore.WHITE}Enter your choice: "
     )
-    use_emojis = input(emoji_prompt).strip().lower() == 'y'
-    print(f"{Fore.MAGENTA}Emoji usage: {'Enabled 😊' if use_emojis else 'Disabled 🚫'}")
+    return input(prompt).strip().lower() == 'y'
+
+def resolve_options(args, interactive):
+    # Fills in every option not set on the command line or in the config file,
+    # prompting for it in interactive mode and using the default otherwise
+    if args.model is None:
+        args.model = get_model_choice() if interactive else MODEL_ALIASES['claude']
+    else:
+        args.model = MODEL_ALIASES.get(args.model.lower(), args.model)
+    logging.info(f"Using model: {args.model}")
+
+    if args.creativity is None:
+        args.creativity = get_creativity_level() if interactive else 2
+    args.temperature = get_temperature(args.creativity)
+    logging.info(f"Creativity level: {args.creativity}, Temperature: {args.temperature}")
+    print(f"{Fore.MAGENTA}Creativity level set to: {args.creativity} (Temperature: {args.temperature}) 🎨")
+
+    if args.compression_level is None:
+        args.compression_level = get_compression_level() if interactive else 3
+    print(f"{Fore.MAGENTA}Compression level set to: {args.compression_level} 🔥")
+
+    if args.field is None:
+        args.field = get_expert_field() if interactive else ''
+    print(f"{Fore.MAGENTA}Selected field: {args.field} 📚")
+
+    if args.style is None:
+        args.style = get_style_guide() if interactive else ''
+    if args.style:
+        print(f"{Fore.MAGENTA}Style guide: {args.style} 🖋️")
+    else:
+        print(f"{Fore.MAGENTA}No additional style guide provided 🖋️")
 
-    # Extract strings and positions, using the AI-based filtering
+    if args.emojis is None:
+        args.emojis = get_emoji_choice() if interactive else False
+    print(f"{Fore.MAGENTA}Emoji usage: {'Enabled 😊' if args.emojis else 'Disabled 🚫'}")
+    return args
+
+def load_config(config_path):
+    # Config files are YAML (or JSON) mappings whose keys match the long option
+    # names, e.g. `compression-level: 4` or `compression_level: 4`
+    import yaml
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f) or {}
+    if not isinstance(config, dict):
+        raise ValueError(f"Config file {config_path} must contain a mapping of option names to values")
+    return {str(key).replace('-', '_'): value for key, value in config.items()}
+
+def check_config_value(action, value):
+    # Applies an option's type and choices to its value from a config file, as
+    # argparse does for the command line; raises ValueError on a bad value
+    if action.nargs == 0:
+        if not isinstance(value, bool):
+            raise ValueError("expected true or false")
+        return value
+    if isinstance(action, argparse._AppendAction) or action.nargs in ('*', '+'):
+        return [check_config_item(action, item) for item in (value if isinstance(value, list) else [value])]
+    if value is None and action.default is None:
+        return value
+    return check_config_item(action, value)
+
+def check_config_item(action, value):
+    convert = action.type or str
+    if isinstance(value, str) or convert is float and type(value) is int:
+        try:
+            value = convert(value)
+        except ValueError:
+            raise ValueError(f"expected {convert.__name__}") from None
+    elif not isinstance(value, convert) or isinstance(value, bool):
+        raise ValueError(f"expected {convert.__name__}")
+    if action.choices is not None and value not in action.choices:
+        raise ValueError(f"expected one of {', '.join(map(str, action.choices))}")
+    return value
+
+def default_output_path(input_file):
+    # If no output file is specified, use _output.originalextension format
+    input_name, input_ext = os.path.splitext(input_file)
+    return f"{input_name}_output{input_ext}"
+
+def expand_inputs(paths, output_dir=None):
+    # Resolves files, directories and glob patterns into (input_file, output_file)
+    # pairs. Directories are searched recursively for supported file types, and
+    # previous *_output files and run journals are skipped.
+    jobs = []
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            matches = []
+            for root, _, files in os.walk(path):
+                for name in files:
+                    if os.path.splitext(name)[1] in EXTENSION_FORMATS:
+                        matches.append(os.path.join(root, name))
+            matches.sort()
+            base = path
+        elif glob.has_magic(path):
+            matches = sorted(match for match in glob.glob(path, recursive=True) if os.path.isfile(match))
+            base = None
+        elif os.path.isfile(path):
+            matches = [path]
+            base = None
+        else:
+            raise FileNotFoundError(f"Input not found: {path}")
+
+        for input_file in matches:
+            if os.path.splitext(os.path.basename(input_file))[0].endswith('_output'):
+                continue
+            if input_file.endswith('.journal'):
+                continue
+            if input_file in seen:
+                continue
+            seen.add(input_file)
+            if output_dir:
+                relative = os.path.relpath(input_file, base) if base else os.path.basename(input_file)
+                output_file = os.path.join(output_dir, relative)
+            else:
+                output_file = default_output_path(input_file)
+            jobs.append((input_file, output_file))
+    return jobs
+
+def open_cache(args):
+    if args.no_cache:
+        return None
+    return ResultCache(args.cache_path, int(args.cache_max_mb * 1024 * 1024), args.cache_max_age_days)
+
+def journal_path(output_file):
+    return f"{output_file}.journal"
+
+def open_journal(output_file, args, cache):
+    if args.no_journal:
+        return None
+    output_directory = os.path.dirname(output_file)
+    if output_directory:
+        os.makedirs(output_directory, exist_ok=True)
+    journal = RunJournal(journal_path(output_file), cache, reuse_complete=args.incremental)
+    if journal.resumed_from is not None:
+        print(f"{Fore.CYAN}Reusing {len(journal.entries)} results from the {journal.resumed_from} ({journal.path})")
+    return journal
+
+def estimate_file_cost(input_file, args, cache):
+    # Dry-run plan for one file: extracts every string, consults the cache, and
+    # counts the requests and tokens a run would need without calling any model.
+    # Compression is estimated as if every uncached string is selected, and each
+    # sequential string as if it used all compression_level attempts, so the
+    # figures are upper bounds.
+    format_name = detect_format(input_file, args.prose)
+    with open(input_file, 'r', encoding='utf-8', newline='') as source:
+        strings = [string for string, _ in iter_string_spans(source, format_name, set(args.exclude_key), args.prose)]
+    plan = {'input_file': input_file, 'format': format_name, 'strings': len(strings), 'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+
+    if format_name in ['JSON', 'YAML']:
+        plan['requests'] += 1
+        plan['prompt_tokens'] += estimate_tokens(generate_structure_prompt(format_name, ''))
+        plan['completion_tokens'] += 100
+
+    # Strings the local rules settle cost nothing; skipped ones are not compressed either
+    prefilter = build_prefilter(args)
+    verdicts = [prefilter.classify(string, format_name) if prefilter else 'ambiguous' for string in strings]
+    plan['settled_locally'] = sum(1 for verdict in verdicts if verdict != 'ambiguous')
+    to_classify = [
+        string for string, verdict in zip(strings, verdicts)
+        if verdict == 'ambiguous' and (
+            cache is None or cache.get(classification_cache_key(string, format_name, args.model, args.temperature)) is None
+        )
+    ]
+    strings = [string for string, verdict in zip(strings, verdicts) if verdict != 'skip']
+    batches = make_batches(to_classify, args.classify_batch_size, args.classify_batch_tokens)
+    plan['classify_requests'] = len(batches)
+    for batch in batches:
+        plan['prompt_tokens'] += estimate_tokens(generate_classification_batch_prompt([to_classify[i] for i in batch], format_name))
+        plan['completion_tokens'] += 4 * len(batch)
+
+    # Compression runs on placeholder-masked templates, which are also what the cache is keyed on
+    _, unique_strings, _ = deduplicate_templates(strings)
+    plan['unique_strings'] = len(unique_strings)
+    to_compress = [
+        string for string in unique_strings
+        if cache is None or cache.get(compression_cache_key(
+            string, format_name, args.field, args.style, args.emojis, args.model, args.compression_level, args.temperature,
+            args.sampling, args.refine, packed=args.pack_batch_size > 0
+        )) is None
+    ]
+    rounds = args.compression_level + (1 if args.sampling == 'parallel' and args.refine else 0)
+    if args.pack_batch_size > 0:
+        groups = [[to_compress[i] for i in batch] for batch in make_batches(to_compress, args.pack_batch_size, args.pack_batch_tokens)]
+        prompts = [generate_packed_compression_prompt(group, format_name, args.field, args.style, args.emojis) for group in groups]
+    else:
+        groups = [[string] for string in to_compress]
+        prompts = [generate_compression_prompt(string, format_name, args.field, args.style, args.emojis) for string in to_compress]
+    plan['compress_requests'] = len(groups) * rounds
+    for group, prompt in zip(groups, prompts):
+        plan['prompt_tokens'] += estimate_tokens(prompt) * rounds
+        plan['completion_tokens'] += sum(estimate_tokens(string) for string in group) * rounds
+    plan['requests'] += plan['classify_requests'] + plan['compress_requests']
+    return plan
+
+def display_plan(plans, args):
+    requests = sum(plan['requests'] for plan in plans)
+    prompt_tokens = sum(plan['prompt_tokens'] for plan in plans)
+    completion_tokens = sum(plan['completion_tokens'] for plan in plans)
+    # Requests run --concurrency at a time, and no faster than the rate limit allows
+    seconds = requests * args.assumed_latency / args.concurrency
+    if args.requests_per_minute:
+        seconds = max(seconds, requests * 60.0 / args.requests_per_minute)
+
+    print(f"\n{Fore.CYAN}{Style.BRIGHT}Dry Run Plan (no model calls made):{Style.RESET_ALL}")
+    print(f"{Fore.YELLOW}{'='*40}")
+    for plan in plans:
+        print(f"{Fore.GREEN}{plan['input_file']} ({plan['format']}): {plan['strings']} strings, {plan['settled_locally']} settled by local rules, "
+              f"{plan['unique_strings']} unique to compress, "
+              f"{plan['classify_requests']} classification + up to {plan['compress_requests']} compression requests")
+    print(f"{Fore.BLUE}Requests:              up to {requests:,}")
+    print(f"{Fore.BLUE}Prompt tokens:         up to {prompt_tokens:,}")
+    print(f"{Fore.BLUE}Completion tokens:     up to {completion_tokens:,}")
+    print(f"{Fore.YELLOW}Estimated time:        up to {seconds:,.0f} seconds "
+          f"(at {args.assumed_latency:g}s per request, {args.concurrency} concurrent)")
+    if args.token_budget:
+        print(f"{Fore.MAGENTA}Token budget:          {args.token_budget:,}")
+    print(f"{Fore.YELLOW}{'='*40}")
+
+def plan_run(input_files, args):
+    cache = open_cache(args)
+    try:
+        plans = [estimate_file_cost(input_file, args, cache) for input_file in input_files]
+    finally:
+        if cache is not None:
+            cache.close()
+    display_plan(plans, args)
+
+def analyze_structure(format_name, content, model, temperature, rate_limiter):
+    # The analysis is only logged, so a failed request does not stop the run
+    if format_name not in ['JSON', 'YAML'] or budget.exhausted():
+        return
+    logging.info("Analyzing file structure")
+    with metrics.phase('structure'):
+        try:
+            structure_prompt = generate_structure_prompt(format_name, content)
+            structure = call_with_retry(ai_completion, structure_prompt, model, temperature=temperature,
+                                        kind='structure', rate_limiter=rate_limiter)
+        except Exception as e:
+            logging.warning(f"Structure analysis failed: {str(e)}")
+            return
+    logging.debug(f"Structure analysis result: {structure[:100]}...")
+
+def process_file(input_file, output_file, args, rate_limiter, cache):
+    logging.info(f"Input file: {input_file}")
+    logging.info(f"Output file: {output_file}")
+    journal = open_journal(output_file, args, cache)
+    skipped_before = budget.skipped
+    controller_before = controller.stats()
+    try:
+        if should_stream(input_file, args):
+            stats = process_file_streaming(input_file, output_file, args, rate_limiter, cache, journal)
+        else:
+            stats = process_file_in_memory(input_file, output_file, args, rate_limiter, cache, journal)
+    except BaseException:
+        if journal is not None:
+            journal.close()
+            print(f"{Fore.YELLOW}Progress is saved in {journal.path}; rerun the same command to resume.")
+        raise
+    if journal is not None:
+        journal.finish(keep=args.incremental)
+    stats['skipped_by_budget'] = budget.skipped - skipped_before
+    if stats['skipped_by_budget']:
+        print(f"{Fore.YELLOW}Budget reached: {stats['skipped_by_budget']} strings were left as they were.")
+
+    # Controller counters and decisions for this file
+    controller_after = controller.stats()
+    for key in ('failed_strings', 'timeouts', 'hedges', 'hedge_wins', 'increases', 'decreases', 'holds'):
+        stats[key] = controller_after[key] - controller_before[key]
+    if controller.max_concurrency:
+        stats['concurrency_limit'] = controller_after['limit']
+        stats['concurrency_peak'] = controller_after['peak']
+        stats['concurrency_decisions'] = controller.decisions[controller_before['decisions']:controller_after['decisions']]
+    display_controller_stats(stats)
+    return stats
+
+def compress_content(content, format_name, args, rate_limiter, store, prefilter=None, output_file=None):
+    # Extracts, classifies, compresses and replaces the strings of content in
+    # memory. Shared by file runs and the server; returns the new content and
+    # its statistics. With output_file the new content is written there segment
+    # by segment instead, and only its first 100 characters are returned.
+    model = args.model
+    temperature = args.temperature
+
+    # Extract strings and positions, using local rules and then the AI for filtering
     original_strings, original_positions, strings_to_compress, positions_to_compress = extract_strings_with_positions(
         content=content,
         format_name=format_name,
         model=model,
-        temperature=temperature
+        temperature=temperature,
+        rate_limiter=rate_limiter,
+        batch_size=args.classify_batch_size,
+        batch_token_budget=args.classify_batch_tokens,
+        max_workers=args.concurrency,
+        cache=store,
+        exclude_keys=set(args.exclude_key),
+        prefilter=prefilter,
+        prose_unit=args.prose
     )
     num_strings = len(original_strings)
     num_strings_to_compress = len(strings_to_compress)
@@ -531,36 +2958,92 @@ def main():
 
     # Compress strings
     logging.info("Compressing content")
-    compressed_strings, compression_attempts, total_original_length, total_compressed_length = compress_strings(
-        strings=strings_to_compress,
-        format_name=format_name,
-        expert_field=expert_field,
-        style_guide=style_guide,
-        use_emojis=use_emojis,
-        model=model,
-        compression_level=compression_level,
-        temperature=temperature
-    )
+    run_stats = {}
+    with metrics.phase('compress'):
+        compressed_strings, compression_attempts, total_original_length, total_compressed_length = compress_strings(
+            strings=strings_to_compress,
+            format_name=format_name,
+            expert_field=args.field,
+            style_guide=args.style,
+            use_emojis=args.emojis,
+            model=model,
+            compression_level=args.compression_level,
+            temperature=temperature,
+            max_workers=args.concurrency,
+            rate_limiter=rate_limiter,
+            cache=store,
+            run_stats=run_stats,
+            sampling=args.sampling,
+            refine=args.refine,
+            packed_batch_size=args.pack_batch_size,
+            packed_batch_tokens=args.pack_batch_tokens
+        )
 
     # End timing
     end_time = time.time()
 
-    # Replace compressed strings in content
-    logging.info("Replacing strings in content")
-    modified_content = replace_strings_in_content_by_positions(
-        content=content,
-        positions=positions_to_compress,
-        original_strings=strings_to_compress,
-        compressed_strings=compressed_strings
-    )
+    if output_file is not None:
+        # Replacing and writing are one pass, so no second copy of the file is built
+        logging.info(f"Writing compressed content to output file: {output_file}")
+        with metrics.phase('write'):
+            output_directory = os.path.dirname(output_file)
+            if output_directory:
+                os.makedirs(output_directory, exist_ok=True)
+            with open(output_file, 'w', encoding='utf-8') as f:
+                compressed_size, modified_content = write_strings_in_content_by_positions(
+                    f, content, positions_to_compress, strings_to_compress, compressed_strings, format_name
+                )
+        stats = summarize_stats(
+            len(content.encode('utf-8')), compressed_size, len(compression_attempts), sum(compression_attempts),
+            start_time, end_time, total_original_length, total_compressed_length
+        )
+    else:
+        # Replace compressed strings in content
+        logging.info("Replacing strings in content")
+        with metrics.phase('replace'):
+            modified_content = replace_strings_in_content_by_positions(
+                content=content,
+                positions=positions_to_compress,
+                original_strings=strings_to_compress,
+                compressed_strings=compressed_strings,
+                format_name=format_name
+            )
+        stats = calculate_stats(content, modified_content, compression_attempts, start_time, end_time, total_original_length, total_compressed_length)
+    stats.update(run_stats)
+    stats['strings_found'] = num_strings
+    stats['strings_selected'] = num_strings_to_compress
+    if prefilter is not None:
+        stats['prefilter_skipped'] = prefilter.skipped
+        stats['prefilter_compressed'] = prefilter.compressed
+        stats['prefilter_calls_avoided'] = prefilter.calls_avoided
+    return modified_content, stats
+
+def process_file_in_memory(input_file, output_file, args, rate_limiter, cache, journal=None):
+    # Results go through the journal when there is one; it falls back to the cache
+    store = journal if journal is not None else cache
+    model = args.model
+    temperature = args.temperature
 
-    # Write the compressed content to the output file
-    logging.info(f"Writing compressed content to output file: {output_file}")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(modified_content)
+    # Detect format and structure
+    logging.info("Detecting file format and structure")
+    with metrics.phase('read'):
+        format_name, content = format_detector(input_file, model, args.prose)
+    logging.info(f"Detected format: {format_name}")
 
-    # Calculate and display statistics
-    stats = calculate_stats(content, modified_content, compression_attempts, start_time, end_time, total_original_length, total_compressed_length)
+    # Analyze structure if applicable
+    analyze_structure(format_name, content, model, temperature, rate_limiter)
+
+    cache_hits_before = cache.hits if cache is not None else 0
+    cache_misses_before = cache.misses if cache is not None else 0
+    # The compressed content goes straight to the output file; only its start is kept for the sample
+    sample, stats = compress_content(content, format_name, args, rate_limiter, store, build_prefilter(args), output_file)
+
+    # Display statistics
+    if cache is not None:
+        stats['cache_hits'] = cache.hits - cache_hits_before
+        stats['cache_misses'] = cache.misses - cache_misses_before
+    if journal is not None:
+        stats['journal_reused'] = journal.reused
     display_stats(stats)
 
     # Display before and after samples
@@ -570,10 +3053,791 @@ def main():
     print(f"{Fore.GREEN}Before (first 100 characters):")
     print(content[:100])
     print(f"\n{Fore.MAGENTA}After (first 100 characters):")
-    print(modified_content[:100])
+    print(sample)
     print(f"{Fore.YELLOW}{'='*40}")
 
+    return stats
+
+def should_stream(input_file, args):
+    return args.stream or os.path.getsize(input_file) > args.stream_threshold_mb * 1024 * 1024
+
+def quoted_string_spans(text, offset):
+    for string, (start, end) in zip(*extract_strings_with_regex(text)):
+        yield string, (offset + start, offset + end)
+
+def iter_string_spans(source, format_name, exclude_keys=(), prose_unit='sentences'):
+    # Lazily yields (string, (start, end)) for every candidate string in a text stream.
+    # JSON, YAML, prose and the quote scanner read the stream incrementally;
+    # JavaScript still needs the whole content for scanning.
+    if format_name == 'Prose':
+        yield from find_prose_segments(source, prose_unit)
+    elif format_name == 'JSON':
+        for string, span, _, _ in find_strings_in_json(source, exclude_keys):
+            if is_sentence(string):
+                yield string, span
+    elif format_name == 'YAML':
+        for string, span, _, _ in find_strings_in_yaml(source):
+            if is_sentence(string):
+                yield string, span
+    elif format_name in JAVASCRIPT_FORMATS:
+        yield from zip(*extract_strings_from_javascript(source.read(), jsx=format_name != 'TypeScript'))
+    else:
+        # Quoted strings never span a blank line, so paragraphs can be scanned one at a time
+        offset = 0
+        paragraph = []
+        for line in source:
+            paragraph.append(line)
+            if BLANK_LINE_PATTERN.fullmatch(line):
+                yield from quoted_string_spans(''.join(paragraph), offset)
+                offset += sum(map(len, paragraph))
+                paragraph = []
+        yield from quoted_string_spans(''.join(paragraph), offset)
+
+def iter_span_batches(spans, batch_size):
+    batch = []
+    for span in spans:
+        batch.append(span)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def resolve_span_batch(batch, format_name, args, rate_limiter, cache, prefilter=None):
+    # Classifies and compresses one batch of spans; returns the compressed string
+    # (or None when the string is left as is) for every span in the batch
+    strings = [string for string, _ in batch]
+    decisions = classify_strings(
+        strings, format_name, args.model, args.temperature,
+        batch_size=args.classify_batch_size,
+        batch_token_budget=args.classify_batch_tokens,
+        rate_limiter=rate_limiter,
+        cache=cache,
+        prefilter=prefilter
+    )
+    selected = [i for i, decision in enumerate(decisions) if decision]
+    batch_stats = {}
+    compressed_strings, compression_attempts, _, _ = compress_strings(
+        [strings[i] for i in selected], format_name, args.field, args.style, args.emojis, args.model,
+        args.compression_level, args.temperature, rate_limiter=rate_limiter, cache=cache, run_stats=batch_stats,
+        sampling=args.sampling, refine=args.refine,
+        packed_batch_size=args.pack_batch_size, packed_batch_tokens=args.pack_batch_tokens
+    )
+    results = [None] * len(batch)
+    for i, compressed in zip(selected, compressed_strings):
+        results[i] = compressed
+    return results, sum(compression_attempts), batch_stats.get('calls_saved', 0), batch_stats.get('candidates_discarded', 0)
+
+def copy_characters(source, output, count):
+    # Copies count characters in bounded chunks and returns the number of bytes written
+    written = 0
+    while count > 0:
+        chunk = source.read(min(count, 1 << 20))
+        if not chunk:
+            break
+        output.write(chunk)
+        written += utf8_length(chunk)
+        count -= len(chunk)
+    return written
+
+def process_file_streaming(input_file, output_file, args, rate_limiter, cache, journal=None):
+    # Memory-bounded variant of process_file: spans are extracted lazily, resolved
+    # by a sliding window of concurrent batches, and each output segment is written
+    # as soon as every span before it is resolved. The source is read by two
+    # handles, one for extraction and one for copying the text between spans.
+    store = journal if journal is not None else cache
+    prefilter = build_prefilter(args)
+    format_name = detect_format(input_file, args.prose)
+    original_size = os.path.getsize(input_file)
+    print(f"{Fore.CYAN}Streaming {input_file} ({original_size:,} bytes) with a window of {args.window} strings...")
+
+    with open(input_file, 'r', encoding='utf-8', newline='') as f:
+        head = f.read(200000)
+    analyze_structure(format_name, head, args.model, args.temperature, rate_limiter)
+
+    cache_hits_before = cache.hits if cache is not None else 0
+    cache_misses_before = cache.misses if cache is not None else 0
+    batch_size = max(1, min(args.classify_batch_size, args.window))
+    max_pending = max(1, args.window // batch_size)
+    num_strings = 0
+    num_compressed = 0
+    total_attempts = 0
+    calls_saved = 0
+    candidates_discarded = 0
+    total_original_length = 0
+    total_compressed_length = 0
+    compressed_size = 0
+    cursor = 0
+
+    # Write to a temporary file so a failed run never leaves a truncated output behind
+    partial_file = f"{output_file}.partial"
+    output_directory = os.path.dirname(output_file)
+    if output_directory:
+        os.makedirs(output_directory, exist_ok=True)
+
+    # Extraction, classification, compression and writing overlap here, so the
+    # whole pass is timed as a single phase
+    start_time = time.time()
+    with metrics.phase('stream'), \
+            open(input_file, 'r', encoding='utf-8', newline='') as source, \
+            open(input_file, 'r', encoding='utf-8', newline='') as copy_source, \
+            open(partial_file, 'w', encoding='utf-8', newline='') as output, \
+            ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        pending = deque()
+        spans = iter_string_spans(source, format_name, set(args.exclude_key), args.prose)
+        batches = iter_span_batches(spans, batch_size)
+        exhausted = False
+        while pending or not exhausted:
+            # Keep the window full, then write out every resolved batch at its head
+            while not exhausted and len(pending) < max_pending:
+                batch = next(batches, None)
+                if batch is None:
+                    exhausted = True
+                    break
+                pending.append((batch, executor.submit(resolve_span_batch, batch, format_name, args, rate_limiter, store, prefilter)))
+            if not pending:
+                break
+            batch, future = pending.popleft()
+            results, attempts, saved, discarded = future.result()
+            total_attempts += attempts
+            calls_saved += saved
+            candidates_discarded += discarded
+            for (string, (start, end)), compressed in zip(batch, results):
+                num_strings += 1
+                if start < cursor:
+                    raise ValueError(f"Span {start}-{end} overlaps the previous span ending at {cursor}")
+                compressed_size += copy_characters(copy_source, output, start - cursor)
+                original_literal = copy_source.read(end - start)
+                if compressed is None or compressed == string:
+                    segment = original_literal
+                else:
+                    segment = render_replacement(original_literal, compressed, format_name)
+                    num_compressed += 1
+                    total_original_length += len(string)
+                    total_compressed_length += len(compressed)
+                output.write(segment)
+                compressed_size += utf8_length(segment)
+                cursor = end
+        compressed_size += copy_characters(copy_source, output, sys.maxsize)
+    end_time = time.time()
+    os.replace(partial_file, output_file)
+
+    print(f"{Fore.GREEN}Found {num_strings} strings in the file; {num_compressed} were compressed.")
+    stats = summarize_stats(original_size, compressed_size, num_compressed, total_attempts, start_time, end_time, total_original_length, total_compressed_length)
+    stats['total_strings'] = num_compressed
+    stats['calls_saved'] = calls_saved
+    stats['candidates_discarded'] = candidates_discarded
+    if cache is not None:
+        stats['cache_hits'] = cache.hits - cache_hits_before
+        stats['cache_misses'] = cache.misses - cache_misses_before
+    if journal is not None:
+        stats['journal_reused'] = journal.reused
+    if prefilter is not None:
+        stats['prefilter_skipped'] = prefilter.skipped
+        stats['prefilter_compressed'] = prefilter.compressed
+        stats['prefilter_calls_avoided'] = prefilter.calls_avoided
+    display_stats(stats)
+    return stats
+
+# Rate limiter shared by every file handled in a batch worker process
+worker_rate_limiter = None
+
+def init_batch_worker(requests_per_minute, lock, next_slot, semaphore, token_budget, time_budget, spent, started):
+    global worker_rate_limiter, budget
+    worker_rate_limiter = RateLimiter(requests_per_minute, lock=lock, next_slot=next_slot, semaphore=semaphore)
+    budget = RunBudget(token_budget, time_budget, lock=lock, spent=spent, started=started)
+
+def process_file_in_worker(input_file, output_file, args):
+    configure_backend(args)
+    cache = open_cache(args)
+    metrics.reset()
+    try:
+        # Per-string progress from several processes would interleave, so workers
+        # stay silent and the parent reports one line per file
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            stats = process_file(input_file, output_file, args, worker_rate_limiter, cache)
+        return {'input_file': input_file, 'output_file': output_file, 'stats': stats, 'metrics': metrics.snapshot()}
+    except Exception as e:
+        logging.error(f"Error compressing {input_file}: {str(e)}")
+        return {'input_file': input_file, 'output_file': output_file, 'error': str(e), 'metrics': metrics.snapshot()}
+    finally:
+        if cache is not None:
+            cache.close()
+
+def display_batch_summary(results, total_time):
+    succeeded = [result['stats'] for result in results if 'stats' in result]
+    failed = [result for result in results if 'error' in result]
+    original_size = sum(stats['original_size'] for stats in succeeded)
+    compressed_size = sum(stats['compressed_size'] for stats in succeeded)
+    total_original_length = sum(stats['total_original_length'] for stats in succeeded)
+    total_compressed_length = sum(stats['total_compressed_length'] for stats in succeeded)
+
+    print(f"\n{Fore.CYAN}{Style.BRIGHT}Batch Statistics:{Style.RESET_ALL}")
+    print(f"{Fore.YELLOW}{'='*40}")
+    print(f"{Fore.GREEN}Files compressed:      {len(succeeded)} of {len(results)}")
+    print(f"{Fore.GREEN}Original size:         {original_size:,} bytes")
+    print(f"{Fore.GREEN}Compressed size:       {compressed_size:,} bytes")
+    if original_size:
+        print(f"{Fore.MAGENTA}File compression ratio:     {(1 - compressed_size / original_size) * 100:.2f}%")
+    if total_original_length:
+        print(f"{Fore.MAGENTA}Text compression ratio: {(1 - total_compressed_length / total_original_length) * 100:.2f}%")
+    print(f"{Fore.BLUE}Strings compressed:    {sum(stats.get('total_strings', 0) for stats in succeeded)}")
+    print(f"{Fore.BLUE}Model calls saved:     {sum(stats.get('calls_saved', 0) for stats in succeeded)}")
+    print(f"{Fore.BLUE}Candidates discarded:  {sum(stats.get('candidates_discarded', 0) for stats in succeeded)}")
+    if any('prefilter_skipped' in stats for stats in succeeded):
+        print(f"{Fore.CYAN}Local rules:           {sum(stats.get('prefilter_skipped', 0) for stats in succeeded)} skipped, "
+              f"{sum(stats.get('prefilter_compressed', 0) for stats in succeeded)} compressed "
+              f"({sum(stats.get('prefilter_calls_avoided', 0) for stats in succeeded)} classification calls avoided)")
+    skipped = sum(stats.get('skipped_by_budget', 0) for stats in succeeded)
+    if skipped:
+        print(f"{Fore.YELLOW}Skipped by budget:     {skipped} strings")
+    failed_strings = sum(stats.get('failed_strings', 0) for stats in succeeded)
+    if failed_strings:
+        print(f"{Fore.YELLOW}Failed strings:        {failed_strings} kept their original text")
+    hedges = sum(stats.get('hedges', 0) for stats in succeeded)
+    if hedges:
+        print(f"{Fore.CYAN}Hedged requests:       {hedges} sent, {sum(stats.get('hedge_wins', 0) for stats in succeeded)} answered first")
+    timeouts = sum(stats.get('timeouts', 0) for stats in succeeded)
+    if timeouts:
+        print(f"{Fore.YELLOW}Timed-out requests:    {timeouts}")
+    if any('cache_hits' in stats for stats in succeeded):
+        print(f"{Fore.CYAN}Cache hits / misses:   {sum(stats.get('cache_hits', 0) for stats in succeeded)} / {sum(stats.get('cache_misses', 0) for stats in succeeded)}")
+    print(f"{Fore.YELLOW}Total processing time: {total_time:.2f} seconds")
+    print(f"{Fore.YELLOW}{'='*40}")
+    for result in failed:
+        print(f"{Fore.RED}Failed: {result['input_file']}: {result['error']}")
+
+def run_batch(jobs, args):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    workers = max(1, min(args.workers, len(jobs)))
+    print(f"{Fore.CYAN}Compressing {len(jobs)} file(s) across {workers} worker process(es)...")
+    start_time = time.time()
+    results = []
+
+    # Every worker draws from one shared rate limit and in-flight budget; each
+    # returns its metrics so the parent can report the whole run
+    metrics.reset()
+    with multiprocessing.Manager() as manager:
+        initargs = (
+            args.requests_per_minute, manager.Lock(), manager.Value('d', 0.0), manager.BoundedSemaphore(args.concurrency),
+            args.token_budget, args.time_budget, manager.Value('i', 0), manager.Value('d', time.time())
+        )
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker, initargs=initargs) as executor:
+            futures = [executor.submit(process_file_in_worker, input_file, output_file, args) for input_file, output_file in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                metrics.merge(result['metrics'])
+                if 'error' in result:
+                    print(f"{Fore.RED}[{len(results)}/{len(jobs)}] {result['input_file']}: {result['error']}")
+                else:
+                    stats = result['stats']
+                    print(f"{Fore.GREEN}[{len(results)}/{len(jobs)}] {result['input_file']} → {result['output_file']} "
+                          f"({stats['compression_ratio']:.2f}% smaller)")
+
+    display_batch_summary(results, time.time() - start_time)
+    display_metrics(metrics.summary())
+    return results
+
+class FairScheduler:
+    # Shares one in-flight limit and request rate between the server's jobs.
+    # Waiting requests queue per job, and freed slots go to the jobs in turn,
+    # so a large file cannot starve a single-string request submitted after it.
+    def __init__(self, concurrency, requests_per_minute=0):
+        self.concurrency = concurrency
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        self.condition = threading.Condition()
+        self.waiting = {}
+        self.granted = set()
+        self.in_flight = 0
+
+    def acquire(self, job_id):
+        ticket = object()
+        with self.condition:
+            self.waiting.setdefault(job_id, deque()).append(ticket)
+            self.dispatch()
+            while ticket not in self.granted:
+                self.condition.wait()
+            self.granted.remove(ticket)
+        self.rate_limiter.acquire()
+
+    def try_acquire(self, job_id):
+        # Takes a slot only if one is free and no request is queued for it
+        with self.condition:
+            if self.in_flight >= self.concurrency or self.waiting:
+                return False
+            self.in_flight += 1
+        if not self.rate_limiter.try_acquire():
+            self.release()
+            return False
+        return True
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.dispatch()
+
+    def dispatch(self):
+        # Called with the condition held; grants the first waiting request of
+        # the next job and moves that job to the back of the line
+        granted = False
+        while self.in_flight < self.concurrency and self.waiting:
+            job_id = next(iter(self.waiting))
+            tickets = self.waiting.pop(job_id)
+            self.granted.add(tickets.popleft())
+            if tickets:
+                self.waiting[job_id] = tickets
+            self.in_flight += 1
+            granted = True
+        if granted:
+            self.condition.notify_all()
+
+    def for_job(self, job_id):
+        # A RateLimiter-like handle that call_with_retry can use for one job
+        return SimpleNamespace(acquire=lambda: self.acquire(job_id), try_acquire=lambda: self.try_acquire(job_id),
+                               release=self.release)
+
+# Per-request options the server accepts, with the type each must have
+SERVER_JOB_OPTIONS = {
+    'model': str,
+    'creativity': int,
+    'compression_level': int,
+    'field': str,
+    'style': str,
+    'emojis': bool,
+    'sampling': str,
+    'refine': bool,
+    'pack_batch_size': int,
+    'exclude_key': list,
+    'prose': str,
+}
+
+def server_job_args(args, options):
+    # Copies the server's settings and applies the request's own options
+    job_args = argparse.Namespace(**vars(args))
+    if not isinstance(options, dict):
+        raise ValueError("options must be an object")
+    for key, value in options.items():
+        name = key.replace('-', '_')
+        expected = SERVER_JOB_OPTIONS.get(name)
+        if expected is None:
+            raise ValueError(f"Unknown option: {key}")
+        if not isinstance(value, expected) or expected is int and isinstance(value, bool):
+            raise ValueError(f"Option {key} must be of type {expected.__name__}")
+        setattr(job_args, name, value)
+    if job_args.creativity not in range(1, 6) or job_args.compression_level not in range(1, 6):
+        raise ValueError("creativity and compression_level must be between 1 and 5")
+    if job_args.sampling not in ('sequential', 'parallel'):
+        raise ValueError("sampling must be sequential or parallel")
+    if job_args.prose not in (None, 'sentences', 'paragraphs'):
+        raise ValueError("prose must be sentences or paragraphs")
+    job_args.model = MODEL_ALIASES.get(job_args.model.lower(), job_args.model)
+    job_args.temperature = get_temperature(job_args.creativity)
+    return job_args
+
+class CompressionServer:
+    # Keeps the backend, result cache and rate limit warm between requests.
+    # Every request runs in its own thread as one job of the shared scheduler.
+    # Combined with ThreadingHTTPServer by create_server.
+    daemon_threads = True
+
+    def __init__(self, address, args, cache, handler_class):
+        super().__init__(address, handler_class)
+        self.args = args
+        self.cache = cache
+        self.scheduler = FairScheduler(args.concurrency, args.requests_per_minute)
+        self.lock = threading.Lock()
+        self.next_job_id = 0
+        self.active_jobs = 0
+        self.completed_jobs = 0
+        self.failed_jobs = 0
+        self.started = time.time()
+
+    def run_job(self, handler, payload):
+        with self.lock:
+            self.next_job_id += 1
+            job_id = self.next_job_id
+            self.active_jobs += 1
+        try:
+            result = handler(payload, server_job_args(self.args, payload.get('options', {})), self.scheduler.for_job(job_id))
+        except BaseException:
+            with self.lock:
+                self.active_jobs -= 1
+                self.failed_jobs += 1
+            raise
+        with self.lock:
+            self.active_jobs -= 1
+            self.completed_jobs += 1
+        return result
+
+    def compress_file(self, payload, job_args, rate_limiter):
+        content = payload.get('content')
+        if not isinstance(content, str):
+            raise ValueError("content must be a string")
+        format_name = payload.get('format') or detect_format(payload.get('filename') or '', job_args.prose)
+        if format_name not in set(EXTENSION_FORMATS.values()) | {'PlainText', 'Prose'}:
+            raise ValueError(f"Unknown format: {format_name}")
+        modified_content, stats = compress_content(content, format_name, job_args, rate_limiter, self.cache, build_prefilter(job_args))
+        return {'format': format_name, 'content': modified_content, 'stats': stats}
+
+    def compress_strings(self, payload, job_args, rate_limiter):
+        # Strings sent on their own are compressed as given unless the caller
+        # asks for them to be classified first
+        strings = payload.get('strings')
+        if not isinstance(strings, list) or not all(isinstance(string, str) for string in strings):
+            raise ValueError("strings must be a list of strings")
+        format_name = payload.get('format', 'PlainText')
+        selected = list(range(len(strings)))
+        if payload.get('classify'):
+            decisions = classify_strings(
+                strings, format_name, job_args.model, job_args.temperature,
+                batch_size=job_args.classify_batch_size, batch_token_budget=job_args.classify_batch_tokens,
+                max_workers=job_args.concurrency, rate_limiter=rate_limiter, cache=self.cache, prefilter=build_prefilter(job_args)
+            )
+            selected = [index for index, decision in enumerate(decisions) if decision]
+        run_stats = {}
+        compressed_strings, _, total_original_length, total_compressed_length = compress_strings(
+            strings=[strings[index] for index in selected],
+            format_name=format_name,
+            expert_field=job_args.field,
+            style_guide=job_args.style,
+            use_emojis=job_args.emojis,
+            model=job_args.model,
+            compression_level=job_args.compression_level,
+            temperature=job_args.temperature,
+            max_workers=job_args.concurrency,
+            rate_limiter=rate_limiter,
+            cache=self.cache,
+            run_stats=run_stats,
+            sampling=job_args.sampling,
+            refine=job_args.refine,
+            packed_batch_size=job_args.pack_batch_size,
+            packed_batch_tokens=job_args.pack_batch_tokens
+        )
+        results = list(strings)
+        for index, compressed in zip(selected, compressed_strings):
+            results[index] = compressed
+        run_stats.update(total_original_length=total_original_length, total_compressed_length=total_compressed_length)
+        return {'results': results, 'stats': run_stats}
+
+    def health(self):
+        with self.lock:
+            status = {
+                'status': 'ok',
+                'model': self.args.model,
+                'uptime': time.time() - self.started,
+                'active_jobs': self.active_jobs,
+                'completed_jobs': self.completed_jobs,
+                'failed_jobs': self.failed_jobs,
+            }
+        if self.cache is not None:
+            status['cache_hits'] = self.cache.hits
+            status['cache_misses'] = self.cache.misses
+        status['requests'] = controller.stats()
+        return status
+
+class CompressionRequestHandler:
+    # GET /health, GET /metrics, POST /compress/file and POST /compress/strings.
+    # Combined with BaseHTTPRequestHandler by create_server.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, self.server.health())
+        elif self.path == '/metrics':
+            self.send_body(200, metrics.to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4')
+        else:
+            self.send_json(404, {'error': f"Not found: {self.path}"})
+
+    def do_POST(self):
+        handlers = {'/compress/file': self.server.compress_file, '/compress/strings': self.server.compress_strings}
+        if self.path not in handlers:
+            self.send_json(404, {'error': f"Not found: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(payload, dict):
+                raise ValueError("request body must be a JSON object")
+        except ValueError as e:
+            self.send_json(400, {'error': f"Invalid request: {str(e)}"})
+            return
+        try:
+            result = self.server.run_job(handlers[self.path], payload)
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            logging.error(f"Error serving {self.path}: {str(e)}")
+            self.send_json(500, {'error': str(e)})
+        else:
+            self.send_json(200, result)
+
+    def send_json(self, status, body):
+        self.send_body(status, json.dumps(body, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8')
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} {format % args}")
+
+def create_server(address, args, cache):
+    # http.server is only imported for --serve, so the server and handler
+    # classes get their standard library bases here
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    server_class = type('CompressionHTTPServer', (CompressionServer, ThreadingHTTPServer), {})
+    handler_class = type('CompressionHTTPRequestHandler', (CompressionRequestHandler, BaseHTTPRequestHandler), {})
+    return server_class(address, args, cache, handler_class)
+
+def serve(args):
+    cache = open_cache(args)
+    metrics.reset()
+    server = create_server((args.host, args.port), args, cache)
+    host, port = server.server_address[:2]
+    print(f"{Fore.CYAN}Serving textpress on http://{host}:{port} with {args.model} (Ctrl-C to stop)")
+    try:
+        # Progress output from concurrent jobs would interleave, so jobs stay silent
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n{Fore.CYAN}Server stopped.")
+    finally:
+        server.server_close()
+        if cache is not None:
+            cache.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI Text Copy Compressor")
+    parser.add_argument('paths', nargs='*', metavar='PATH',
+                        help="Input file and optional output file, or in batch mode any number of files, directories and glob patterns")
+    parser.add_argument('--batch', action='store_true',
+                        help="Treat every PATH as an input and compress them without prompts")
+    parser.add_argument('--output-dir',
+                        help="Directory for compressed files (default: next to each input as <input_name>_output<extension>)")
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1),
+                        help="Number of worker processes in batch mode (default: up to 4)")
+    parser.add_argument('--serve', action='store_true',
+                        help="Run a local HTTP/JSON server that compresses file content and strings on request")
+    parser.add_argument('--host', default='127.0.0.1', help="Address the server listens on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=8765, help="Port the server listens on (default: 8765, 0 picks a free port)")
+    parser.add_argument('--config', help="YAML or JSON file with default values for any of these options")
+    parser.add_argument('--non-interactive', action='store_true',
+                        help="Never prompt; options that are not given use their defaults")
+    parser.add_argument('--model', help="Model name, or one of: claude (default), chatgpt, llama")
+    parser.add_argument('--creativity', type=int, choices=range(1, 6), help="Creativity level 1-5 (default: 2)")
+    parser.add_argument('--compression-level', type=int, choices=range(1, 6), help="Compression level 1-5 (default: 3)")
+    parser.add_argument('--field', help="Field of expertise for the text, e.g. psychology")
+    parser.add_argument('--style', help="Additional style guidelines, e.g. formal")
+    parser.add_argument('--emojis', action=argparse.BooleanOptionalAction, default=None,
+                        help="Allow emojis in compressed text (default: no)")
+    parser.add_argument('--ell-store', metavar='PATH',
+                        help="Directory where ell records model invocations (default: ./logdir)")
+    parser.add_argument('--no-ell-store', action='store_true',
+                        help="Do not record model invocations; saves a disk write per request")
+    parser.add_argument('--fake-backend', nargs='?', const='', metavar='SPEC',
+                        help="Answer every request with a deterministic local fake instead of a model, "
+                             "e.g. latency=0.2,error_rate=0.01,ratio=0.7,seed=1")
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help="Maximum number of compression requests in flight (default: 4)")
+    parser.add_argument('--requests-per-minute', type=int, default=0,
+                        help="Maximum number of model requests started per minute (default: 0, unlimited)")
+    parser.add_argument('--adaptive-concurrency', action='store_true',
+                        help="Adjust requests in flight between 1 and --concurrency: one more after each healthy window, "
+                             "half as many after a rate limit or timeout")
+    parser.add_argument('--request-timeout', type=float, default=0,
+                        help="Give up on a model request after this many seconds and retry it (default: 0, no timeout)")
+    parser.add_argument('--hedge', action='store_true',
+                        help="Send a duplicate of any request still running after the p95 latency of its kind and keep the first answer")
+    parser.add_argument('--stream', action='store_true',
+                        help="Process the file in a memory-bounded streaming pipeline")
+    parser.add_argument('--stream-threshold-mb', type=float, default=50,
+                        help="Stream files larger than this automatically (default: 50)")
+    parser.add_argument('--window', type=int, default=1000,
+                        help="Maximum number of strings in flight while streaming (default: 1000)")
+    parser.add_argument('--sampling', choices=['sequential', 'parallel'], default='sequential',
+                        help="sequential feeds each compression back for another attempt; parallel requests "
+                             "compression-level candidates at once at varied temperatures (default: sequential)")
+    parser.add_argument('--refine', action='store_true',
+                        help="With --sampling parallel, compress the best candidate once more")
+    parser.add_argument('--pack-batch-size', type=int, default=0,
+                        help="Compress up to this many strings per request as one packed JSON prompt (default: 0, one string per request)")
+    parser.add_argument('--pack-batch-tokens', type=int, default=1000,
+                        help="Approximate token budget for the strings in one packed compression request (default: 1000)")
+    parser.add_argument('--no-prefilter', action='store_true',
+                        help="Send every string to the model for classification instead of settling obvious cases locally")
+    parser.add_argument('--prefilter-disable', action='append', default=[], metavar='[FORMAT:]RULE',
+                        help=f"Turn off a local rule, for all formats or one (e.g. JavaScript:single_word); "
+                             f"may be given multiple times. Rules: {', '.join(PREFILTER_RULES)}")
+    parser.add_argument('--classify-batch-size', type=int, default=50,
+                        help="Maximum number of strings classified per request (default: 50)")
+    parser.add_argument('--classify-batch-tokens', type=int, default=2000,
+                        help="Approximate token budget for the strings in one classification request (default: 2000)")
+    parser.add_argument('--prose', choices=['sentences', 'paragraphs'],
+                        help="Read plain-text files as prose and compress each sentence or paragraph instead of quoted strings")
+    parser.add_argument('--exclude-key', action='append', default=[], metavar='KEY',
+                        help="Skip JSON values under this key; may be given multiple times")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Bypass the persistent result cache for this run")
+    parser.add_argument('--clear-cache', action='store_true',
+                        help="Delete all cached results before running")
+    parser.add_argument('--cache-path', default=DEFAULT_CACHE_PATH,
+                        help=f"Location of the result cache (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument('--cache-max-mb', type=float, default=100,
+                        help="Evict least recently used cache entries above this size (default: 100)")
+    parser.add_argument('--cache-max-age-days', type=float, default=30,
+                        help="Evict cache entries unused for this many days (default: 30)")
+    parser.add_argument('--no-journal', action='store_true',
+                        help="Do not keep a journal of results next to the output file for resuming interrupted runs")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Keep the journal after a successful run and reuse it next time, so only new or changed strings are recompressed")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Estimate requests, tokens and time for the run without calling any model or writing output")
+    parser.add_argument('--assumed-latency', type=float, default=2.0,
+                        help="Seconds per model request assumed by --dry-run (default: 2)")
+    parser.add_argument('--token-budget', type=int, default=0,
+                        help="Stop starting new requests once this many tokens are spent (default: 0, unlimited)")
+    parser.add_argument('--time-budget', type=float, default=0,
+                        help="Stop starting new requests after this many seconds (default: 0, unlimited)")
+    parser.add_argument('--metrics-out', metavar='PATH',
+                        help="Write per-phase timings, request latencies, token counts and retries to PATH")
+    parser.add_argument('--metrics-format', choices=['json', 'prometheus'],
+                        help="Format of --metrics-out (default: prometheus for .prom files, otherwise json)")
+
+    # Values from a config file become the defaults; explicit flags still win
+    known_args, _ = parser.parse_known_args(argv)
+    if known_args.config:
+        config = load_config(known_args.config)
+        unknown_keys = set(config) - set(vars(known_args)) - {'paths'}
+        if unknown_keys:
+            parser.error(f"Unknown option(s) in {known_args.config}: {', '.join(sorted(unknown_keys))}")
+        actions = {action.dest: action for action in parser._actions}
+        for key, value in config.items():
+            try:
+                config[key] = check_config_value(actions[key], value)
+            except ValueError as e:
+                parser.error(f"Invalid value for {key} in {known_args.config}: {value!r} ({e})")
+        parser.set_defaults(**config)
+
+    args = parser.parse_args(argv)
+    if args.serve and args.paths:
+        parser.error("--serve takes no PATH arguments")
+    if not args.serve and not args.paths:
+        parser.error("the following arguments are required: PATH")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.requests_per_minute < 0:
+        parser.error("--requests-per-minute must not be negative")
+    if args.classify_batch_size < 1:
+        parser.error("--classify-batch-size must be at least 1")
+    if args.pack_batch_size < 0:
+        parser.error("--pack-batch-size must not be negative")
+    if args.window < 1:
+        parser.error("--window must be at least 1")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.request_timeout < 0:
+        parser.error("--request-timeout must not be negative")
+    if args.token_budget < 0 or args.time_budget < 0:
+        parser.error("--token-budget and --time-budget must not be negative")
+    try:
+        Prefilter(args.prefilter_disable)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.incremental and args.no_journal:
+        parser.error("--incremental needs the journal; drop --no-journal")
+    # One input file with an optional output file keeps the original single-file mode
+    args.single_file = not args.batch and (
+        len(args.paths) == 1 and os.path.isfile(args.paths[0]) or
+        len(args.paths) == 2 and os.path.isfile(args.paths[0]) and not os.path.isdir(args.paths[1])
+    )
+    return args
+
+def main():
+    global budget
+    logging.info("Starting AI Text Copy Compressor")
+    print(f"{Fore.CYAN}{Style.BRIGHT}Welcome to the AI Text Copy Compressor! 🧠✨{Style.RESET_ALL}")
+    
+    args = parse_args()
+    configure_backend(args)
+
+    if args.clear_cache:
+        cache = ResultCache(args.cache_path, int(args.cache_max_mb * 1024 * 1024), args.cache_max_age_days)
+        cache.clear()
+        cache.close()
+        print(f"{Fore.MAGENTA}Result cache cleared 🧹")
+
+    if args.serve:
+        # The server never prompts; requests may override the resolved options
+        resolve_options(args, interactive=False)
+        serve(args)
+        return
+
+    if not args.single_file:
+        # Batch mode never prompts
+        try:
+            jobs = expand_inputs(args.paths, args.output_dir)
+        except FileNotFoundError as e:
+            print(f"{Fore.RED}Error: {str(e)}")
+            sys.exit(1)
+        if not jobs:
+            print(f"{Fore.RED}Error: No input files found.")
+            sys.exit(1)
+        resolve_options(args, interactive=False)
+        if args.dry_run:
+            plan_run([input_file for input_file, _ in jobs], args)
+            return
+        results = run_batch(jobs, args)
+        if args.metrics_out:
+            metrics.export(args.metrics_out, args.metrics_format)
+            print(f"{Fore.CYAN}Metrics written to {args.metrics_out}")
+        if any('error' in result for result in results):
+            sys.exit(1)
+        return
+
+    # Obtain input file path
+    input_file = args.paths[0]
+
+    # Determine output file path
+    if len(args.paths) == 2:
+        output_file = args.paths[1]
+    elif args.output_dir:
+        output_file = os.path.join(args.output_dir, os.path.basename(input_file))
+    else:
+        output_file = default_output_path(input_file)
+
+    resolve_options(args, interactive=not args.non_interactive)
+    if args.dry_run:
+        plan_run([input_file], args)
+        return
+
+    # Classification and compression requests share one rate limit, in-flight
+    # limit and budget; parallel sampling runs its candidates on nested pools,
+    # so the pools' sizes alone do not bound the requests in flight
+    rate_limiter = RateLimiter(args.requests_per_minute, semaphore=threading.BoundedSemaphore(args.concurrency))
+    budget = RunBudget(args.token_budget, args.time_budget)
+
+    # Open the persistent result cache unless bypassed
+    cache = open_cache(args)
+    metrics.reset()
+    try:
+        process_file(input_file, output_file, args, rate_limiter, cache)
+    except KeyboardInterrupt:
+        print(f"\n{Fore.RED}Interrupted.")
+        sys.exit(130)
+    finally:
+        if cache is not None:
+            cache.close()
+    display_metrics(metrics.summary())
+    if args.metrics_out:
+        metrics.export(args.metrics_out, args.metrics_format)
+        print(f"{Fore.CYAN}Metrics written to {args.metrics_out}")
+
     logging.info("AI Text Copy Compressor completed successfully")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()